@@ -200,6 +200,7 @@ class CloudProviderCollection(BaseCollection):
 @navigator.register(CloudProviderCollection, 'All')
 class All(CFMENavigateStep):
     VIEW = CloudProvidersView
+    DEEP_LINK = True
     prerequisite = NavigateToAttribute('appliance.server', 'LoggedIn')
 
     def step(self):
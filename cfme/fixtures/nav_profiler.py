@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Navigation profiling, see :py:mod:`cfme.utils.nav_profiler`
+
+Usage
+-----
+
+``py.test --nav-profile``
+
+Every process (the slaves when parallelized) dumps its aggregated navigation timing into
+``log/nav_profile/<slave id>.json``. The master (or the only process) merges them at the end of
+the session into:
+
+* ``log/nav_profile.txt``: the slowest destinations, the most repeated prerequisite chains and
+  the tests navigating the longest,
+* ``log/nav_profile.folded``: folded stacks for ``flamegraph.pl`` or speedscope.
+"""
+import pytest
+
+from cfme.fixtures.pytest_store import store
+from cfme.utils.log import logger
+from cfme.utils.nav_profiler import NavigationProfiler, profiler
+from cfme.utils.path import log_path
+
+profile_dir = log_path.join('nav_profile')
+report_path = log_path.join('nav_profile.txt')
+folded_path = log_path.join('nav_profile.folded')
+
+
+class NavProfilerPlugin(object):
+    def pytest_configure(self, config):
+        # cleanup cruft from previous runs
+        if store.parallelizer_role != 'slave':
+            profile_dir.remove(ignore_errors=True)
+        profile_dir.ensure(dir=True)
+        profiler.enabled = True
+
+    @pytest.mark.hookwrapper
+    def pytest_runtest_protocol(self, item):
+        profiler.start_test(item.nodeid)
+        try:
+            yield
+        finally:
+            profiler.finish_test()
+
+    def pytest_sessionfinish(self, exitstatus):
+        if store.parallelizer_role != 'master':
+            profiler.dump(profile_dir.join('{}.json'.format(store.slaveid or 'main')).strpath)
+
+        # for slaves, everything is done at this point
+        if store.parallelizer_role == 'slave':
+            return
+
+        merged = NavigationProfiler()
+        for dump in profile_dir.listdir('*.json'):
+            merged.load(dump.strpath)
+        report_path.write(merged.report())
+        folded_path.write('\n'.join(merged.folded_stacks()))
+        logger.info('Navigation profile written to %s and %s', report_path, folded_path)
+        store.write_line('Navigation profile: {}'.format(report_path), bold=True)
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('cfme')
+    group.addoption('--nav-profile', dest='nav_profile', action='store_true', default=False,
+        help="Profile the UI navigation and write a report of where the time goes")
+
+
+def pytest_cmdline_main(config):
+    # Only register the plugin if the navigation profiling is enabled
+    if config.option.nav_profile:
+        config.pluginmanager.register(NavProfilerPlugin(), name="nav-profiler")
@@ -20,8 +20,15 @@ The Workflow
 - Before running the last test in a group, the slave will request more tests from the master
 
   - If more tests are received, they are run
+  - If no tests are left, the master looks for a busy slave with tests it has not started yet,
+    asks it to release some of them and hands those to the idle slave
   - If no tests are received, the slave will shut down after running its final test
 
+- Appliances can be added to the session while it runs with
+  :py:meth:`ParallelSession.add_appliance`, their slaves start and join the test distribution
+  right away; appliances can be retired with :py:meth:`ParallelSession.retire_appliance`, and
+  are retired automatically if ``--parallelizer-health-interval`` is set and they fail a check
+
 - After all slaves are shut down, the master will do its end-of-session reporting as usual, and
   shut down
 
@@ -48,7 +55,7 @@ import zmq
 from _pytest import runner
 
 from cfme.fixtures import terminalreporter
-from cfme.fixtures.parallelizer import remote
+from cfme.fixtures.parallelizer import remote, scheduler
 from cfme.fixtures.pytest_store import store
 from cfme.utils import at_exit, conf
 from cfme.utils.log import create_sublogger
@@ -63,6 +70,18 @@ if not conf.runtime['env'].get('ts'):
     conf.runtime['env']['ts'] = ts
 
 
+def pytest_addoption(parser):
+    group = parser.getgroup('cfme')
+    group.addoption('--parallelizer-schedule', dest='parallelizer_schedule',
+                    choices=['collection', 'duration'], default='collection',
+                    help='Order in which test groups are sent to slaves; "duration" uses the '
+                         'test durations of previous runs to send the longest groups first')
+    group.addoption('--parallelizer-health-interval', dest='parallelizer_health_interval',
+                    type=int, default=0,
+                    help='Check the slave appliances every this many seconds and retire the '
+                         'slaves of unhealthy ones; 0 disables the checks')
+
+
 def pytest_addhooks(pluginmanager):
     from . import hooks
     pluginmanager.add_hookspecs(hooks)
@@ -98,6 +117,10 @@ def handle_end_session(signal, frame):
 
 signal.signal(signal.SIGQUIT, handle_end_session)
 
+# a slave needs at least this many sent but unfinished tests to have some of them stolen,
+# the test it is running and the one it has already queued up next are never released
+STEAL_THRESHOLD = 4
+
 
 @attr.s(hash=False)
 class SlaveDetail(object):
@@ -113,6 +136,11 @@ class SlaveDetail(object):
     process = attr.ib(default=None, repr=False)
 
     provider_allocation = attr.ib(default=attr.Factory(list), repr=False)
+    # idle slave waiting for tests to be reclaimed from this one
+    thief = attr.ib(default=None, init=False, repr=False)
+    steal_sent = attr.ib(default=False, init=False, repr=False)
+    # a retiring slave gets no more tests and shuts down once its current group is done
+    retiring = attr.ib(default=False, init=False, repr=False)
 
     def start(self):
         if self.forbid_restart:
@@ -148,6 +176,9 @@ class ParallelSession(object):
         self.terminal = store.terminalreporter
         self.trdist = None
         self.slaves = {}
+        self.schedule = config.getoption('parallelizer_schedule')
+        self.durations = scheduler.DurationStore.from_cache(getattr(config, 'cache', None))
+        self.predicted_makespan = None
         self.test_groups = self._test_item_generator()
 
         self._pool = []
@@ -157,8 +188,14 @@ class ParallelSession(object):
         self.used_prov = set()
 
         self.failed_slave_test_groups = deque()
+        # slaves which asked for tests and are waiting for some to be reclaimed
+        self.idle_slaves = []
         self.slave_spawn_count = 0
-        self.appliances = appliances
+        self.appliances = list(appliances)
+        # appliances added or retired from other threads, applied by the slave audit
+        self.added_appliances = deque()
+        self.retired_appliances = deque()
+        self.health_interval = config.getoption('parallelizer_health_interval')
 
         # set up the ipc socket
 
@@ -188,16 +225,57 @@ class ParallelSession(object):
             self.print_message("using appliance {}".format(self.slaves[slave].appliance.url),
                 slave, green=True)
 
+    def add_appliance(self, appliance):
+        """Start a new slave for ``appliance`` during the session
+
+        Safe to call from any thread, the slave is started by the next slave audit.
+
+        """
+        self.added_appliances.append(appliance)
+
+    def retire_appliance(self, appliance, drain=True):
+        """Stop using ``appliance`` during the session
+
+        Safe to call from any thread, the slave is retired by the next slave audit.
+
+        Args:
+            appliance: appliance whose slave should be retired
+            drain: if ``True`` the slave finishes its current test group before shutting down,
+                otherwise it is interrupted and its unfinished tests are sent to other slaves
+
+        """
+        self.retired_appliances.append((appliance, drain))
+
     def _slave_audit(self):
-        # XXX: There is currently no mechanism to add or remove slave_urls, short of
-        #      firing up the debugger and doing it manually. This is making room for
-        #      planned future abilities to dynamically add and remove slaves via automation
+        # start slaves for the appliances added since the last audit
+        while self.added_appliances:
+            appliance = self.added_appliances.popleft()
+            slave = SlaveDetail(appliance=appliance, worker_config=self.worker_config)
+            self.slaves[slave.id] = slave
+            self.appliances.append(appliance)
+            self.print_message('adding appliance {}'.format(appliance.url), slave, green=True)
+            slave.start()
+
+        while self.retired_appliances:
+            appliance, drain = self.retired_appliances.popleft()
+            for slave in list(self.slaves.values()):
+                if slave.appliance is not appliance or slave.forbid_restart:
+                    continue
+                if drain:
+                    self.print_message('retiring after the current tests', slave, yellow=True)
+                    slave.retiring = True
+                else:
+                    self.print_message('retiring now', slave, yellow=True)
+                    self.interrupt(slave)
 
         # check for unexpected slave shutdowns and redistribute tests
         for slave in self.slaves.values():
             returncode = slave.poll()
             if returncode:
                 slave.process = None
+                slave.thief, slave.steal_sent = None, False
+                if slave in self.idle_slaves:
+                    self.idle_slaves.remove(slave)
                 if returncode == -9:
                     msg = '{} killed due to error, respawning'.format(slave.id)
                 else:
@@ -215,20 +293,39 @@ class ParallelSession(object):
         # the terminated flag implies the appliance has died :(
         for slave in list(self.slaves.values()):
             if slave.forbid_restart:
-                if slave.process is None:
+                if slave.process is None or slave.poll() is not None:
+                    if slave.tests:
+                        # an interrupted slave may exit cleanly without finishing its tests
+                        self.sent_tests -= len(slave.tests)
+                        self.failed_slave_test_groups.append(slave.tests)
+                        slave.tests = set()
                     self.config.hook.pytest_miq_node_shutdown(
                         config=self.config, nodeinfo=slave.appliance.url)
                     del self.slaves[slave.id]
-                else:
-                    # no hook call here, a future audit will handle the fallout
-                    self.print_message(
-                        "{}'s appliance has died, deactivating slave".format(slave.id))
-                    self.interrupt(slave)
+                # otherwise the slave was already interrupted or killed and is still shutting
+                # down, no hook call here, a future audit will handle the fallout
             else:
                 if slave.process is None:
                     slave.start()
                     self.slave_spawn_count += 1
 
+    def _health_check_t(self):
+        # retire the slaves of appliances whose web ui stopped responding
+        while not self.session_finished:
+            sleep(self.health_interval)
+            for slave in list(self.slaves.values()):
+                if slave.retiring or slave.forbid_restart:
+                    continue
+                try:
+                    healthy = slave.appliance.is_web_ui_running(unsure=True)
+                except Exception:
+                    self.log.exception('health check of {} failed'.format(slave.appliance.url))
+                    healthy = False
+                if not healthy:
+                    self.log.warning('{} is unhealthy, retiring {}'.format(
+                        slave.appliance.url, slave.id))
+                    self.retire_appliance(slave.appliance, drain=False)
+
     def send(self, slave, event_data):
         """Send data to slave.
 
@@ -277,8 +374,18 @@ class ParallelSession(object):
             '({})[{}] '.format(prefix, stamp), message, **markup)
 
     def ack(self, slave, event_name):
-        """Acknowledge a slave's message"""
-        self.send(slave, 'ack {}'.format(event_name))
+        """Acknowledge a slave's message
+
+        If an idle slave is waiting for tests from this one, a test progress message is answered
+        with a request to release its unstarted tests instead.
+
+        """
+        if (slave.thief is not None and not slave.steal_sent and
+                event_name in ('runtest_logstart', 'runtest_logreport')):
+            slave.steal_sent = True
+            self.send(slave, 'steal')
+        else:
+            self.send(slave, 'ack {}'.format(event_name))
 
     def monitor_shutdown(self, slave):
         # non-daemon so slaves get every opportunity to shut down cleanly
@@ -344,12 +451,17 @@ class ParallelSession(object):
             slave.process.kill()
             self.monitor_shutdown(slave, **kwargs)
 
-    def send_tests(self, slave):
-        """Send a slave a group of tests"""
+    def next_tests(self, slave):
+        """Get the next group of tests for a slave, redistributed tests first"""
         try:
-            tests = list(self.failed_slave_test_groups.popleft())
+            return list(self.failed_slave_test_groups.popleft())
         except IndexError:
-            tests = self.get(slave)
+            return self.get(slave)
+
+    def send_tests(self, slave, tests=None):
+        """Send a slave a group of tests"""
+        if tests is None:
+            tests = self.next_tests(slave)
         self.send(slave, tests)
         slave.tests.update(tests)
         collect_len = len(self.collection)
@@ -392,6 +504,7 @@ class ParallelSession(object):
         """
         # Build master collection for slave diffing and distribution
         self.collection = [item.nodeid for item in self.session.items]
+        start_time = time()
 
         # Fire up the workers after master collection is complete
         # master and the first slave share an appliance, this is a workaround to prevent a slave
@@ -399,6 +512,11 @@ class ParallelSession(object):
         for slave in self.slaves.values():
             slave.start()
 
+        if self.health_interval:
+            health_thread = Thread(target=self._health_check_t)
+            health_thread.daemon = True
+            health_thread.start()
+
         try:
             self.print_message("Waiting for {} slave collections".format(len(self.slaves)),
                 red=True)
@@ -409,6 +527,7 @@ class ParallelSession(object):
             while True:
                 # spawn/kill/replace slaves if needed
                 self._slave_audit()
+                self._serve_idle_slaves()
 
                 if not self.slaves:
                     # All slaves are killed or errored, we're done with tests
@@ -442,8 +561,13 @@ class ParallelSession(object):
                     else:
                         self.ack(slave, event_name)
                 elif event_name == 'need_tests':
-                    self.send_tests(slave)
-                    self.log.info('starting master test distribution')
+                    # a slave asking for tests has nothing left to steal, answered when served
+                    slave.thief = None
+                    self.idle_slaves.append(slave)
+                    self._serve_idle_slaves()
+                elif event_name == 'released_tests':
+                    self.ack(slave, event_name)
+                    self._reassign_released(slave, event_data['node_ids'])
                 elif event_name == 'runtest_logstart':
                     self.ack(slave, event_name)
                     self.trdist.runtest_logstart(
@@ -455,6 +579,7 @@ class ParallelSession(object):
                     report = unserialize_report(event_data['report'])
                     if report.when in ('call', 'teardown'):
                         slave.tests.discard(report.nodeid)
+                    self.durations.record(report.nodeid, report.duration)
                     self.trdist.runtest_logreport(slave.id, report)
                 elif event_name == 'internalerror':
                     self.ack(slave, event_name)
@@ -465,6 +590,8 @@ class ParallelSession(object):
                         config=self.config, nodeinfo=slave.appliance.url)
                     self.ack(slave, event_name)
                     del self.slaves[slave.id]
+                    if slave in self.idle_slaves:
+                        self.idle_slaves.remove(slave)
                     self.monitor_shutdown(slave)
 
                 # total slave spawn count * 3, to allow for each slave's initial spawn
@@ -482,16 +609,102 @@ class ParallelSession(object):
         finally:
             terminalreporter.enable()
 
+        self.durations.save(getattr(self.config, 'cache', None))
+        if self.predicted_makespan is not None:
+            self.print_message('predicted wall time {:.0f}s, actual wall time {:.0f}s'.format(
+                self.predicted_makespan, time() - start_time))
+
         # Suppress other runtestloop calls
         return True
 
+    def _serve_idle_slaves(self):
+        """Answer the slaves waiting for tests
+
+        Slaves get the next test group if there is one. Otherwise a busy slave is asked to release
+        its unstarted tests to the waiting slave, and only when no slave has enough tests left
+        the waiting slave gets an empty group, which shuts it down.
+
+        """
+        for slave in list(self.idle_slaves):
+            if slave.id not in self.slaves:
+                self.idle_slaves.remove(slave)
+                continue
+            if slave.retiring:
+                # no more tests, the slave shuts down
+                self.idle_slaves.remove(slave)
+                self.send_tests(slave, [])
+                continue
+            if any(other.thief is slave for other in self.slaves.values()):
+                # still waiting for the released tests
+                continue
+            tests = self.next_tests(slave)
+            if not tests:
+                victim = self._steal_victim(slave)
+                if victim is not None:
+                    self.log.info('asking {} to release tests for {}'.format(victim.id, slave.id))
+                    victim.thief = slave
+                    continue
+            self.idle_slaves.remove(slave)
+            self.send_tests(slave, tests)
+
+    def _steal_victim(self, thief):
+        """Pick the busy slave to reclaim tests from, preferring the thief's providers"""
+        candidates = [
+            slave for slave in self.slaves.values()
+            if slave is not thief and slave.thief is None and slave not in self.idle_slaves and
+            len(slave.tests) >= STEAL_THRESHOLD]
+        if not candidates:
+            return None
+
+        def steal_preference(slave):
+            shares_provider = bool(
+                set(self.provs_of_tests(slave.tests)) & set(thief.provider_allocation))
+            return shares_provider, len(slave.tests)
+        return max(candidates, key=steal_preference)
+
+    def _reassign_released(self, victim, released):
+        """Hand tests released by ``victim`` to the slave that is waiting for them"""
+        thief, victim.thief, victim.steal_sent = victim.thief, None, False
+        victim.tests.difference_update(released)
+        self.sent_tests -= len(released)
+        if not released:
+            # the thief gets served again on the next loop iteration
+            return
+        self.print_message('reclaimed {} tests from {}'.format(len(released), victim.id))
+        if thief is None or thief not in self.idle_slaves:
+            self.failed_slave_test_groups.append(released)
+            return
+        provs = self.provs_of_tests(released)
+        if provs and provs[0] not in thief.provider_allocation:
+            thief.provider_allocation = provs[:1]
+        self.idle_slaves.remove(thief)
+        self.send_tests(thief, released)
+
     def _test_item_generator(self):
-        for tests in self._modscope_item_generator():
+        if self.schedule == 'duration':
+            generator = self._duration_item_generator()
+        else:
+            generator = self._modscope_item_generator()
+        for tests in generator:
+            yield tests
+
+    def _duration_item_generator(self):
+        # same module/parametrization groups as the modscope generator, but sent longest-first
+        # with any group that would outlast the ideal makespan split into smaller chunks
+        costed_groups = scheduler.schedule(
+            self._modscope_item_generator(log_groups=False), self.durations, len(self.appliances))
+        self.predicted_makespan = scheduler.predict_makespan(
+            [cost for cost, tests in costed_groups], len(self.appliances))
+        self.log.info('predicted wall time of {} test groups: {:.0f}s'.format(
+            len(costed_groups), self.predicted_makespan))
+        for cost, tests in costed_groups:
+            self.log.info('sent tests with estimated cost {:.0f}s {!r}'.format(cost, tests))
             yield tests
 
-    def _modscope_item_generator(self):
+    def _modscope_item_generator(self, log_groups=True):
         # breaks out tests by module, can work just about any way we want
         # as long as it yields lists of tests id from the master collection
+        # log_groups=False leaves logging the groups up to the caller
         sent_tests = 0
         collection_len = len(self.collection)
 
@@ -499,13 +712,14 @@ class ParallelSession(object):
             return nodeid.split('::')[0]
 
         for fspath, gen_moditems in groupby(self.collection, key=get_fspart):
-            for tests in self._modscope_id_splitter(gen_moditems):
+            for tests in self._modscope_id_splitter(gen_moditems, log_groups):
                 sent_tests += len(tests)
-                self.log.info('{} tests remaining to send'.format(
-                    collection_len - sent_tests))
+                if log_groups:
+                    self.log.info('{} tests remaining to send'.format(
+                        collection_len - sent_tests))
                 yield list(tests)
 
-    def _modscope_id_splitter(self, module_items):
+    def _modscope_id_splitter(self, module_items, log_groups=True):
         # given a list of item ids from one test module, break up tests into groups with the same id
         parametrized_ids = defaultdict(list)
         for item in module_items:
@@ -520,17 +734,19 @@ class ParallelSession(object):
 
         for id, tests in parametrized_ids.items():
             if tests:
-                self.log.info('sent tests with param {} {!r}'.format(id, tests))
+                if log_groups:
+                    self.log.info('sent tests with param {} {!r}'.format(id, tests))
                 yield tests
 
-    def get(self, slave):
+    def provs_of_tests(self, test_group):
+        found = set()
+        for test in test_group:
+            found.update(pv for pv in self.provs
+                         if '[' in test and pv in test)
+        return sorted(found)
 
-        def provs_of_tests(test_group):
-            found = set()
-            for test in test_group:
-                found.update(pv for pv in self.provs
-                             if '[' in test and pv in test)
-            return sorted(found)
+    def get(self, slave):
+        provs_of_tests = self.provs_of_tests
 
         if not self._pool:
             for test_group in self.test_groups:
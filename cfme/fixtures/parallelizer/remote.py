@@ -1,5 +1,6 @@
 import json
 import signal
+from collections import deque
 
 import zmq
 from py.path import local
@@ -30,6 +31,8 @@ class SlaveManager(object):
         self.sock.connect(zmq_endpoint)
 
         self.messages = {}
+        # node ids of the current test group that have not been started yet
+        self.pending = deque()
 
         self.quit_signaled = False
 
@@ -41,11 +44,20 @@ class SlaveManager(object):
         if recv == 'die':
             self.log.info('Slave instructed to die by master; shutting down')
             raise SystemExit()
+        elif recv == 'steal':
+            self.release_tests()
         else:
             self.log.debug('received "{!r}" from master'.format(recv))
             if recv != 'ack':
                 return recv
 
+    def release_tests(self):
+        """Give the later half of the unstarted tests back to the master for another slave"""
+        released = [self.pending.pop() for _ in range(len(self.pending) // 2)]
+        released.reverse()
+        self.log.info('releasing {} tests to the master'.format(len(released)))
+        self.send_event('released_tests', node_ids=released)
+
     def message(self, message, **kwargs):
         """Send a message to the master, which should get printed to the console"""
         self.send_event('message', message=message, markup=kwargs)  # message!
@@ -156,9 +168,10 @@ class SlaveManager(object):
             node_ids = self.send_event('need_tests')
             if not node_ids:
                 break
-            for nodeid in node_ids:
+            self.pending.extend(node_ids)
+            while self.pending:
                 # TODO: take non-unique node ids into account
-                yield self.collection[nodeid]
+                yield self.collection[self.pending.popleft()]
 
 
 def serialize_report(rep):
@@ -0,0 +1,121 @@
+"""Cost based test scheduling for the parallelizer
+
+Historical per-test durations are stored in the pytest cache at the end of every parallel session.
+On the next run the master uses them to estimate the cost of every test group, hands the groups
+out longest-first, and splits up groups that would on their own run longer than the ideal
+makespan, so a single huge module no longer keeps one slave busy long after the others are done.
+
+Tests that have never been timed are costed at the mean of the known durations, or at
+:py:data:`DEFAULT_TEST_COST` when nothing is known yet.
+
+"""
+import heapq
+
+#: pytest cache key holding the nodeid -> seconds mapping
+DURATIONS_CACHE_KEY = 'parallelizer/durations'
+
+#: cost in seconds assumed for a test when no durations are known at all
+DEFAULT_TEST_COST = 30.0
+
+#: weight of the most recent run when merging new durations into the historical ones
+DURATION_SMOOTHING = 0.5
+
+
+class DurationStore(object):
+    """Historical and current-run per-test durations
+
+    Args:
+        durations: mapping of test nodeid to its historical duration in seconds
+
+    """
+    def __init__(self, durations=None):
+        self.durations = dict(durations or {})
+        self.current = {}
+        known = list(self.durations.values())
+        self.default_cost = sum(known) / len(known) if known else DEFAULT_TEST_COST
+
+    @classmethod
+    def from_cache(cls, cache):
+        """Load the durations from the pytest cache, ``None`` (no cacheprovider) gives none"""
+        if cache is None:
+            return cls()
+        return cls(cache.get(DURATIONS_CACHE_KEY, None))
+
+    def record(self, nodeid, duration):
+        """Add the duration of one test phase to the test's total for this run"""
+        self.current[nodeid] = self.current.get(nodeid, 0.0) + duration
+
+    def cost(self, nodeid):
+        return self.durations.get(nodeid, self.default_cost)
+
+    def group_cost(self, tests):
+        return sum(self.cost(test) for test in tests)
+
+    def merged(self):
+        """Historical durations updated with the results of the current run"""
+        durations = dict(self.durations)
+        for nodeid, duration in self.current.items():
+            if nodeid in durations:
+                duration = (DURATION_SMOOTHING * duration +
+                            (1 - DURATION_SMOOTHING) * durations[nodeid])
+            durations[nodeid] = duration
+        return durations
+
+    def save(self, cache):
+        if cache is not None:
+            cache.set(DURATIONS_CACHE_KEY, self.merged())
+
+
+def split_group(tests, cost, limit):
+    """Split a list of test ids into consecutive chunks costing no more than ``limit`` each
+
+    A single test costing more than ``limit`` still makes up a chunk of its own.
+
+    """
+    chunk, chunk_cost = [], 0.0
+    for test in tests:
+        test_cost = cost(test)
+        if chunk and chunk_cost + test_cost > limit:
+            yield chunk
+            chunk, chunk_cost = [], 0.0
+        chunk.append(test)
+        chunk_cost += test_cost
+    if chunk:
+        yield chunk
+
+
+def predict_makespan(costs, slave_count):
+    """Wall time of handing out ``costs`` in order to the first free of ``slave_count`` slaves"""
+    if slave_count < 1:
+        return sum(costs)
+    loads = [0.0] * slave_count
+    for group_cost in costs:
+        heapq.heapreplace(loads, loads[0] + group_cost)
+    return max(loads)
+
+
+def schedule(groups, durations, slave_count):
+    """Order test groups longest-first, splitting up the ones above the ideal makespan
+
+    Args:
+        groups: iterable of lists of test ids, usually split at parametrization boundaries
+        durations: :py:class:`DurationStore` used to cost the tests
+        slave_count: number of slaves the groups will be spread across
+
+    Returns:
+        A list of ``(cost, tests)`` tuples, most expensive first
+
+    """
+    groups = [list(tests) for tests in groups if tests]
+    total = sum(durations.group_cost(tests) for tests in groups)
+    limit = total / max(slave_count, 1)
+    costed = []
+    for tests in groups:
+        if durations.group_cost(tests) > limit:
+            chunks = split_group(tests, durations.cost, limit)
+        else:
+            chunks = [tests]
+        costed.extend((durations.group_cost(chunk), chunk) for chunk in chunks)
+    # stable sort keeps collection order between equally costed groups
+    costed.sort(key=lambda costed_group: costed_group[0], reverse=True)
+    return costed
@@ -21,4 +21,6 @@ def pytest_sessionfinish(session, exitstatus):
     for session in ssh._client_session:
         with diaper:
             session.close()
+    logger.info('ssh transport pool stats: %r', ssh.transport_pool.stats())
+    ssh.transport_pool.close_all()
     yield
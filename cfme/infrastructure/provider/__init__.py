@@ -277,6 +277,7 @@ class InfraProviderCollection(BaseCollection):
 @navigator.register(InfraProvider, 'All')
 class All(CFMENavigateStep):
     VIEW = InfraProvidersView
+    DEEP_LINK = True
     prerequisite = NavigateToAttribute('appliance.server', 'LoggedIn')
 
     def step(self):
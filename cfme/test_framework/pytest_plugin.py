@@ -66,6 +66,7 @@ pytest_plugins = (
     'cfme.fixtures.log',
     'cfme.fixtures.maximized',
     'cfme.fixtures.merkyl',
+    'cfme.fixtures.nav_profiler',
     'cfme.fixtures.nelson',
     'cfme.fixtures.node_annotate',
     'cfme.fixtures.page_screenshots',
@@ -2,6 +2,7 @@
 import json
 import os
 import requests
+import time
 
 import attr
 
@@ -13,6 +14,11 @@ from cfme.utils.log import logger
 from cfme.utils.wait import wait_for
 
 
+#: How long in seconds request_check_changed waits for the pool to change, Sprout itself only
+#: waits a couple of seconds per call
+REQUEST_CHECK_WAIT = 20
+
+
 class SproutException(Exception):
     pass
 
@@ -102,6 +108,8 @@ class SproutClient(object):
             provider_type=None, lease_time=60, ram=None, cpu=None, **kwargs):
         # provisioning may take more time than it is expected in some cases
         wait_time = kwargs.pop('wait_time', 900)
+        # without waiting, the appliances which are not ready yet are returned as well
+        wait = kwargs.pop('wait', True)
         # If we specify version, stream is ignored because we will get that specific version
         if version:
             stream = get_stream(version)
@@ -125,14 +133,25 @@ class SproutClient(object):
             count=count,
             **kwargs
         )
-        wait_for(
-            lambda: self.call_method('request_check', str(request_id))['finished'],
-            num_sec=wait_time,
-            message='provision {} appliance(s) from sprout'.format(count))
+        if wait:
+            pool_state = {}
+
+            def pool_finished():
+                pool_state.update(
+                    self.request_check_changed(request_id, pool_state.get('state_version')))
+                return pool_state['finished']
+
+            wait_for(
+                pool_finished,
+                num_sec=wait_time,
+                message='provision {} appliance(s) from sprout'.format(count))
         data = self.call_method('request_check', str(request_id))
         logger.debug(data)
         appliances = []
         for appliance in data['appliances']:
+            if not appliance['ready']:
+                # only possible without waiting for the pool to finish
+                continue
             app_args = {'hostname': appliance['ip_address'],
                         'project': appliance['project'],
                         'container': appliance['container'],
@@ -140,5 +159,22 @@ class SproutClient(object):
             appliances.append(IPAppliance(**app_args))
         return appliances, request_id
 
+    def request_check_changed(self, request_id, state_version=None, timeout=REQUEST_CHECK_WAIT):
+        """Check the pool, waiting until it changes since ``state_version``
+
+        ``state_version`` is the one returned by the previous check, without it (or with a Sprout
+        not supporting that) the check returns immediately. Sprout waits only a couple of seconds
+        per call, so the check is repeated until the pool changes or ``timeout`` seconds pass.
+        """
+        if state_version is None:
+            return self.call_method('request_check', str(request_id))
+        deadline = time.time() + timeout
+        while True:
+            result = self.call_method(
+                'request_check', str(request_id), state_version=state_version)
+            # A Sprout without the state versions returns none
+            if result.get('state_version') != state_version or time.time() >= deadline:
+                return result
+
     def destroy_pool(self, pool_id):
         self.call_method('destroy_pool', id=pool_id)
@@ -1,5 +1,6 @@
 import re
-from threading import Timer
+from threading import Thread, Timer
+from time import sleep
 
 import pytest
 import random
@@ -56,6 +57,10 @@ def pytest_addoption(parser):
     group._addoption('--sprout-user-key', default=None,
                      help='Key for sprout user in credentials yaml, '
                           'alternatively set SPROUT_USER and SPROUT_PASSWORD env vars')
+    group._addoption('--sprout-elastic', dest='sprout_elastic', action='store_true',
+                     default=False,
+                     help='Start testing as soon as two appliances are ready and add the rest '
+                          'to the parallel session when they become ready')
 
 
 def dump_pool_info(log, pool_data):
@@ -81,8 +86,12 @@ def mangle_in_sprout_appliances(config):
     provision_request = SproutProvisioningRequest.from_config(config)
 
     mgr = config._sprout_mgr = SproutManager(config.option.sprout_user_key)
+    if config.option.sprout_elastic:
+        min_ready = min(2, provision_request.count)
+    else:
+        min_ready = None
     try:
-        requested_appliances = mgr.request_appliances(provision_request)
+        requested_appliances = mgr.request_appliances(provision_request, min_ready=min_ready)
     except AuthException:
         log.exception('Sprout client not authenticated, please provide env vars or sprout_user_key')
         raise
@@ -90,28 +99,7 @@ def mangle_in_sprout_appliances(config):
     appliances = config.option.appliances
     log.info("Appliances were provided:")
     for appliance in requested_appliances:
-
-        appliance_args = {'hostname': appliance['url']}
-        provider_data = conf.cfme_data['management_systems'].get(appliance['provider'])
-        if provider_data and provider_data['type'] == 'openshift':
-            ocp_creds = conf.credentials[provider_data['credentials']]
-            ssh_creds = conf.credentials[provider_data['ssh_creds']]
-            extra_args = {
-                'container': appliance['container'],
-                'db_host': appliance['db_host'],
-                'project': appliance['project'],
-                'openshift_creds': {
-                    'hostname': provider_data['hostname'],
-                    'username': ocp_creds['username'],
-                    'password': ocp_creds['password'],
-                    'ssh': {
-                        'username': ssh_creds['username'],
-                        'password': ssh_creds['password'],
-                    }
-                }
-            }
-            appliance_args.update(extra_args)
-        appliances.append(appliance_args)
+        appliances.append(sprout_appliance_args(appliance))
         log.info("- %s is %s", appliance['url'], appliance['name'])
     mgr.reset_timer()
     template_name = requested_appliances[0]["template_name"]
@@ -122,6 +110,34 @@ def mangle_in_sprout_appliances(config):
     log.info("Sprout setup finished.")
 
     config.pluginmanager.register(ShutdownPlugin())
+    if min_ready is not None:
+        config.pluginmanager.register(
+            ElasticPoolPlugin(mgr, {appliance['url'] for appliance in requested_appliances}))
+
+
+def sprout_appliance_args(appliance):
+    """Appliance arguments, as passed with ``--appliance``, for a sprout appliance"""
+    appliance_args = {'hostname': appliance['url']}
+    provider_data = conf.cfme_data['management_systems'].get(appliance['provider'])
+    if provider_data and provider_data['type'] == 'openshift':
+        ocp_creds = conf.credentials[provider_data['credentials']]
+        ssh_creds = conf.credentials[provider_data['ssh_creds']]
+        extra_args = {
+            'container': appliance['container'],
+            'db_host': appliance['db_host'],
+            'project': appliance['project'],
+            'openshift_creds': {
+                'hostname': provider_data['hostname'],
+                'username': ocp_creds['username'],
+                'password': ocp_creds['password'],
+                'ssh': {
+                    'username': ssh_creds['username'],
+                    'password': ssh_creds['password'],
+                }
+            }
+        }
+        appliance_args.update(extra_args)
+    return appliance_args
 
 
 @attr.s
@@ -168,21 +184,37 @@ class SproutManager(object):
     pool = attr.ib(init=False, default=None)
     lease_time = attr.ib(init=False, default=None, repr=False)
     timer = attr.ib(init=False, default=None, repr=False)
+    pool_state_version = attr.ib(init=False, default=None, repr=False)
 
     @cached_property
     def client(self):
         """Provide additional kwargs to from_config for auth passing"""
         return SproutClient.from_config(sprout_user_key=self.sprout_user_key)
 
-    def request_appliances(self, provision_request):
-        self.request_pool(provision_request)
+    def request_appliances(self, provision_request, min_ready=None):
+        """Request a pool and wait for its appliances
+
+        Args:
+            provision_request: :py:class:`SproutProvisioningRequest` describing the pool
+            min_ready: if set, only wait until this many appliances are ready and return those,
+                the rest can be picked up later with :py:meth:`watch_pool`
 
+        """
+        self.request_pool(provision_request, wait=min_ready is None)
+
+        def check_ready():
+            return len(self.ready_appliances()) >= min_ready
+
+        if min_ready is None:
+            check, message = self.check_fullfilled, "requesting appliances was fulfilled"
+        else:
+            check, message = check_ready, "{} requested appliances were ready".format(min_ready)
         try:
             result = wait_for(
-                self.check_fullfilled,
+                check,
                 num_sec=provision_request.provision_timeout * 60,
-                delay=5,
-                message="requesting appliances was fulfilled"
+                delay=1,
+                message=message
             )
         except Exception:
             pool = self.request_check()
@@ -196,9 +228,11 @@ class SproutManager(object):
             dump_pool_info(log, pool)
 
         log.info("Provisioning took %.1f seconds", result.duration)
-        return pool["appliances"]
+        if min_ready is None:
+            return pool["appliances"]
+        return [appliance for appliance in pool["appliances"] if appliance["ready"]]
 
-    def request_pool(self, provision_request):
+    def request_pool(self, provision_request, wait=True):
         log.info("Requesting %s appliances from Sprout at %s",
                  provision_request.count, self.client.api_entry)
         self.lease_time = provision_request.lease_time
@@ -218,7 +252,8 @@ class SproutManager(object):
             'cpu': provision_request.cpu,
             'ram': provision_request.ram,
             'stream': provision_request.group,
-            'wait_time': provision_request.provision_timeout * 60
+            'wait_time': provision_request.provision_timeout * 60,
+            'wait': wait,
         }
         if provision_request.template_type:
             kargs['template_type'] = provision_request.template_type
@@ -239,17 +274,62 @@ class SproutManager(object):
     def request_check(self):
         return self.client.request_check(self.pool)
 
-    def check_fullfilled(self):
+    def _checked_request(self):
         try:
-            result = self.request_check()
+            # Sprout answers once the pool changes, so there is no need to poll
+            result = self.client.request_check_changed(self.pool, self.pool_state_version)
         except SproutException as e:
             # TODO: ensure we only exit this way on sprout usage
             self.destroy_pool()
             log.error("sprout pool could not be fulfilled\n%s", str(e))
             pytest.exit(1)
 
+        self.pool_state_version = result.get('state_version')
         log.debug("fulfilled at %f %%", result['progress'])
-        return result["finished"]
+        return result
+
+    def check_fullfilled(self):
+        return self._checked_request()["finished"]
+
+    def ready_appliances(self):
+        return [
+            appliance for appliance in self._checked_request()["appliances"]
+            if appliance["ready"]]
+
+    def watch_pool(self, known_urls, callback, delay=30):
+        """Call ``callback`` from a daemon thread for every appliance which becomes ready
+
+        Args:
+            known_urls: urls of the appliances already in use, these are not passed to callback
+            callback: called with the sprout data of each newly ready appliance
+            delay: seconds between checks of the pool
+
+        """
+        known_urls = set(known_urls)
+
+        def _watch():
+            state_version = None
+            while self.pool is not None:
+                try:
+                    pool = self.client.request_check_changed(self.pool, state_version)
+                except Exception:
+                    log.exception("Failed to check the sprout pool %s", self.pool)
+                    state_version = None
+                else:
+                    state_version = pool.get('state_version')
+                    for appliance in pool["appliances"]:
+                        if appliance["ready"] and appliance["url"] not in known_urls:
+                            known_urls.add(appliance["url"])
+                            callback(appliance)
+                    if pool["finished"] and len(known_urls) >= len(pool["appliances"]):
+                        log.info("All appliances of the sprout pool %s are in use", self.pool)
+                        return
+                if state_version is None:
+                    sleep(delay)
+
+        watcher = Thread(target=_watch)
+        watcher.daemon = True
+        watcher.start()
 
     def clean_jenkins_job(self, jenkins_job):
         try:
@@ -340,6 +420,25 @@ class ShutdownPlugin(object):
             log.debug('The IP address was not present - not terminating any appliance')
 
 
+@attr.s
+class ElasticPoolPlugin(object):
+    """Adds appliances of a partially ready sprout pool to the parallel session"""
+    mgr = attr.ib()
+    known_urls = attr.ib()
+
+    def pytest_parallel_configured(self, parallel_session):
+        if parallel_session is None:
+            return
+        from cfme.test_framework.appliance import appliances_from_cli
+
+        def add_appliance(appliance_data):
+            log.info("Sprout appliance %s is ready, adding it", appliance_data['url'])
+            appliance, = appliances_from_cli([sprout_appliance_args(appliance_data)], None)
+            parallel_session.add_appliance(appliance)
+
+        self.mgr.watch_pool(self.known_urls, add_appliance)
+
+
 class NewHooks(object):
     def pytest_miq_node_shutdown(self, config, nodeinfo):
         pass
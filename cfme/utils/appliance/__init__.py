@@ -2,7 +2,8 @@ import json
 import logging
 import socket
 import traceback
-from copy import copy
+from contextlib import contextmanager
+from copy import copy, deepcopy
 from datetime import datetime
 from tempfile import NamedTemporaryFile
 from time import sleep, time
@@ -21,6 +22,7 @@ from cached_property import cached_property
 from debtcollector import removals
 from manageiq_client.api import APIException, ManageIQClient as VanillaMiqApi
 from six.moves.urllib.parse import urlparse
+from sqlalchemy import and_, func
 from werkzeug.local import LocalStack, LocalProxy
 from wrapanapi import VmState
 from wrapanapi.exceptions import VMInstanceNotFound
@@ -214,6 +216,16 @@ class ApplianceConsoleCli(object):
         assert not self.appliance.ssh_client.run_command("cat /etc/ipa/default.conf")
 
 
+def _merge_settings(settings, changes):
+    """Recursively merges the ``changes`` dictionary into the ``settings`` dictionary"""
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(settings.get(key), dict):
+            _merge_settings(settings[key], value)
+        else:
+            settings[key] = value
+    return settings
+
+
 class IPAppliance(object):
     """IPAppliance represents an already provisioned cfme appliance whos provider is unknown
     but who has an IP address. This has a lot of core functionality that Appliance uses, since
@@ -322,6 +334,12 @@ class IPAppliance(object):
         self.openshift_creds = openshift_creds or {}
         self.is_dev = is_dev
         self._user = None
+        # (fingerprint, settings document) of the last fetched advanced settings
+        self._settings_cache = None
+        # settings changes collected by batched_settings_update
+        self._settings_batch = None
+        # cleared when the settings cannot be fingerprinted, eg. the database is not reachable
+        self._settings_fingerprinting = True
         self.appliance_console = ApplianceConsole(self)
         self.appliance_console_cli = ApplianceConsoleCli(self)
 
@@ -937,6 +955,14 @@ ExecStartPre=/usr/bin/bash -c "ipcs -s|grep apache|cut -d\  -f2|while read line;
         store.ssh_clients_to_close.append(ssh_client)
         return ssh_client
 
+    @property
+    def ssh_pool_stats(self):
+        """Statistics of the shared ssh transports to this appliance
+
+        See :py:meth:`cfme.utils.ssh.TransportPool.stats`
+        """
+        return ssh.transport_pool.stats(hostname=self.hostname)
+
     @property
     def swap(self):
         """Retrieves the value of swap for the appliance. Might raise an exception if SSH fails.
@@ -1899,15 +1925,13 @@ ExecStartPre=/usr/bin/bash -c "ipcs -s|grep apache|cut -d\  -f2|while read line;
         """Return a dictionary of server roles from database"""
         asr = self.db.client['assigned_server_roles']
         sr = self.db.client['server_roles']
-        all_role_names = {row[0] for row in self.db.client.session.query(sr.name)}
-        # Query all active server roles assigned to this server
+        # All the roles with their assignments to this server, in one query
         query = self.db.client.session\
-            .query(sr.name)\
-            .join(asr, asr.server_role_id == sr.id)\
-            .filter(asr.miq_server_id == self.evm_id)\
-            .filter(asr.active == True)  # noqa
-        active_roles = {row[0] for row in query}
-        roles = {role_name: role_name in active_roles for role_name in all_role_names}
+            .query(sr.name, asr.active)\
+            .outerjoin(asr, and_(asr.server_role_id == sr.id, asr.miq_server_id == self.evm_id))
+        roles = {}
+        for role_name, active in query:
+            roles[role_name] = roles.get(role_name, False) or bool(active)
         dead_keys = ['database_owner', 'vdi_inventory']
         for key in roles:
             if not self.is_storage_enabled:
@@ -1925,10 +1949,11 @@ ExecStartPre=/usr/bin/bash -c "ipcs -s|grep apache|cut -d\  -f2|while read line;
     @server_roles.setter
     def server_roles(self, roles):
         """Sets the server roles. Requires a dictionary full of the role keys with bool values."""
-        if self.server_roles == roles:
+        current_roles = self.server_roles
+        if current_roles == roles:
             self.log.debug(' Roles already match, returning...')
             return
-        ansible_old = self.server_roles.get('embedded_ansible', False)
+        ansible_old = current_roles.get('embedded_ansible', False)
         ansible_new = roles.get('embedded_ansible', False)
         enabling_ansible = ansible_old is False and ansible_new is True
 
@@ -1961,7 +1986,9 @@ ExecStartPre=/usr/bin/bash -c "ipcs -s|grep apache|cut -d\  -f2|while read line;
         self.server_roles = roles
 
     def update_server_roles(self, changed_roles):
-        server_roles = self.server_roles.copy()
+        server_roles = self.server_roles
+        if all(server_roles.get(role) == value for role, value in changed_roles.items()):
+            return True
         server_roles.update(changed_roles)
         self.server_roles = server_roles
         return server_roles == self.server_roles
@@ -2016,7 +2043,49 @@ ExecStartPre=/usr/bin/bash -c "ipcs -s|grep apache|cut -d\  -f2|while read line;
 
     @property
     def advanced_settings(self):
-        """Get settings from the base api/settings endpoint for appliance"""
+        """Get settings from the base api/settings endpoint for appliance
+
+        The settings document is fetched again only when the settings changed in the database
+        since the last fetch (see :py:meth:`_settings_fingerprint`), every access returns a copy
+        of it which can be freely modified. Inside :py:meth:`batched_settings_update` the changes
+        waiting to be applied are included.
+        """
+        fingerprint = self._settings_fingerprint()
+        if (fingerprint is None or self._settings_cache is None or
+                self._settings_cache[0] != fingerprint):
+            self._settings_cache = (fingerprint, self._fetch_advanced_settings())
+        settings = deepcopy(self._settings_cache[1])
+        if self._settings_batch is not None:
+            _merge_settings(settings, self._settings_batch)
+        return settings
+
+    def _settings_fingerprint(self):
+        """Cheap value which changes whenever the settings stored in the database change.
+
+        Returns ``None`` when it could not be determined, so the settings are always fetched.
+        """
+        if not self._settings_fingerprinting:
+            return None
+        try:
+            changes = self.db.client['settings_changes']
+            return tuple(self.db.client.session.query(
+                func.count(changes.id), func.max(changes.id), func.max(changes.updated_at)).one())
+        except Exception:
+            logger.warning(
+                'Could not fingerprint the settings of %s, they will be fetched on every access',
+                self.hostname, exc_info=True)
+            self._settings_fingerprinting = False
+            try:
+                self.db.client.session.rollback()
+            except Exception:
+                pass
+            return None
+
+    def invalidate_advanced_settings(self):
+        """Forget the cached settings document, the next access fetches it again"""
+        self._settings_cache = None
+
+    def _fetch_advanced_settings(self):
         if self.version > '5.9':
             return self.rest_api.get(self.rest_api.collections.settings._href)
         else:
@@ -2052,6 +2121,10 @@ ExecStartPre=/usr/bin/bash -c "ipcs -s|grep apache|cut -d\  -f2|while read line;
         Raises:
             ApplianceException when server_id isn't set
         """
+        if self._settings_batch is not None:
+            _merge_settings(self._settings_batch, deepcopy(settings_dict))
+            return
+        self.invalidate_advanced_settings()
         # Can only modify through server ID, raise if that's not set yet
         if self.version < '5.9':
             data_dict_base = self.advanced_settings
@@ -2080,6 +2153,33 @@ ExecStartPre=/usr/bin/bash -c "ipcs -s|grep apache|cut -d\  -f2|while read line;
                 raise ApplianceException('No server id is set, cannot modify yaml config via REST')
             self.server.update_advanced_settings(settings_dict)
 
+    @contextmanager
+    def batched_settings_update(self):
+        """Collects the :py:meth:`update_advanced_settings` calls made inside the context and
+        applies all the changes with a single update when leaving it.
+
+        The changes are merged key by key, the later ones win. Nothing is applied when the
+        context is left with an exception.
+
+        Usage:
+
+            with appliance.batched_settings_update():
+                appliance.set_session_timeout(3600)
+                appliance.update_advanced_settings({'product': {'transformation': True}})
+        """
+        if self._settings_batch is not None:
+            # nested, the outer context applies the changes
+            yield
+            return
+        self._settings_batch = {}
+        try:
+            yield
+            changes = self._settings_batch
+        finally:
+            self._settings_batch = None
+        if changes:
+            self.update_advanced_settings(changes)
+
     def set_proxy(self, host, port, user=None, password=None, prov_type=None):
         vmdb_config = self.advanced_settings
         proxy_type = prov_type or 'default'
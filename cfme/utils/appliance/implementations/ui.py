@@ -4,6 +4,7 @@ import time
 from inspect import isclass
 from time import sleep
 
+import attr
 import os
 from cached_property import cached_property
 from jsmin import jsmin
@@ -21,6 +22,7 @@ from cfme import exceptions
 from cfme.fixtures.pytest_store import store
 from cfme.utils.browser import manager
 from cfme.utils.log import logger, create_sublogger
+from cfme.utils.nav_profiler import profiler
 from cfme.utils.version import Version
 from cfme.utils.wait import wait_for
 from . import Implementation
@@ -53,6 +55,22 @@ class ErrorView(View):
         return None
 
 
+@attr.s(frozen=True)
+class PageState(object):
+    """State of the page found by :py:meth:`MiqBrowserPlugin.probe_page`
+
+    Args:
+        blocked: The page is blocked by the blocker div, a notification or a modal backdrop.
+        modal: A large modal window is open.
+        jquery: jQuery is present on the page.
+        rails_error: The rails error message displayed instead of the page or ``None``.
+    """
+    blocked = attr.ib(default=False)
+    modal = attr.ib(default=False)
+    jquery = attr.ib(default=True)
+    rails_error = attr.ib(default=None)
+
+
 class MiqBrowserPlugin(DefaultPlugin):
     # Here we dismiss notifications as they obscure lower elements which need to be clicked on
     # We don't bother iterating and instead choose [0] and [1] to simplify the codepath
@@ -105,6 +123,52 @@ class MiqBrowserPlugin(DefaultPlugin):
         }
         ''')
 
+    # Collects everything CFMENavigateStep.pre_badness_check needs to know about the page, see
+    # PageState. The checks replicate ErrorView.get_rails_error and the is_displayed checks.
+    PAGE_STATE = jsmin('''\
+        function isVisible(el) {
+            return !!(el && (el.offsetWidth || el.offsetHeight || el.getClientRects().length));
+        }
+        function first(xpath) {
+            return document.evaluate(
+                xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+        }
+        function visible(xpath) {
+            return isVisible(first(xpath));
+        }
+        function text(xpath) {
+            var el = first(xpath);
+            return el === null ? null : (el.innerText || el.textContent).trim();
+        }
+
+        try {
+            miqSparkleOff();
+        } catch(err) {
+            // miqSparkleOff undefined, so it's definitely off.
+        }
+
+        var railsError = null;
+        if (visible("//body[./h1 and ./p and ./hr and ./address]")) {
+            var title = text("//body/h1"), body = text("//body/p");
+            if (title !== null && body !== null) {
+                railsError = title + ": " + body;
+            }
+        } else if (visible("//h1[normalize-space(.)='Unexpected error encountered']")) {
+            railsError = text(
+                "//h1[normalize-space(.)='Unexpected error encountered']" +
+                "/following-sibling::h3[not(fieldset)]");
+        }
+        var backdrop = document.querySelector(".modal-backdrop.fade.in");
+
+        return {
+            blocked: visible("//div[@id='blocker_div' or @id='notification']") ||
+                isVisible(backdrop),
+            modal: visible(
+                "//div[contains(@class, 'modal-dialog') and contains(@class, 'modal-lg')]"),
+            jquery: typeof jQuery !== "undefined",
+            rails_error: railsError
+        };
+        ''')
     OBSERVED_FIELD_MARKERS = (
         'data-miq_observe',
         'data-miq_observe_date',
@@ -112,6 +176,20 @@ class MiqBrowserPlugin(DefaultPlugin):
     )
     DEFAULT_WAIT = .8
 
+    def probe_page(self):
+        """Returns the :py:class:`PageState` of the current page, collected with a single script.
+
+        Turns the sparkle off as well. The state is never cached, the page can change without
+        any interaction through selenium (page loads, AJAX responses, alerts).
+        """
+        try:
+            result = self.browser.execute_script(self.PAGE_STATE, silent=True)
+        except Exception:
+            # Alerts block the scripts
+            self.browser.dismiss_any_alerts()
+            result = self.browser.execute_script(self.PAGE_STATE, silent=True)
+        return PageState(**result)
+
     @property
     def page_has_changes(self):
         """Checks whether current page has any changes which may lead to "Abandon Changes" alert """
@@ -177,8 +255,8 @@ class MiqBrowserPlugin(DefaultPlugin):
 
     def after_keyboard_input(self, element, keyboard_input):
         observed_field_attr = None
-        for attr in self.OBSERVED_FIELD_MARKERS:
-            observed_field_attr = self.browser.get_attribute(attr, element)
+        for marker in self.OBSERVED_FIELD_MARKERS:
+            observed_field_attr = self.browser.get_attribute(marker, element)
             if observed_field_attr is not None:
                 break
         else:
@@ -258,7 +336,19 @@ def can_skip_badness_test(fn):
 
 
 class CFMENavigateStep(NavigateStep):
+    """Navigation step of the CFME UI.
+
+    Steps setting ``DEEP_LINK`` to ``True`` remember the URL they reach as a deep link the first
+    time the step's view is verified to be displayed. Next time the step opens the deep link
+    directly and only falls back to the prerequisites and the step when the view is not
+    displayed there. The deep link is shared by all the objects the step class is registered
+    for, so only opt in steps whose URL alone leads to their view whatever the object, not the
+    explorer ones whose content depends on the session nor the ones showing a single object. A
+    URL reached by several step classes and a deep link which did not lead to the view are never
+    used again. Pass ``use_deep_link=False`` to ``navigate_to`` to skip the deep link.
+    """
     VIEW = None
+    DEEP_LINK = False
 
     @cached_property
     def view(self):
@@ -279,6 +369,50 @@ class CFMENavigateStep(NavigateStep):
         except (AttributeError, NoSuchElementException):
             return False
 
+    @property
+    def deep_link_key(self):
+        """Key of the step's deep link, the step class and its destination name"""
+        return type(self), self._name
+
+    def follow_deep_link(self, *args, **kwargs):
+        """Opens the deep link of the step, if there is one.
+
+        Returns:
+            ``True`` when the step's view is displayed after opening the deep link, the step is
+            marked as not deep linkable otherwise.
+        """
+        deep_links = self.appliance.browser.deep_links
+        url = deep_links.get(self.deep_link_key)
+        if url is None:
+            return False
+        self.log_message("Following deep link {}".format(url))
+        br = self.appliance.browser.widgetastic
+        br.url = url
+        br.plugin.ensure_page_safe()
+        if self.am_i_here():
+            return True
+        self.log_message("Deep link {} did not lead to the view, not using it anymore".format(
+            url), level="warning")
+        deep_links[self.deep_link_key] = None
+        return False
+
+    def remember_deep_link(self):
+        """Remembers the current URL as the deep link of the step
+
+        A step once marked as not deep linkable (``None``) is not recorded again. A URL reached by
+        several step classes depends on more than the URL, all of them are marked as not deep
+        linkable.
+        """
+        key = self.deep_link_key
+        deep_links = self.appliance.browser.deep_links
+        if key in deep_links:
+            return
+        url = self.appliance.browser.widgetastic.url
+        shared = [other for other, other_url in deep_links.items() if other_url == url]
+        for other in shared:
+            deep_links[other] = None
+        deep_links[key] = None if shared else url
+
     def pre_badness_check(self, _tries, *args, **go_kwargs):
         # check for MiqQE javascript patch on first try and patch the appliance if necessary
         if self.appliance.is_miqqe_patch_candidate and not self.appliance.miqqe_patch_applied:
@@ -288,43 +422,25 @@ class CFMENavigateStep(NavigateStep):
             self.go(_tries, *args, **go_kwargs)
 
         br = self.appliance.browser
-
-        try:
-            br.widgetastic.execute_script('miqSparkleOff();', silent=True)
-        except:  # noqa
-            # miqSparkleOff undefined, so it's definitely off.
-            # Or maybe it is alerts? Let's only do this when we get an exception.
-            self.appliance.browser.widgetastic.dismiss_any_alerts()
-            # If we went so far, let's put diapers on one more miqSparkleOff just to be sure
-            # It can be spinning in the back
-            try:
-                br.widgetastic.execute_script('miqSparkleOff();', silent=True)
-            except:  # noqa
-                pass
+        # Turns the sparkle off and checks the page in one go
+        page = br.widgetastic.plugin.probe_page()
 
         # Check if the page is blocked with blocker_div. If yes, let's headshot the browser right
         # here
-        if (
-                br.widgetastic.is_displayed("//div[@id='blocker_div' or @id='notification']") or
-                br.widgetastic.is_displayed(".modal-backdrop.fade.in")):
+        if page.blocked:
             logger.warning("Page was blocked with blocker div on start of navigation, recycling.")
             self.appliance.browser.quit_browser()
             self.go(_tries, *args, **go_kwargs)
 
         # Check if modal window is displayed
-        if (br.widgetastic.is_displayed(
-                "//div[contains(@class, 'modal-dialog') and contains(@class, 'modal-lg')]")):
+        if page.modal:
             logger.warning("Modal window was open; closing the window")
             br.widgetastic.click(
                 "//button[contains(@class, 'close') and contains(@data-dismiss, 'modal')]")
 
         # Check if jQuery present
-        try:
-            br.widgetastic.execute_script("jQuery", silent=True)
-        except Exception as e:
-            if "jQuery" not in str(e):
-                logger.error("Checked for jQuery but got something different.")
-                logger.exception(e)
+        if not page.jquery:
+            logger.error("jQuery is not present on the page.")
             # Restart some workers
             logger.warning("Restarting UI and VimBroker workers!")
             with self.appliance.ssh_client as ssh:
@@ -338,8 +454,7 @@ class CFMENavigateStep(NavigateStep):
             self.go(_tries, *args, **go_kwargs)
 
         # Same with rails errors
-        view = br.widgetastic.create_view(ErrorView)
-        rails_e = view.get_rails_error()
+        rails_e = page.rails_error
 
         if rails_e is not None:
             logger.warning("Page was blocked by rails error, renavigating.")
@@ -381,10 +496,12 @@ class CFMENavigateStep(NavigateStep):
         restart_evmserverd = False
 
         try:
-            self.pre_badness_check(_tries, *args, **go_kwargs)
+            with profiler.span('badness_check'):
+                self.pre_badness_check(_tries, *args, **go_kwargs)
             self.log_message(
                 "Invoking {}, with {} and {}".format(fn.__name__, args, kwargs), level="debug")
-            return fn(*args, **kwargs)
+            with profiler.span(fn.__name__):
+                return fn(*args, **kwargs)
         except (KeyboardInterrupt, ValueError):
             # KeyboardInterrupt: Don't block this while navigating
             raise
@@ -496,22 +613,32 @@ class CFMENavigateStep(NavigateStep):
     def post_navigate(self, *args, **kwargs):
         pass
 
-    def log_message(self, msg, level="debug"):
+    @property
+    def destination(self):
+        """Name of the destination, like ``InfraVm/Details``"""
         class_name = self.obj.__name__ if isclass(self.obj) else self.obj.__class__.__name__
-        str_msg = "[UI-NAV/{}/{}]: {}".format(class_name, self._name, msg)
+        return "{}/{}".format(class_name, self._name)
+
+    def log_message(self, msg, level="debug"):
+        str_msg = "[UI-NAV/{}]: {}".format(self.destination, msg)
         getattr(logger, level)(str_msg)
 
-    def construct_message(self, here, resetter, view, duration, waited):
+    def construct_message(self, here, resetter, view, duration, waited, deep_link=False):
         str_here = "Already Here" if here else "Needed Navigation"
+        str_deep_link = "Deep Link Used" if deep_link else "No Deep Link"
         str_resetter = "Resetter Used" if resetter else "No Resetter"
         str_view = "View Returned" if view else "No View Available"
         str_waited = "Waited on View" if waited else "No Wait on View"
-        return "{}/{}/{}/{} (elapsed {}ms)".format(
-            str_here, str_resetter, str_view, str_waited, duration
+        return "{}/{}/{}/{}/{} (elapsed {}ms)".format(
+            str_here, str_deep_link, str_resetter, str_view, str_waited, duration
         )
 
     def go(self, _tries=0, *args, **kwargs):
-        nav_args = {'use_resetter': True, 'wait_for_view': 10}
+        with profiler.span('navigate', self.destination):
+            return self._go(_tries, *args, **kwargs)
+
+    def _go(self, _tries, *args, **kwargs):
+        nav_args = {'use_resetter': True, 'wait_for_view': 10, 'use_deep_link': True}
         self.log_message("Beginning Navigation...", level="info")
         start_time = time.time()
         if _tries > 2:
@@ -526,16 +653,30 @@ class CFMENavigateStep(NavigateStep):
                 nav_args[arg] = kwargs.pop(arg)
         self.check_for_badness(self.pre_navigate, _tries, nav_args, *args, **kwargs)
         here = False
+        deep_link_used = False
         resetter_used = False
         waited = False
+        # The URL of a step with arguments may depend on them
+        use_deep_link = (
+            nav_args['use_deep_link'] and self.DEEP_LINK and self.VIEW is not None and
+            not args and not kwargs)
         try:
             here = self.check_for_badness(self.am_i_here, _tries, nav_args, *args, **kwargs)
         except Exception as e:
             self.log_message(
                 "Exception raised [{}] whilst checking if already here".format(e), level="error")
-        if not here:
+        if not here and use_deep_link:
+            try:
+                deep_link_used = bool(self.check_for_badness(
+                    self.follow_deep_link, _tries, nav_args, *args, **kwargs))
+            except Exception as e:
+                self.log_message(
+                    "Exception raised [{}] whilst following deep link".format(e), level="error")
+                self.appliance.browser.deep_links[self.deep_link_key] = None
+        if not here and not deep_link_used:
             self.log_message("Prerequisite Needed")
-            self.prerequisite_view = self.prerequisite()
+            with profiler.span('prerequisite'):
+                self.prerequisite_view = self.prerequisite()
             try:
                 self.check_for_badness(self.step, _tries, nav_args, *args, **kwargs)
             except (exceptions.CandidateNotFound, exceptions.ItemNotFound) as e:
@@ -554,12 +695,16 @@ class CFMENavigateStep(NavigateStep):
         if view and nav_args['wait_for_view'] and not os.environ.get(
                 'DISABLE_NAVIGATE_ASSERT', False):
             waited = True
-            wait_for(
-                lambda: view.is_displayed, num_sec=nav_args['wait_for_view'],
-                message="Waiting for view [{}] to display".format(view.__class__.__name__)
-            )
+            with profiler.span('wait_for_view'):
+                wait_for(
+                    lambda: view.is_displayed, num_sec=nav_args['wait_for_view'],
+                    message="Waiting for view [{}] to display".format(view.__class__.__name__)
+                )
+            if use_deep_link and not deep_link_used:
+                self.remember_deep_link()
         self.log_message(
-            self.construct_message(here, resetter_used, view, duration, waited), level="info"
+            self.construct_message(here, resetter_used, view, duration, waited, deep_link_used),
+            level="info"
         )
         return view
 
@@ -577,6 +722,12 @@ class ViaUI(Implementation):
     def __str__(self):
         return 'UI'
 
+    @cached_property
+    def deep_links(self):
+        """Deep links of the navigation steps, ``None`` for the steps which are not deep linkable,
+        see :py:class:`CFMENavigateStep`"""
+        return {}
+
     @cached_property
     def widgetastic(self):
         """This gives us a widgetastic browser."""
@@ -4,8 +4,9 @@
 
 """
 
-from time import sleep
-from threading import Thread, Event as ThreadEvent
+from collections import defaultdict
+from itertools import product
+from threading import Lock, Thread, Event as ThreadEvent
 
 from cfme.utils.log import create_sublogger
 from manageiq_client.filters import Q
@@ -93,8 +94,8 @@ class Event(object):
                 self.event_attrs['target_id'] = EventAttr(**{'target_id': o[0].id})
 
             except ValueError:
-                # Target isn't added yet. Need to wait
-                sleep(1)
+                # Target isn't added yet, it is resolved again with the next portion of events
+                pass
 
     def matches(self, evt):
         """ Compares common attributes of expected event and passed event."""
@@ -113,23 +114,122 @@ class Event(object):
 
     def build_from_entity(self, event_entity):
         """ Builds Event object from event Entity"""
-        for key, value in event_entity['_data'].items():
+        return self.build_from_data(event_entity['_data'])
+
+    def build_from_data(self, event_data):
+        """ Builds Event object from the data of an event returned by REST API"""
+        for key, value in event_data.items():
             self.add_attrs(EventAttr(**{key: value}))
         return self
 
 
+class ExpectedEvents(object):
+    """ Expected events of a listener, indexed by the attributes of :py:attr:`INDEX_ATTRS`.
+
+    Every arrived event is compared only with the expected events which can match it, instead of
+    all of them. Expected events are stored as dicts with ``event``, ``callback``,
+    ``matched_events`` and ``first_event`` keys.
+
+    :var INDEX_ATTRS: Attributes of the events used as the index key
+    """
+    INDEX_ATTRS = ('event_type', 'target_type')
+
+    def __init__(self):
+        self._lock = Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.expectations = []
+            # index key -> positions of the expected events in self.expectations
+            self._index = defaultdict(list)
+
+    def _key(self, event):
+        """ Index key of an expected event, None stands for any value of the attribute."""
+        key = []
+        for name in self.INDEX_ATTRS:
+            attr = event.event_attrs.get(name)
+            if attr is None or not attr.value or attr.cmp_func:
+                key.append(None)
+                continue
+            try:
+                hash(attr.value)
+            except TypeError:
+                key.append(None)
+            else:
+                key.append(attr.value)
+        return tuple(key)
+
+    def add(self, event, callback=None, first_event=False):
+        with self._lock:
+            self.expectations.append({'event': event,
+                                      'callback': callback,
+                                      'matched_events': [],
+                                      'first_event': first_event})
+            self._index[self._key(event)].append(len(self.expectations) - 1)
+
+    def waiting(self):
+        """ Returns the expected events which still accept events."""
+        return [exp_event for exp_event in self.expectations
+                if not (exp_event['first_event'] and exp_event['matched_events'])]
+
+    def candidates(self, got_event):
+        """ Returns the expected events which can match the got event, in the order of adding."""
+        with self._lock:
+            if any(name not in got_event.event_attrs for name in self.INDEX_ATTRS):
+                return list(self.expectations)
+            values = [(got_event.event_attrs[name].value, None) for name in self.INDEX_ATTRS]
+            positions = set()
+            for key in product(*values):
+                try:
+                    positions.update(self._index.get(key, []))
+                except TypeError:
+                    # unhashable value in the got event, cannot use the index
+                    return list(self.expectations)
+            return [self.expectations[position] for position in sorted(positions)]
+
+    def dispatch(self, got_event):
+        """ Compares the got event with the expected events and records the matches.
+
+        Calls the callbacks of the matched expected events.
+        """
+        for exp_event in self.candidates(got_event):
+            # Skip if event has occurred
+            if exp_event['first_event'] and exp_event['matched_events']:
+                continue
+            try:
+                if exp_event['event'].matches(got_event):
+                    if exp_event['callback']:
+                        exp_event['callback'](exp_event=exp_event['event'], got_event=got_event)
+                    exp_event['matched_events'].append(got_event)
+            except Exception:
+                logger.exception("An exception during matching events occurred.")
+
+    def __iter__(self):
+        return iter(self.expectations)
+
+    def __len__(self):
+        return len(self.expectations)
+
+
 class RestEventListener(Thread):
     """ EventListener accepts "expected" events, listens to db events and compares matched events
     with expected events. Runs callback function if expected events have it.
 
-    :var FILTER_ATTRS: List of filters used in REST API call
+    Every portion of new events in event_streams is fetched only once, with the events expanded
+    in the response of a single REST query per :py:attr:`PORTION_SIZE` events, and dispatched to
+    the expected events through :py:class:`ExpectedEvents`. The appliance cannot push the
+    events, so the listener polls, every :py:attr:`MIN_POLL_INTERVAL` seconds while the events
+    are coming and up to every :py:attr:`MAX_POLL_INTERVAL` seconds when they are not.
     """
-    FILTER_ATTRS = ['event_type', 'target_type', 'target_id', 'source']
+    MIN_POLL_INTERVAL = 1
+    MAX_POLL_INTERVAL = 4
+    PORTION_SIZE = 500
 
     def __init__(self, appliance):
         super(RestEventListener, self).__init__()
         self._appliance = appliance
-        self._events_to_listen = []
+        self._expected = ExpectedEvents()
         self._last_processed_id = 0  # this is used to filter out old or processed events
         self._stop_event = ThreadEvent()
 
@@ -178,17 +278,13 @@ class RestEventListener(Thread):
 
         for evt in evts:
             if isinstance(evt, Event):
-                exp_event = {'event': evt,
-                             'callback': callback,
-                             'matched_events': [],
-                             'first_event': first_event}
-                self._events_to_listen.append(exp_event)
+                self._expected.add(evt, callback=callback, first_event=first_event)
                 logger.info("event {} is added to listening queue.".format(evt))
             else:
                 raise ValueError("one of events doesn't belong to Event class")
 
     def start(self):
-        self._last_processed_id = self.get_max_record_id()
+        self._last_processed_id = self.get_max_record_id() or 0
         self._stop_event.clear()
         super(RestEventListener, self).start()
         logger.info('Event Listener has been started')
@@ -210,68 +306,62 @@ class RestEventListener(Thread):
 
         Processed events are ignored next time.
         """
-        while not self._stop_event.is_set():
-            sleep(1)
-            cur_last_record_id = self.get_max_record_id()
-            if not cur_last_record_id:
+        interval = self.MIN_POLL_INTERVAL
+        while not self._stop_event.wait(interval):
+            try:
+                events = self.get_next_portion()
+            except Exception:
+                logger.exception("An exception during fetching events occurred.")
+                events = []
+            if not events:
+                interval = min(interval * 2, self.MAX_POLL_INTERVAL)
                 continue
+            interval = self.MIN_POLL_INTERVAL
 
-            for exp_event in self._events_to_listen:
-
-                # Skip if event has occurred
-                if exp_event['first_event'] and len(exp_event['matched_events']):
-                    continue
-
-                matched_events = self.get_next_portion(exp_event['event'], cur_last_record_id)
-
-                if not matched_events:
-                    continue
-
-                # Match events
-                try:
-                    for event_entity in matched_events:
-                            got_event = Event(self._appliance).build_from_entity(event_entity)
-                            if exp_event['event'].matches(got_event):
-                                if exp_event['callback']:
-                                    exp_event['callback'](exp_event=exp_event['event'],
-                                                          got_event=got_event)
-                                exp_event['matched_events'].append(got_event)
-                except Exception:
-                    logger.exception("An exception during matching events occurred.")
+            # Expected events waiting for their targets to appear
+            for exp_event in self._expected.waiting():
+                exp_event['event'].process_id()
 
+            for got_event in events:
+                self._expected.dispatch(got_event)
                 if self._stop_event.is_set():
                     break
-            self._last_processed_id = cur_last_record_id
-
-    def get_next_portion(self, evt, max_id=None):
-        """ Returns list with one or more events matched with expected event.
 
-        Returns None if there is no matched events."""
-        evt.process_id()
+    def _fetch_events_after(self, last_id):
+        """ Returns the data of at most :py:attr:`PORTION_SIZE` events following ``last_id``.
 
-        q = Q('id', '>', self._last_processed_id)  # ensure we get only new events
-        if max_id:
-            q &= Q('id', '<=', max_id)
-
-        used_filters = set(self.FILTER_ATTRS).intersection(set(evt.event_attrs))
-        for filter_attr in used_filters:
-            evt_attr = evt.event_attrs[filter_attr]
-            if evt_attr.value:
-                q &= Q(filter_attr, '=', evt_attr.value)
-        result = self.event_streams.filter(q)
-
-        if len(result):
-            return result
+        The resources are expanded in the response, iterating the collection query instead would
+        reload every event entity with a request of its own.
+        """
+        query = '?expand=resources&filter[]=id>{}&sort_by=id&sort_order=asc&limit={}'.format(
+            last_id, self.PORTION_SIZE)
+        response = self._appliance.rest_api.get('{}{}'.format(self.event_streams._href, query))
+        return response.get('resources', [])
+
+    def get_next_portion(self):
+        """ Fetches all the events which arrived since the previous portion.
+
+        Returns a list of :py:class:`Event`, empty if there are no new events."""
+        events = []
+        while True:
+            resources = self._fetch_events_after(self._last_processed_id)
+            events.extend(Event(self._appliance).build_from_data(event_data)
+                          for event_data in resources)
+            if resources:
+                # only the events actually received are processed
+                self._last_processed_id = int(resources[-1]['id'])
+            if len(resources) < self.PORTION_SIZE or self._stop_event.is_set():
+                return events
 
     @property
     def got_events(self):
         """ Returns dict with expected events and all the events matched to expected ones."""
-        evts = [(evt['event'], len(evt['matched_events'])) for evt in self._events_to_listen]
+        evts = [(evt['event'], len(evt['matched_events'])) for evt in self._expected]
         logger.info(evts)
-        return self._events_to_listen
+        return self._expected.expectations
 
     def reset_events(self):
-        self._events_to_listen = []
+        self._expected.clear()
 
     def check_expected_events(self):
         """ Checks that all expected events has arrived."""
@@ -12,6 +12,7 @@ from sqlalchemy.sql.expression import func
 from time import sleep
 from threading import Thread, Event as ThreadEvent
 
+from cfme.utils.events import ExpectedEvents
 from cfme.utils.log import create_sublogger
 
 logger = create_sublogger('events')
@@ -285,13 +286,19 @@ class DbEventListener(Thread):
     """
      accepts "expected" events, listens to db events and compares showed up events with expected
      events. Runs callback function if expected events have it.
+
+     New events are read in portions of at most :py:attr:`PORTION_SIZE` rows and every one is
+     compared only with the expected events which can match it, see
+     :py:class:`cfme.utils.events.ExpectedEvents`.
     """
+    PORTION_SIZE = 500
+
     def __init__(self, appliance):
         super(DbEventListener, self).__init__()
         self._appliance = appliance
         self._tool = EventTool(self._appliance)
 
-        self._events_to_listen = []
+        self._expected = ExpectedEvents()
         # last_id is used to ignore already arrived messages the database
         # When database is "cleared" the id of the last event is placed here. That is then used
         # in queries to prevent events of this id and earlier to get in.
@@ -302,12 +309,9 @@ class DbEventListener(Thread):
         if evt:
             self._last_processed_id = evt.event_attrs['id'].value
         else:
-            try:
-                self._last_processed_id = self._tool.query(
-                    func.max(self._tool.event_streams.id)).one()
-            except IndexError:
-                # No events yet, so do nothing
-                pass
+            # No events yet when None
+            self._last_processed_id = self._tool.query(
+                func.max(self._tool.event_streams.id)).scalar() or 0
 
     def new_event(self, *attrs, **kwattrs):
         """
@@ -356,10 +360,7 @@ class DbEventListener(Thread):
             for evt in evts:
                 if isinstance(evt, Event):
                     logger.info("event {} is added to listening queue".format(evt))
-                    self._events_to_listen.append({'event': evt,
-                                                   'callback': callback,
-                                                   'matched_events': [],
-                                                   'first_event': first_event})
+                    self._expected.add(evt, callback=callback, first_event=first_event)
                 else:
                     raise ValueError("one of events doesn't belong to Event class")
         else:
@@ -395,14 +396,7 @@ class DbEventListener(Thread):
             for got_event in events:
                 logger.debug("processing event id {}".format(got_event.id))
                 got_event = Event(event_tool=self._tool).build_from_raw_event(got_event)
-                for exp_event in self._events_to_listen:
-                    if exp_event['first_event'] and len(exp_event['matched_events']) > 0:
-                        continue
-
-                    if exp_event['event'].matches(got_event):
-                        if exp_event['callback']:
-                            exp_event['callback'](exp_event=exp_event['event'], got_event=got_event)
-                        exp_event['matched_events'].append(got_event)
+                self._expected.dispatch(got_event)
                 self.set_last_record(got_event)
 
                 if self._stop_event.is_set():
@@ -413,22 +407,22 @@ class DbEventListener(Thread):
         """
         returns dict with expected events and all the events matched to expected ones
         """
-        evts = [(evt['event'], len(evt['matched_events'])) for evt in self._events_to_listen]
+        evts = [(evt['event'], len(evt['matched_events'])) for evt in self._expected]
         logger.info(evts)
-        return self._events_to_listen
+        return self._expected.expectations
 
     def reset_matches(self):
-        for event in self._events_to_listen:
+        for event in self._expected:
             event['matched_events'] = []
 
     def reset_events(self):
-        self._events_to_listen = []
+        self._expected.clear()
 
     def get_next_portion(self):
         logger.debug("obtaining next portion of events")
         return self._tool.query(self._tool.event_streams)\
             .filter(self._tool.event_streams.id > self._last_processed_id)\
-            .order_by(self._tool.event_streams.id).yield_per(100).all()
+            .order_by(self._tool.event_streams.id).limit(self.PORTION_SIZE).all()
 
     def check_expected_events(self):
         return all([len(event['matched_events']) for event in self.got_events])
@@ -1,4 +1,6 @@
 import re
+from threading import Event, Thread
+
 import pytest
 
 from .ssh import SSHTail
@@ -27,6 +29,13 @@ class LogValidator(object):
         skip_patterns: array of skip regex patterns
         failure_patterns: array of failure regex patterns
         matched_patterns: array of expected regex patterns to be matched
+        server_side_filter: if True, only the lines matching one of the patterns are transferred
+            from the appliance, filtered with ``grep -P``; the patterns must be valid for both
+            python and grep
+
+    The log can also be validated while the test runs, so that the lines are read in smaller
+    portions over time; call :py:meth:`start_streaming` after :py:meth:`fix_before_start`,
+    :py:meth:`validate_logs` stops it and reports what was found.
 
     Usage:
         .. code-block:: python
@@ -42,22 +51,68 @@ class LogValidator(object):
         self.skip_patterns = kwargs.pop('skip_patterns', [])
         self.failure_patterns = kwargs.pop('failure_patterns', [])
         self.matched_patterns = kwargs.pop('matched_patterns', [])
+        self.server_side_filter = kwargs.pop('server_side_filter', False)
 
         self._remote_file_tail = SSHTail(remote_filename, **kwargs)
         self.matches = {}
 
+        self._skip_re = _combined(self.skip_patterns)
+        self._failure_re = _combined(self.failure_patterns)
+        self._matched_re = _combined(self.matched_patterns)
+        self._stop_streaming = None
+        self._streaming_thread = None
+        self._streaming_failure = None
+
     def fix_before_start(self):
         self._remote_file_tail.set_initial_file_end()
 
+    def start_streaming(self, interval=10):
+        """Check the new log lines every ``interval`` seconds in a background thread"""
+        self._stop_streaming = Event()
+        self._streaming_thread = Thread(target=self._stream, args=(interval,))
+        self._streaming_thread.daemon = True
+        self._streaming_thread.start()
+
+    def _stream(self, interval):
+        while not self._stop_streaming.wait(interval):
+            try:
+                self._check_new_lines()
+            except pytest.fail.Exception as e:
+                # reported from the test's thread by validate_logs
+                self._streaming_failure = e
+                return
+            except Exception:
+                logger.exception('Streaming validation of the log failed, retrying')
+
     def validate_logs(self):
-        for line in self._remote_file_tail:
+        if self._streaming_thread is not None:
+            self._stop_streaming.set()
+            self._streaming_thread.join()
+            self._streaming_thread = None
+            if self._streaming_failure is not None:
+                raise self._streaming_failure
+        self._check_new_lines()
+        self._verify_match_logs()
+
+    def _new_lines(self):
+        if self.server_side_filter:
+            patterns = self.skip_patterns + self.failure_patterns + self.matched_patterns
+            if patterns:
+                # the checks use re.match, so the remote filter is anchored the same way
+                return self._remote_file_tail.grep_lines(
+                    '|'.join('^(?:{})'.format(pattern) for pattern in patterns))
+        return iter(self._remote_file_tail)
+
+    def _check_new_lines(self):
+        for line in self._new_lines():
             if self._check_skip_logs(line):
                 continue
             self._check_fail_logs(line)
             self._check_match_logs(line)
-        self._verify_match_logs()
 
     def _check_skip_logs(self, line):
+        if self._skip_re is not None and not self._skip_re.match(line):
+            return False
         for pattern in self.skip_patterns:
             if re.match(pattern, line):
                 logger.info('Skip pattern {} was matched on line {},\
@@ -66,11 +121,15 @@ class LogValidator(object):
         return False
 
     def _check_fail_logs(self, line):
+        if self._failure_re is not None and not self._failure_re.match(line):
+            return
         for pattern in self.failure_patterns:
             if re.match(pattern, line):
                 pytest.fail('Failure pattern {} was matched on line {}'.format(pattern, line))
 
     def _check_match_logs(self, line):
+        if self._matched_re is not None and not self._matched_re.match(line):
+            return
         for pattern in self.matched_patterns:
             if re.match(pattern, line):
                 logger.info('Expected pattern {} was matched on line {}'.format(pattern, line))
@@ -80,3 +139,17 @@ class LogValidator(object):
         for pattern in self.matched_patterns:
             if pattern not in self.matches:
                 pytest.fail('Expected pattern {} did not match'.format(pattern))
+
+
+def _combined(patterns):
+    """Compile one regex matching where any of ``patterns`` matches
+
+    Lets most lines be ruled out with a single match. Returns ``None`` if there are no patterns
+    or they can not be combined, in which case every pattern has to be checked.
+    """
+    if not patterns:
+        return None
+    try:
+        return re.compile('|'.join('(?:{})'.format(pattern) for pattern in patterns))
+    except re.error:
+        return None
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Profiler of the UI navigation.
+
+:py:class:`cfme.utils.appliance.implementations.ui.CFMENavigateStep` reports the nested spans of
+every navigation (the navigation itself, badness checks, ``am_i_here``, prerequisites, steps,
+resetters, waiting for the view) to :py:data:`profiler`. When enabled (``--nav-profile``, see
+:py:mod:`cfme.fixtures.nav_profiler`), the spans are aggregated into:
+
+* time and count of every destination,
+* time of every kind of span (exclusive of the nested spans),
+* count and time of the prerequisite chains of the navigations,
+* navigation time of every test,
+* folded stacks (``frame;frame;frame microseconds`` lines) for flame graph tools like
+  ``flamegraph.pl`` or speedscope.
+
+The aggregated data of several processes (parallelizer slaves) can be merged with
+:py:meth:`NavigationProfiler.merge`.
+"""
+import json
+import time
+from contextlib import contextmanager
+
+
+class NavigationProfiler(object):
+    """Aggregates the timing of nested navigation spans.
+
+    Args:
+        clock: Function returning the current time in seconds.
+    """
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        # open spans, [kind, name, start, time of the child spans, prerequisite chain]
+        self._stack = []
+        self.current_test = None
+        # destination -> [count, total time, max time]
+        self.destinations = {}
+        # span kind -> [count, exclusive time]
+        self.kinds = {}
+        # prerequisite chain -> [count, total time]
+        self.chains = {}
+        # test -> [navigations, total time]
+        self.tests = {}
+        # folded stack -> exclusive time
+        self.stacks = {}
+
+    @contextmanager
+    def span(self, kind, name=None):
+        """Measures the enclosed block as a span of ``kind``, nested in the currently open span.
+
+        Navigations are spans of ``'navigate'`` kind named by their destination.
+        """
+        if not self.enabled:
+            yield
+            return
+        frame = [kind, name, self.clock(), 0.0, [name] if kind == 'navigate' else None]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            self._close(frame, self.clock() - frame[2])
+
+    def _close(self, frame, duration):
+        kind, name, _, child_time, chain = frame
+        exclusive = duration - child_time
+        path = [self._frame_name(open_frame) for open_frame in self._stack]
+        path.append(self._frame_name(frame))
+        _add(self.stacks, ';'.join(path), [exclusive])
+        _add(self.kinds, kind, [1, exclusive])
+        if self._stack:
+            self._stack[-1][3] += duration
+        if kind != 'navigate':
+            return
+
+        count, total, maximum = self.destinations.get(name, (0, 0.0, 0.0))
+        self.destinations[name] = [count + 1, total + duration, max(maximum, duration)]
+        for open_frame in reversed(self._stack):
+            if open_frame[0] == 'navigate':
+                # a prerequisite of an enclosing navigation
+                open_frame[4].extend(chain)
+                return
+        if len(chain) > 1:
+            _add(self.chains, ' <- '.join(chain), [1, duration])
+        if self.current_test is not None:
+            _add(self.tests, self.current_test, [1, duration])
+
+    @staticmethod
+    def _frame_name(frame):
+        kind, name = frame[:2]
+        label = '{}:{}'.format(kind, name) if name is not None else kind
+        # ; separates the frames of the folded stacks
+        return label.replace(';', ',')
+
+    def start_test(self, test):
+        self.current_test = test
+
+    def finish_test(self):
+        self.current_test = None
+
+    def as_dict(self):
+        return {
+            'destinations': self.destinations,
+            'kinds': self.kinds,
+            'chains': self.chains,
+            'tests': self.tests,
+            'stacks': self.stacks,
+        }
+
+    def dump(self, path):
+        """Writes the aggregated data as JSON into the file ``path``"""
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f)
+
+    def merge(self, data):
+        """Adds the aggregated data of another profiler (:py:meth:`as_dict`) to this one"""
+        for name, (count, total, maximum) in data['destinations'].items():
+            own_count, own_total, own_maximum = self.destinations.get(name, (0, 0.0, 0.0))
+            self.destinations[name] = [
+                own_count + count, own_total + total, max(own_maximum, maximum)]
+        for attr in ('kinds', 'chains', 'tests', 'stacks'):
+            aggregated = getattr(self, attr)
+            for key, values in data[attr].items():
+                _add(aggregated, key, values)
+
+    def load(self, path):
+        """Merges the aggregated data dumped into the file ``path``"""
+        with open(path) as f:
+            self.merge(json.load(f))
+
+    def folded_stacks(self):
+        """Lines of the folded stacks with the exclusive time in microseconds"""
+        return ['{} {}'.format(stack, int(round(values[0] * 1000000)))
+                for stack, values in sorted(self.stacks.items())]
+
+    def report(self, top=20):
+        """Returns the text report of the slowest destinations, the most repeated prerequisite
+        chains and the tests spending the most time navigating."""
+        lines = []
+        total = sum(values[1] for values in self.kinds.values())
+        lines.append('Navigation time: {:.1f}s'.format(total))
+        lines.append('')
+        lines.append('Time by span kind (exclusive):')
+        for kind, (count, kind_time) in _top(self.kinds, 1, len(self.kinds)):
+            lines.append('  {:>10.1f}s {:>7} x {}'.format(kind_time, count, kind))
+        lines.append('')
+        lines.append('Slowest destinations (total time, count, mean, max):')
+        for name, (count, dest_time, maximum) in _top(self.destinations, 1, top):
+            lines.append('  {:>10.1f}s {:>7} x {:>7.2f}s {:>7.2f}s  {}'.format(
+                dest_time, count, dest_time / count, maximum, name))
+        lines.append('')
+        lines.append('Most repeated prerequisite chains (count, total time):')
+        for chain, (count, chain_time) in _top(self.chains, 0, top):
+            lines.append('  {:>7} x {:>10.1f}s  {}'.format(count, chain_time, chain))
+        lines.append('')
+        lines.append('Tests navigating the longest (total time, navigations):')
+        for test, (count, test_time) in _top(self.tests, 1, top):
+            lines.append('  {:>10.1f}s {:>7} x  {}'.format(test_time, count, test))
+        return '\n'.join(lines)
+
+
+def _add(aggregated, key, values):
+    """Adds the values to the values aggregated under the key"""
+    current = aggregated.get(key)
+    if current is None:
+        aggregated[key] = list(values)
+    else:
+        aggregated[key] = [a + b for a, b in zip(current, values)]
+
+
+def _top(aggregated, index, count):
+    """The ``count`` items of the aggregated dict with the highest value at ``index``"""
+    return sorted(aggregated.items(), key=lambda item: item[1][index], reverse=True)[:count]
+
+
+#: The profiler the navigation reports to
+profiler = NavigationProfiler()
@@ -3,6 +3,7 @@
 appliance.
 """
 import csv
+import multiprocessing
 import subprocess
 from datetime import datetime
 from datetime import timedelta
@@ -36,6 +37,21 @@ miqmsg_deq = re.compile(r'Dequeued\sin:\s\[([0-9\.]*)\]\sseconds')
 # Delivered in [ * ] seconds
 miqmsg_del = re.compile(r'Delivered\sin\s\[([0-9\.]*)\]\sseconds')
 
+# Expressions used by the message parser, which works on the raw bytes of the log:
+# timestamp, pid and the (last) MIQ(...) method of a line in one search
+miqmsg_line = re.compile(
+    br'\[----\]\s[IWE],\s\[([0-9\-]+)T([0-9\:\.]+)\s#([0-9]+):[0-9a-z]+\]'
+    br'.*MIQ\(([a-zA-Z0-9\._]*)\)')
+# the fields of the MiqQueue message lines
+miqmsg_id_b = re.compile(miqmsg_id.pattern.encode('ascii'))
+miqmsg_cmd_b = re.compile(miqmsg_cmd.pattern.encode('ascii'))
+miqmsg_args_b = re.compile(miqmsg_args.pattern.encode('ascii'))
+miqmsg_deq_b = re.compile(miqmsg_deq.pattern.encode('ascii'))
+miqmsg_del_b = re.compile(miqmsg_del.pattern.encode('ascii'))
+
+# Size of the evm.log pieces parsed by each process when parsing in parallel, in bytes
+EVM_CHUNK_SIZE = 64 * 1024 * 1024
+
 # Worker related regular expressions:
 # MIQ(PriorityWorker) ID [15], PID [6461]
 miqwkr = re.compile(r'MIQ\(([A-Za-z]*)\)\sID\s\[([0-9]*)\],\sPID\s\[([0-9]*)\]')
@@ -60,7 +76,123 @@ miq_top = re.compile(r'([0-9]+)\s+[0-9]+\s+[A-Za-z0-9]+\s+[0-9]+\s+[0-9\-]+\s+([
     r'([0-9\.mg]+)\s+([0-9\.mg]+)\s+[SRDZ]\s+([0-9\.]+)\s+([0-9\.]+)')
 
 
-def evm_to_messages(evm_file, filters):
+def _search_field(regex, line, convert=None):
+    result = regex.search(line)
+    if result:
+        value = result.group(1).decode('ascii')
+        return convert(value) if convert else value
+    return False
+
+
+def _parse_message_line(line, method, ts, pid):
+    """Parse a MiqQueue message log line into a record for :py:func:`evm_to_messages`"""
+    msg_id = _search_field(miqmsg_id_b, line)
+    if method == 'MiqQueue.put':
+        return (method, msg_id, ts, pid, _search_field(miqmsg_cmd_b, line),
+                _search_field(miqmsg_args_b, line))
+    if method == 'MiqQueue.get_via_drb':
+        return method, msg_id, ts, pid, _search_field(miqmsg_deq_b, line, float), None
+    return method, msg_id, ts, pid, _search_field(miqmsg_del_b, line, float), None
+
+
+def _parse_evm_chunk(chunk):
+    """Parse the lines of an evm.log starting within a byte range
+
+    Args:
+        chunk: tuple of the file name, and the start and end offsets of the range
+
+    Returns:
+        A tuple of the number of lines, the first MIQ timestamp (or ``''``) and a list of
+        ``(line #, record)`` tuples for the MiqQueue message lines, where each record is a tuple
+        of the method, message id, timestamp, pid and up to two method specific fields
+    """
+    evm_file, start, end = chunk
+    first_ts = ''
+    records = []
+    with open(evm_file, 'rb') as evmlogfile:
+        if start:
+            # the line which started in the previous chunk belongs to it
+            evmlogfile.seek(start - 1)
+            evmlogfile.readline()
+        data = evmlogfile.read(max(end - evmlogfile.tell(), 0))
+        if data and not data.endswith(b'\n'):
+            # finish the line crossing the end of the chunk
+            data += evmlogfile.readline()
+    line_count = data.count(b'\n')
+    if data and not data.endswith(b'\n'):
+        line_count += 1
+    # Rather than looking at every line, jump from one MIQ line to the next; only MiqQueue lines
+    # matter once the first MIQ line is found
+    needle = b'MIQ('
+    line_no, counted = 1, 0
+    position = data.find(needle)
+    while position != -1:
+        line_start = data.rfind(b'\n', 0, position) + 1
+        line_end = data.find(b'\n', position)
+        if line_end == -1:
+            line_end = len(data)
+        line_no += data.count(b'\n', counted, line_start)
+        counted = line_start
+        position = data.find(needle, line_end)
+
+        line = data[line_start:line_end]
+        line_result = miqmsg_line.search(line)
+        if line_result:
+            date, time_of_day, pid, method = line_result.groups()
+            ts = '{} {}'.format(date.decode('ascii'), time_of_day.decode('ascii'))
+            pid = pid.decode('ascii')
+            method = method.decode('ascii')
+        else:
+            # MIQ line without the usual stamp in front of it
+            text_line = line.decode('utf-8', 'replace')
+            line_result = miqmsg.search(text_line)
+            if not line_result:
+                continue
+            ts, pid = get_msg_timestamp_pid(text_line)
+            method = line_result.group(1)
+        if first_ts == '':
+            first_ts = ts
+            needle = b'MIQ(MiqQueue.'
+            position = data.find(needle, line_end)
+        if method in ('MiqQueue.put', 'MiqQueue.get_via_drb', 'MiqQueue.delivered'):
+            records.append((line_no, _parse_message_line(line, method, ts, pid)))
+    return line_count, first_ts, records
+
+
+def _evm_chunks(evm_file, chunk_size):
+    size = os.path.getsize(evm_file)
+    return [(evm_file, start, min(start + chunk_size, size))
+            for start in range(0, size, chunk_size)] or [(evm_file, 0, 0)]
+
+
+def iter_evm_chunks(evm_file, processes=1, chunk_size=None):
+    """Parse an evm.log piece by piece, yielding the results of each piece in the order of the log
+
+    With more than one process, pieces of ``chunk_size`` bytes of the log are parsed in parallel
+    by a pool of processes, so results are available long before the whole log is parsed.
+
+    Yields:
+        Tuples of the number of lines before the piece and the result of
+        :py:func:`_parse_evm_chunk` for the piece
+    """
+    chunks = _evm_chunks(evm_file, chunk_size or EVM_CHUNK_SIZE)
+    if processes > 1 and len(chunks) > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(_parse_evm_chunk, chunks)
+    else:
+        pool = None
+        results = (_parse_evm_chunk(chunk) for chunk in chunks)
+    line_offset = 0
+    try:
+        for result in results:
+            yield line_offset, result
+            line_offset += result[0]
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def evm_to_messages(evm_file, filters, processes=1):
     test_start = ''
     test_end = ''
     line_count = 0
@@ -68,76 +200,56 @@ def evm_to_messages(evm_file, filters):
     msg_cmds = {}
 
     runningtime = time()
-    evmlogfile = open(evm_file, 'r')
-    evm_log_line = evmlogfile.readline()
-    while evm_log_line:
-        line_count += 1
-        evm_log_line = evm_log_line.strip()
-
-        miqmsg_result = miqmsg.search(evm_log_line)
-        if miqmsg_result:
-
-            # Obtains the first timestamp in the log file
-            if test_start == '':
-                ts, pid = get_msg_timestamp_pid(evm_log_line)
-                test_start = ts
+    for line_offset, (chunk_lines, chunk_start, records) in iter_evm_chunks(evm_file, processes):
+        # Obtains the first timestamp in the log file
+        if test_start == '':
+            test_start = chunk_start
+        line_count = line_offset + chunk_lines
+        for line_no, (method, msg_id, ts, pid, field, msg_args) in records:
+            line_no += line_offset
 
             # A message was first put on the queue, this starts its queuing time
-            if (miqmsg_result.group(1) == 'MiqQueue.put'):
-
-                msg_cmd = get_msg_cmd(evm_log_line)
-                msg_id = get_msg_id(evm_log_line)
+            if method == 'MiqQueue.put':
                 if msg_id:
-                    ts, pid = get_msg_timestamp_pid(evm_log_line)
                     test_end = ts
-                    messages[msg_id] = MiqMsgStat()
-                    messages[msg_id].msg_id = msg_id
-                    messages[msg_id].msg_id = '\'' + msg_id + '\''
-                    messages[msg_id].msg_cmd = msg_cmd
-                    messages[msg_id].pid_put = pid
-                    messages[msg_id].puttime = ts
-                    msg_args = get_msg_args(evm_log_line)
+                    msg = messages[msg_id] = MiqMsgStat()
+                    msg.msg_id = '\'' + msg_id + '\''
+                    msg.msg_cmd = field
+                    msg.pid_put = pid
+                    msg.puttime = ts
                     if msg_args is False:
-                        logger.debug('Could not obtain message args line #: %s', line_count)
+                        logger.debug('Could not obtain message args line #: %s', line_no)
                     else:
-                        messages[msg_id].msg_args = msg_args
+                        msg.msg_args = msg_args
                 else:
-                    logger.error('Could not obtain message id, line #: %s', line_count)
+                    logger.error('Could not obtain message id, line #: %s', line_no)
 
-            elif (miqmsg_result.group(1) == 'MiqQueue.get_via_drb'):
-                msg_id = get_msg_id(evm_log_line)
+            elif method == 'MiqQueue.get_via_drb':
                 if msg_id:
                     if msg_id in messages:
-                        ts, pid = get_msg_timestamp_pid(evm_log_line)
                         test_end = ts
                         messages[msg_id].pid_get = pid
                         messages[msg_id].gettime = ts
-                        messages[msg_id].deq_time = get_msg_deq(evm_log_line)
+                        messages[msg_id].deq_time = field
                     else:
                         logger.error('Message ID not in dictionary: %s', msg_id)
                 else:
-                    logger.error('Could not obtain message id, line #: %s', line_count)
+                    logger.error('Could not obtain message id, line #: %s', line_no)
 
-            elif (miqmsg_result.group(1) == 'MiqQueue.delivered'):
-                msg_id = get_msg_id(evm_log_line)
+            else:
                 if msg_id:
-                    ts, pid = get_msg_timestamp_pid(evm_log_line)
                     test_end = ts
                     if msg_id in messages:
-                        messages[msg_id].del_time = get_msg_del(evm_log_line)
-                        messages[msg_id].total_time = messages[msg_id].deq_time + \
-                            messages[msg_id].del_time
+                        messages[msg_id].del_time = field
+                        messages[msg_id].total_time = messages[msg_id].deq_time + field
                     else:
                         logger.error('Message ID not in dictionary: %s', msg_id)
                 else:
-                    logger.error('Could not obtain message id, line #: %s', line_count)
-
-        if (line_count % 100000) == 0:
-            timediff = time() - runningtime
-            runningtime = time()
-            logger.info('Count {} : Parsed 100000 lines in %s', line_count, timediff)
+                    logger.error('Could not obtain message id, line #: %s', line_no)
 
-        evm_log_line = evmlogfile.readline()
+        timediff = time() - runningtime
+        runningtime = time()
+        logger.info('Count %s : Parsed %s lines in %s', line_count, chunk_lines, timediff)
 
     # I tried to avoid two loops but this reduced the complexity of filtering on messages.
     # By filtering over messages, we can better display what is occuring under the covers, as a
@@ -799,7 +911,7 @@ def top_to_workers(workers, top_file):
     return top_workers, len(top_lines)
 
 
-def perf_process_evm(evm_file, top_file):
+def perf_process_evm(evm_file, top_file, processes=1):
     msg_filters = {
         '-hourly': re.compile(r'\"[0-9\-]*T[0-9\:]*Z\",\s\"hourly\"'),
         '-daily': re.compile(r'\"[0-9\-]*T[0-9\:]*Z\",\s\"daily\"'),
@@ -813,7 +925,8 @@ def perf_process_evm(evm_file, top_file):
     initialtime = starttime
 
     logger.info('----------- Parsing evm log file for messages -----------')
-    messages, msg_cmds, test_start, test_end, msg_lc = evm_to_messages(evm_file, msg_filters)
+    messages, msg_cmds, test_start, test_end, msg_lc = evm_to_messages(evm_file, msg_filters,
+                                                                      processes)
     timediff = time() - starttime
     logger.info('----------- Completed Parsing evm log file -----------')
     logger.info('Parsed %s lines of evm log file for messages in %s', msg_lc, timediff)
@@ -1033,10 +1146,12 @@ def perf_process_evm(evm_file, top_file):
 
 
 class MiqMsgStat(object):
+    # slotted, a long perf run logs millions of messages
+    __slots__ = ('msg_id', 'msg_cmd', 'msg_args', 'pid_put', 'pid_get', 'puttime', 'gettime',
+        'deq_time', 'del_time', 'total_time')
+    headers = list(__slots__)
 
     def __init__(self):
-        self.headers = ['msg_id', 'msg_cmd', 'msg_args', 'pid_put', 'pid_get', 'puttime', 'gettime',
-            'deq_time', 'del_time', 'total_time']
         self.msg_id = ''
         self.msg_cmd = ''
         self.msg_args = ''
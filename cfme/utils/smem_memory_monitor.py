@@ -1,9 +1,13 @@
 """Monitor Memory on a CFME/Miq appliance and builds report&graphs displaying usage per process."""
 import json
+import shutil
+import tempfile
 import time
 import traceback
+from array import array
 from collections import OrderedDict
 from datetime import datetime
+from itertools import chain
 from threading import Thread
 
 import os
@@ -14,6 +18,7 @@ from yaycl import AttrDict
 from cfme.utils.conf import cfme_performance
 from cfme.utils.log import logger
 from cfme.utils.path import results_path
+from cfme.utils.path import scripts_data_path
 from cfme.utils.version import current_version
 from cfme.utils.version import get_version
 
@@ -134,9 +139,170 @@ test_ts = time.strftime('%Y%m%d%H%M%S')
 # 10s sample interval (occasionally sampling can take almost 4s on an appliance doing a lot of work)
 SAMPLE_INTERVAL = 10
 
+appliance_measurements = ['total', 'free', 'used', 'buffers', 'cached', 'slab', 'swap_total',
+    'swap_free']
+process_measurements = ['rss', 'pss', 'uss', 'vss', 'swap']
+
+# Sampler collection mode: scripts/data/smem-sampler.sh samples on the appliance itself into a
+# ring buffer of files, and the monitor fetches all new samples with one command every
+# SAMPLE_INTERVAL. The ring buffer has to hold more than SAMPLE_INTERVAL worth of samples.
+SAMPLER_SCRIPT = scripts_data_path.join('smem-sampler.sh')
+SAMPLER_REMOTE_SCRIPT = '/var/tmp/smem-sampler.sh'
+SAMPLER_REMOTE_DIR = '/var/tmp/smem-samples'
+SAMPLER_RING_SIZE = 600
+# The evm worker pids come from the database, query it every n samples only
+SAMPLER_WORKERS_EVERY = 10
+
+# Samples of a series held in memory before they are spilled to disk (a day of 10s samples)
+SPILL_SIZE = 8640
+
+
+class MemorySamples(object):
+    """Columnar store of the memory samples of the appliance or of a single process
+
+    The sample times (seconds since the epoch) and every measurement are kept in their own
+    ``array`` of doubles, so a multi-day run costs 8 bytes per value instead of a dict per sample.
+    With a ``spill_dir``, every ``spill_size`` samples are moved out of memory into a file in it,
+    only read back when a whole column is asked for.
+    """
+    def __init__(self, measurements, spill_dir=None, spill_size=SPILL_SIZE):
+        self.measurements = list(measurements)
+        self.spill_dir = spill_dir
+        self.spill_size = spill_size
+        self.spill_file = None
+        self.spilled = 0
+        self.first = None
+        self.last = None
+        self._columns = [array('d') for _ in range(len(self.measurements) + 1)]
+
+    def __len__(self):
+        return self.spilled + len(self._columns[0])
+
+    def append(self, sample_time, values):
+        """Add a sample taken at ``sample_time`` with a dict of values of all the measurements"""
+        row = [sample_time] + [values[measurement] for measurement in self.measurements]
+        for column, value in zip(self._columns, row):
+            column.append(value)
+        if self.first is None:
+            self.first = row
+        self.last = row
+        if self.spill_dir and len(self._columns[0]) >= self.spill_size:
+            self._spill()
+
+    def _spill(self):
+        if self.spill_file is None:
+            handle, self.spill_file = tempfile.mkstemp(dir=self.spill_dir, suffix='.samples')
+            os.close(handle)
+        rows = array('d', chain.from_iterable(six.moves.zip(*self._columns)))
+        with open(self.spill_file, 'ab') as spill_file:
+            rows.tofile(spill_file)
+        self.spilled += len(self._columns[0])
+        self._columns = [array('d') for _ in self._columns]
+
+    def _column(self, index):
+        values = array('d')
+        if self.spilled:
+            width = len(self._columns)
+            with open(self.spill_file, 'rb') as spill_file:
+                values.fromfile(spill_file, self.spilled * width)
+            values = values[index::width]
+        values.extend(self._columns[index])
+        return values
+
+    def column(self, measurement):
+        """All the values of a measurement, as an ``array`` of doubles"""
+        return self._column(self.measurements.index(measurement) + 1)
+
+    @property
+    def times(self):
+        return self._column(0)
+
+    @property
+    def dates(self):
+        return [datetime.fromtimestamp(sample_time) for sample_time in self.times]
+
+    @property
+    def start(self):
+        return datetime.fromtimestamp(self.first[0])
+
+    @property
+    def end(self):
+        return datetime.fromtimestamp(self.last[0])
+
+    def start_value(self, measurement):
+        return self.first[self.measurements.index(measurement) + 1]
+
+    def end_value(self, measurement):
+        return self.last[self.measurements.index(measurement) + 1]
+
+    def rows(self):
+        """Iterate over the samples as tuples of the sample datetime and the measurements"""
+        columns = [self._column(index) for index in range(len(self._columns))]
+        for row in six.moves.zip(*columns):
+            yield (datetime.fromtimestamp(row[0]),) + tuple(row[1:])
+
+    def statistics(self, measurement):
+        """Minimum, maximum, average and growth of a measurement
+
+        Returns:
+            A tuple of the minimum, maximum and average of the measurement, and its growth in
+            MiB/hour from the least squares line through all the samples
+        """
+        # Import here to allow perf to install numpy separately
+        import numpy
+
+        values = numpy.frombuffer(self.column(measurement), dtype=numpy.float64)
+        hours = numpy.frombuffer(self.times, dtype=numpy.float64)
+        hours = (hours - hours[0]) / 3600
+        if len(values) > 1 and hours[-1] > 0:
+            growth = numpy.polyfit(hours, values, 1)[0]
+        else:
+            growth = 0.0
+        return values.min(), values.max(), values.mean(), growth
+
+    def close(self):
+        """Remove the spilled samples from disk"""
+        if self.spill_file is not None:
+            os.remove(self.spill_file)
+            self.spill_file = None
+
+
+def parse_sampler_output(output):
+    """Split the output of ``smem-sampler.sh fetch`` into samples
+
+    Returns:
+        A list of ``(sample #, sample time, sections)`` tuples sorted by sample number, where
+        sections maps the section names to their text. Incomplete samples are left out.
+    """
+    samples = {}
+    header, sections, section = None, {}, None
+    for line in output.split('\n'):
+        if line.startswith('@@'):
+            name = line[2:].split(' ')
+            if name[0] == 'sample':
+                header, sections = (int(name[1]), float(name[2])), {}
+            elif name[0] == 'end':
+                if header is not None:
+                    samples[header[0]] = header + (
+                        dict((key, '\n'.join(value)) for key, value in sections.items()),)
+                header = None
+            else:
+                section = sections[name[0]] = []
+        elif header is not None and section is not None:
+            section.append(line)
+    return [samples[number] for number in sorted(samples)]
+
 
 class SmemMemoryMonitor(Thread):
-    def __init__(self, ssh_client, scenario_data):
+    """Samples appliance and per process memory until :py:attr:`signal` is cleared, then reports
+
+    By default every sample costs three ssh commands (meminfo, worker pids, smem). With a
+    ``sampler_interval`` (seconds, may be below one), a sampler script on the appliance takes the
+    samples at that rate instead and the monitor only fetches them in batches. Defaults to
+    ``tools/smem_sampler/interval`` of the performance configuration.
+    """
+    def __init__(self, ssh_client, scenario_data, sampler_interval=None,
+            sampler_ring_size=SAMPLER_RING_SIZE, sampler_workers_every=SAMPLER_WORKERS_EVERY):
         super(SmemMemoryMonitor, self).__init__()
         self.ssh_client = ssh_client
         self.scenario_data = scenario_data
@@ -144,26 +310,24 @@ class SmemMemoryMonitor(Thread):
         self.miq_server_id = ''
         self.use_slab = False
         self.signal = True
+        self.spill_dir = None
+        if sampler_interval is None:
+            sampler_interval = cfme_performance.get('tools', {}).get('smem_sampler', {}).get(
+                'interval')
+        self.sampler_interval = sampler_interval
+        self.sampler_ring_size = sampler_ring_size
+        self.sampler_workers_every = sampler_workers_every
 
     def create_process_result(self, process_results, starttime, process_pid, process_name,
             memory_by_pid):
         if process_pid in memory_by_pid.keys():
             if process_name not in process_results:
                 process_results[process_name] = OrderedDict()
-                process_results[process_name][process_pid] = OrderedDict()
             if process_pid not in process_results[process_name]:
-                process_results[process_name][process_pid] = OrderedDict()
-            process_results[process_name][process_pid][starttime] = {}
-            rss_mem = memory_by_pid[process_pid]['rss']
-            pss_mem = memory_by_pid[process_pid]['pss']
-            uss_mem = memory_by_pid[process_pid]['uss']
-            vss_mem = memory_by_pid[process_pid]['vss']
-            swap_mem = memory_by_pid[process_pid]['swap']
-            process_results[process_name][process_pid][starttime]['rss'] = rss_mem
-            process_results[process_name][process_pid][starttime]['pss'] = pss_mem
-            process_results[process_name][process_pid][starttime]['uss'] = uss_mem
-            process_results[process_name][process_pid][starttime]['vss'] = vss_mem
-            process_results[process_name][process_pid][starttime]['swap'] = swap_mem
+                process_results[process_name][process_pid] = MemorySamples(process_measurements,
+                    self.spill_dir)
+            process_results[process_name][process_pid].append(starttime,
+                memory_by_pid[process_pid])
             del memory_by_pid[process_pid]
         else:
             logger.warn('Process {} PID, not found: {}'.format(process_name, process_pid))
@@ -174,41 +338,48 @@ class SmemMemoryMonitor(Thread):
         # 5.4 - RHEL 6 / Centos 6
         # Application Memory Used : MemTotal - (MemFree + Buffers + Cached)
         # Available memory could potentially be better metric
-        appliance_results[plottime] = {}
-
         result = self.ssh_client.run_command('cat /proc/meminfo')
         if result.failed:
             logger.error('Exit_status nonzero in get_appliance_memory: {}, {}'
                          .format(result.rc, result.output))
-            del appliance_results[plottime]
         else:
-            meminfo_raw = result.output.replace('kB', '').strip()
-            meminfo = OrderedDict((k.strip(), v.strip()) for k, v in
-                (value.strip().split(':') for value in meminfo_raw.split('\n')))
-            appliance_results[plottime]['total'] = float(meminfo['MemTotal']) / 1024
-            appliance_results[plottime]['free'] = float(meminfo['MemFree']) / 1024
-            if 'MemAvailable' in meminfo:  # 5.5, RHEL 7/Centos 7
-                self.use_slab = True
-                mem_used = (float(meminfo['MemTotal']) - (float(meminfo['MemFree']) + float(
-                    meminfo['Slab']) + float(meminfo['Cached']))) / 1024
-            else:  # 5.4, RHEL 6/Centos 6
-                mem_used = (float(meminfo['MemTotal']) - (float(meminfo['MemFree']) + float(
-                    meminfo['Buffers']) + float(meminfo['Cached']))) / 1024
-            appliance_results[plottime]['used'] = mem_used
-            appliance_results[plottime]['buffers'] = float(meminfo['Buffers']) / 1024
-            appliance_results[plottime]['cached'] = float(meminfo['Cached']) / 1024
-            appliance_results[plottime]['slab'] = float(meminfo['Slab']) / 1024
-            appliance_results[plottime]['swap_total'] = float(meminfo['SwapTotal']) / 1024
-            appliance_results[plottime]['swap_free'] = float(meminfo['SwapFree']) / 1024
+            appliance_results.append(plottime, self.parse_appliance_memory(result.output))
+
+    def parse_appliance_memory(self, output):
+        """Appliance memory measurements from the contents of /proc/meminfo"""
+        sample = {}
+        meminfo_raw = output.replace('kB', '').strip()
+        meminfo = OrderedDict((k.strip(), v.strip()) for k, v in
+            (value.strip().split(':') for value in meminfo_raw.split('\n')))
+        sample['total'] = float(meminfo['MemTotal']) / 1024
+        sample['free'] = float(meminfo['MemFree']) / 1024
+        if 'MemAvailable' in meminfo:  # 5.5, RHEL 7/Centos 7
+            self.use_slab = True
+            mem_used = (float(meminfo['MemTotal']) - (float(meminfo['MemFree']) + float(
+                meminfo['Slab']) + float(meminfo['Cached']))) / 1024
+        else:  # 5.4, RHEL 6/Centos 6
+            mem_used = (float(meminfo['MemTotal']) - (float(meminfo['MemFree']) + float(
+                meminfo['Buffers']) + float(meminfo['Cached']))) / 1024
+        sample['used'] = mem_used
+        sample['buffers'] = float(meminfo['Buffers']) / 1024
+        sample['cached'] = float(meminfo['Cached']) / 1024
+        sample['slab'] = float(meminfo['Slab']) / 1024
+        sample['swap_total'] = float(meminfo['SwapTotal']) / 1024
+        sample['swap_free'] = float(meminfo['SwapFree']) / 1024
+        return sample
 
     def get_evm_workers(self):
         result = self.ssh_client.run_command(
             'psql -t -q -d vmdb_production -c '
             '\"select pid,type from miq_workers where miq_server_id = \'{}\'\"'.format(
                 self.miq_server_id))
-        if result.output.strip():
+        return self.parse_evm_workers(result.output)
+
+    def parse_evm_workers(self, output):
+        """Mapping of pid to worker type from the output of the miq_workers query"""
+        if output.strip():
             workers = {}
-            for worker in result.output.strip().split('\n'):
+            for worker in output.strip().split('\n'):
                 pid_worker = worker.strip().split('|')
                 if len(pid_worker) == 2:
                     workers[pid_worker[0].strip()] = pid_worker[1].strip()
@@ -248,7 +419,11 @@ class SmemMemoryMonitor(Thread):
     def get_pids_memory(self):
         result = self.ssh_client.run_command(
             'smem -c \'pid rss pss uss vss swap name command\' | sed 1d')
-        pids_memory = result.output.strip().split('\n')
+        return self.parse_pids_memory(result.output)
+
+    def parse_pids_memory(self, output):
+        """Per process memory measurements from smem output"""
+        pids_memory = output.strip().split('\n')
         memory_by_pid = {}
         for line in pids_memory:
             if line.strip():
@@ -267,91 +442,152 @@ class SmemMemoryMonitor(Thread):
                 except Exception as e:
                     logger.error('Processing smem output error: {}'.format(e.__class__.__name__, e))
                     logger.error('Issue with pid: {} line: {}'.format(pid, line))
-                    logger.error('Complete smem output: {}'.format(result.output))
+                    logger.error('Complete smem output: {}'.format(output))
         return memory_by_pid
 
+    def record_process_results(self, process_results, starttime, workers, memory_by_pid):
+        """Sort the per process measurements of a sample out into the monitored processes"""
+        for worker_pid in workers:
+            self.create_process_result(process_results, starttime, worker_pid,
+                workers[worker_pid], memory_by_pid)
+
+        for pid in sorted(memory_by_pid.keys()):
+            if memory_by_pid[pid]['name'] == 'httpd':
+                self.create_process_result(process_results, starttime, pid, 'httpd',
+                    memory_by_pid)
+            elif memory_by_pid[pid]['name'] == 'postgres':
+                self.create_process_result(process_results, starttime, pid, 'postgres',
+                    memory_by_pid)
+            elif memory_by_pid[pid]['name'] == 'postmaster':
+                self.create_process_result(process_results, starttime, pid, 'postgres',
+                    memory_by_pid)
+            elif memory_by_pid[pid]['name'] == 'memcached':
+                self.create_process_result(process_results, starttime, pid, 'memcached',
+                    memory_by_pid)
+            elif memory_by_pid[pid]['name'] == 'collectd':
+                self.create_process_result(process_results, starttime, pid, 'collectd',
+                    memory_by_pid)
+            elif memory_by_pid[pid]['name'] == 'ruby':
+                if 'evm_server.rb' in memory_by_pid[pid]['cmd']:
+                    self.create_process_result(process_results, starttime, pid,
+                        'MIQ Server (evm_server.rb)', memory_by_pid)
+                elif 'MIQ Server' in memory_by_pid[pid]['cmd']:
+                    self.create_process_result(process_results, starttime, pid,
+                        'MIQ Server (evm_server.rb)', memory_by_pid)
+                elif 'evm_watchdog.rb' in memory_by_pid[pid]['cmd']:
+                    self.create_process_result(process_results, starttime, pid,
+                        'evm_watchdog.rb', memory_by_pid)
+                elif 'appliance_console.rb' in memory_by_pid[pid]['cmd']:
+                    self.create_process_result(process_results, starttime, pid,
+                        'appliance_console.rb', memory_by_pid)
+                elif 'evm:dbsync:replicate' in memory_by_pid[pid]['cmd']:
+                    self.create_process_result(process_results, starttime, pid,
+                        'evm:dbsync:replicate', memory_by_pid)
+                else:
+                    logger.debug('Unaccounted for ruby pid: {}'.format(pid))
+
+    def start_sampler(self):
+        """Deploy and start the sampler script on the appliance, returns whether it is running"""
+        if self.sampler_ring_size * self.sampler_interval <= SAMPLE_INTERVAL:
+            logger.warn('Sampler ring buffer of {} samples every {}s overflows between fetches'
+                .format(self.sampler_ring_size, self.sampler_interval))
+        try:
+            self.ssh_client.put_file(SAMPLER_SCRIPT.strpath, SAMPLER_REMOTE_SCRIPT)
+        except Exception as e:
+            logger.error('Could not install the memory sampler, sampling over ssh instead: {}'
+                .format(e))
+            return False
+        result = self.ssh_client.run_command('bash {} start {} {} {} {} {}'.format(
+            SAMPLER_REMOTE_SCRIPT, SAMPLER_REMOTE_DIR, self.sampler_interval,
+            self.sampler_ring_size, self.sampler_workers_every, self.miq_server_id))
+        if result.failed:
+            logger.error('Could not start the memory sampler, sampling over ssh instead: {}, {}'
+                .format(result.rc, result.output))
+            return False
+        logger.info('Started the memory sampler, sampling every {}s'.format(
+            self.sampler_interval))
+        return True
+
+    def stop_sampler(self):
+        self.ssh_client.run_command('bash {} stop {}'.format(SAMPLER_REMOTE_SCRIPT,
+            SAMPLER_REMOTE_DIR))
+
+    def fetch_samples(self, appliance_results, process_results, last_sample, workers):
+        """Fetch and record the samples the sampler took since ``last_sample``
+
+        Returns:
+            A tuple of the number of the last sample recorded and the latest evm worker pids
+        """
+        result = self.ssh_client.run_command('bash {} fetch {} {}'.format(SAMPLER_REMOTE_SCRIPT,
+            SAMPLER_REMOTE_DIR, last_sample))
+        if result.failed:
+            logger.error('Exit_status nonzero in fetch_samples: {}, {}'.format(result.rc,
+                result.output))
+            return last_sample, workers
+        for number, sample_time, sections in parse_sampler_output(result.output):
+            if number <= last_sample:
+                continue
+            if number != last_sample + 1:
+                logger.warn('Lost {} samples, the sampler ring buffer overflowed'.format(
+                    number - last_sample - 1))
+            last_sample = number
+            if 'workers' in sections:
+                workers = self.parse_evm_workers(sections['workers'])
+            appliance_results.append(sample_time,
+                self.parse_appliance_memory(sections['meminfo']))
+            self.record_process_results(process_results, sample_time, workers,
+                self.parse_pids_memory(sections['smem']))
+        return last_sample, workers
+
     def _real_run(self):
-        """ Result dictionaries:
-        appliance_results[timestamp][measurement] = value
-        appliance_results[timestamp]['total'] = value
-        appliance_results[timestamp]['free'] = value
-        appliance_results[timestamp]['used'] = value
-        appliance_results[timestamp]['buffers'] = value
-        appliance_results[timestamp]['cached'] = value
-        appliance_results[timestamp]['slab'] = value
-        appliance_results[timestamp]['swap_total'] = value
-        appliance_results[timestamp]['swap_free'] = value
+        """ Results:
+        appliance_results = MemorySamples of the appliance measurements
         appliance measurements: total/free/used/buffers/cached/slab/swap_total/swap_free
-        process_results[name][pid][timestamp][measurement] = value
-        process_results[name][pid][timestamp]['rss'] = value
-        process_results[name][pid][timestamp]['pss'] = value
-        process_results[name][pid][timestamp]['uss'] = value
-        process_results[name][pid][timestamp]['vss'] = value
-        process_results[name][pid][timestamp]['swap'] = value
+        process_results[name][pid] = MemorySamples of the process measurements
+        process measurements: rss/pss/uss/vss/swap
         """
-        appliance_results = OrderedDict()
+        self.spill_dir = tempfile.mkdtemp(prefix='smem-samples-')
+        appliance_results = MemorySamples(appliance_measurements, self.spill_dir)
         process_results = OrderedDict()
         install_smem(self.ssh_client)
         self.get_miq_server_id()
         logger.info('Starting Monitoring Thread.')
-        while self.signal:
-            starttime = time.time()
-            plottime = datetime.now()
-
-            self.get_appliance_memory(appliance_results, plottime)
-            workers = self.get_evm_workers()
-            memory_by_pid = self.get_pids_memory()
-
-            for worker_pid in workers:
-                self.create_process_result(process_results, plottime, worker_pid,
-                    workers[worker_pid], memory_by_pid)
-
-            for pid in sorted(memory_by_pid.keys()):
-                if memory_by_pid[pid]['name'] == 'httpd':
-                    self.create_process_result(process_results, plottime, pid, 'httpd',
-                        memory_by_pid)
-                elif memory_by_pid[pid]['name'] == 'postgres':
-                    self.create_process_result(process_results, plottime, pid, 'postgres',
-                        memory_by_pid)
-                elif memory_by_pid[pid]['name'] == 'postmaster':
-                    self.create_process_result(process_results, plottime, pid, 'postgres',
-                        memory_by_pid)
-                elif memory_by_pid[pid]['name'] == 'memcached':
-                    self.create_process_result(process_results, plottime, pid, 'memcached',
-                        memory_by_pid)
-                elif memory_by_pid[pid]['name'] == 'collectd':
-                    self.create_process_result(process_results, plottime, pid, 'collectd',
-                        memory_by_pid)
-                elif memory_by_pid[pid]['name'] == 'ruby':
-                    if 'evm_server.rb' in memory_by_pid[pid]['cmd']:
-                        self.create_process_result(process_results, plottime, pid,
-                            'MIQ Server (evm_server.rb)', memory_by_pid)
-                    elif 'MIQ Server' in memory_by_pid[pid]['cmd']:
-                        self.create_process_result(process_results, plottime, pid,
-                            'MIQ Server (evm_server.rb)', memory_by_pid)
-                    elif 'evm_watchdog.rb' in memory_by_pid[pid]['cmd']:
-                        self.create_process_result(process_results, plottime, pid,
-                            'evm_watchdog.rb', memory_by_pid)
-                    elif 'appliance_console.rb' in memory_by_pid[pid]['cmd']:
-                        self.create_process_result(process_results, plottime, pid,
-                            'appliance_console.rb', memory_by_pid)
-                    elif 'evm:dbsync:replicate' in memory_by_pid[pid]['cmd']:
-                        self.create_process_result(process_results, plottime, pid,
-                            'evm:dbsync:replicate', memory_by_pid)
-                    else:
-                        logger.debug('Unaccounted for ruby pid: {}'.format(pid))
-
-            timediff = time.time() - starttime
-            logger.debug('Monitoring sampled in {}s'.format(round(timediff, 4)))
+        sampling = bool(self.sampler_interval) and self.start_sampler()
+        last_sample, workers = 0, {}
+        try:
+            while self.signal:
+                starttime = time.time()
 
-            # Sleep Monitoring interval
-            # Roughly 10s samples, accounts for collection of memory measurements
-            time_to_sleep = abs(SAMPLE_INTERVAL - timediff)
-            time.sleep(time_to_sleep)
+                if sampling:
+                    last_sample, workers = self.fetch_samples(appliance_results, process_results,
+                        last_sample, workers)
+                else:
+                    self.get_appliance_memory(appliance_results, starttime)
+                    workers = self.get_evm_workers()
+                    memory_by_pid = self.get_pids_memory()
+
+                    self.record_process_results(process_results, starttime, workers, memory_by_pid)
+
+                timediff = time.time() - starttime
+                logger.debug('Monitoring sampled in {}s'.format(round(timediff, 4)))
+
+                # Sleep Monitoring interval
+                # Roughly 10s samples, accounts for collection of memory measurements
+                time_to_sleep = abs(SAMPLE_INTERVAL - timediff)
+                time.sleep(time_to_sleep)
+            if sampling:
+                # the samples taken since the last fetch
+                self.fetch_samples(appliance_results, process_results, last_sample, workers)
+        finally:
+            if sampling:
+                self.stop_sampler()
         logger.info('Monitoring CFME Memory Terminating')
 
-        create_report(self.scenario_data, appliance_results, process_results, self.use_slab,
-            self.grafana_urls)
+        try:
+            create_report(self.scenario_data, appliance_results, process_results, self.use_slab,
+                self.grafana_urls)
+        finally:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
 
     def run(self):
         try:
@@ -423,25 +659,19 @@ def create_report(scenario_data, appliance_results, process_results, use_slab, g
 def compile_per_process_results(procs_to_compile, process_results, ts_end):
     alive_pids = 0
     recycled_pids = 0
-    total_running_rss = 0
-    total_running_pss = 0
-    total_running_uss = 0
-    total_running_vss = 0
-    total_running_swap = 0
+    total_running = dict.fromkeys(process_measurements, 0)
     for process in procs_to_compile:
         if process in process_results:
             for pid in process_results[process]:
-                if ts_end in process_results[process][pid]:
+                samples = process_results[process][pid]
+                if samples.end == ts_end:
                     alive_pids += 1
-                    total_running_rss += process_results[process][pid][ts_end]['rss']
-                    total_running_pss += process_results[process][pid][ts_end]['pss']
-                    total_running_uss += process_results[process][pid][ts_end]['uss']
-                    total_running_vss += process_results[process][pid][ts_end]['vss']
-                    total_running_swap += process_results[process][pid][ts_end]['swap']
+                    for measurement in process_measurements:
+                        total_running[measurement] += samples.end_value(measurement)
                 else:
                     recycled_pids += 1
-    return alive_pids, recycled_pids, total_running_rss, total_running_pss, total_running_uss, \
-        total_running_vss, total_running_swap
+    return alive_pids, recycled_pids, total_running['rss'], total_running['pss'], \
+        total_running['uss'], total_running['vss'], total_running['swap']
 
 
 def generate_raw_data_csv(directory, appliance_results, process_results):
@@ -449,24 +679,15 @@ def generate_raw_data_csv(directory, appliance_results, process_results):
     file_name = str(directory.join('appliance.csv'))
     with open(file_name, 'w') as csv_file:
         csv_file.write('TimeStamp,Total,Free,Used,Buffers,Cached,Slab,Swap_Total,Swap_Free\n')
-        for ts in appliance_results:
-            csv_file.write('{},{},{},{},{},{},{},{},{}\n'.format(ts,
-                appliance_results[ts]['total'], appliance_results[ts]['free'],
-                appliance_results[ts]['used'], appliance_results[ts]['buffers'],
-                appliance_results[ts]['cached'], appliance_results[ts]['slab'],
-                appliance_results[ts]['swap_total'], appliance_results[ts]['swap_free']))
+        for row in appliance_results.rows():
+            csv_file.write('{},{},{},{},{},{},{},{},{}\n'.format(*row))
     for process_name in process_results:
         for process_pid in process_results[process_name]:
             file_name = str(directory.join('{}-{}.csv'.format(process_pid, process_name)))
             with open(file_name, 'w') as csv_file:
                 csv_file.write('TimeStamp,RSS,PSS,USS,VSS,SWAP\n')
-                for ts in process_results[process_name][process_pid]:
-                    csv_file.write('{},{},{},{},{},{}\n'.format(ts,
-                        process_results[process_name][process_pid][ts]['rss'],
-                        process_results[process_name][process_pid][ts]['pss'],
-                        process_results[process_name][process_pid][ts]['uss'],
-                        process_results[process_name][process_pid][ts]['vss'],
-                        process_results[process_name][process_pid][ts]['swap']))
+                for row in process_results[process_name][process_pid].rows():
+                    csv_file.write('{},{},{},{},{},{}\n'.format(*row))
     timediff = time.time() - starttime
     logger.info('Generated Raw Data CSVs in: {}'.format(timediff))
 
@@ -477,29 +698,13 @@ def generate_summary_csv(file_name, appliance_results, process_results, provider
     with open(str(file_name), 'w') as csv_file:
         csv_file.write('Version: {}, Provider(s): {}\n'.format(version_string, provider_names))
         csv_file.write('Measurement,Start of test,End of test\n')
-        start = appliance_results.keys()[0]
-        end = appliance_results.keys()[-1]
-        csv_file.write('Appliance Total Memory,{},{}\n'.format(
-            round(appliance_results[start]['total'], 2), round(appliance_results[end]['total'], 2)))
-        csv_file.write('Appliance Free Memory,{},{}\n'.format(
-            round(appliance_results[start]['free'], 2), round(appliance_results[end]['free'], 2)))
-        csv_file.write('Appliance Used Memory,{},{}\n'.format(
-            round(appliance_results[start]['used'], 2), round(appliance_results[end]['used'], 2)))
-        csv_file.write('Appliance Buffers,{},{}\n'.format(
-            round(appliance_results[start]['buffers'], 2),
-            round(appliance_results[end]['buffers'], 2)))
-        csv_file.write('Appliance Cached,{},{}\n'.format(
-            round(appliance_results[start]['cached'], 2),
-            round(appliance_results[end]['cached'], 2)))
-        csv_file.write('Appliance Slab,{},{}\n'.format(
-            round(appliance_results[start]['slab'], 2),
-            round(appliance_results[end]['slab'], 2)))
-        csv_file.write('Appliance Total Swap,{},{}\n'.format(
-            round(appliance_results[start]['swap_total'], 2),
-            round(appliance_results[end]['swap_total'], 2)))
-        csv_file.write('Appliance Free Swap,{},{}\n'.format(
-            round(appliance_results[start]['swap_free'], 2),
-            round(appliance_results[end]['swap_free'], 2)))
+        for measurement, label in zip(appliance_measurements, ['Appliance Total Memory',
+                'Appliance Free Memory', 'Appliance Used Memory', 'Appliance Buffers',
+                'Appliance Cached', 'Appliance Slab', 'Appliance Total Swap',
+                'Appliance Free Swap']):
+            csv_file.write('{},{},{}\n'.format(label,
+                round(appliance_results.start_value(measurement), 2),
+                round(appliance_results.end_value(measurement), 2)))
 
         summary_csv_measurement_dump(csv_file, process_results, 'rss')
         summary_csv_measurement_dump(csv_file, process_results, 'pss')
@@ -507,12 +712,19 @@ def generate_summary_csv(file_name, appliance_results, process_results, provider
         summary_csv_measurement_dump(csv_file, process_results, 'vss')
         summary_csv_measurement_dump(csv_file, process_results, 'swap')
 
+        summary_csv_statistics_dump(csv_file, process_results, 'rss')
+        summary_csv_statistics_dump(csv_file, process_results, 'pss')
+        summary_csv_statistics_dump(csv_file, process_results, 'uss')
+
     timediff = time.time() - starttime
     logger.info('Generated Summary CSV in: {}'.format(timediff))
 
 
 def generate_summary_html(directory, version_string, appliance_results, process_results,
         scenario_data, provider_names, grafana_urls):
+    # Import here to allow perf to install numpy separately
+    import numpy
+
     starttime = time.time()
     file_name = str(directory.join('index.html'))
     with open(file_name, 'w') as html_file:
@@ -538,17 +750,14 @@ def generate_summary_html(directory, version_string, appliance_results, process_
         html_file.write(' : <b><a href=\'workload.html\'>Workload Info</a></b>')
         html_file.write(' : <b><a href=\'graphs/\'>Graphs directory</a></b>\n')
         html_file.write(' : <b><a href=\'rawdata/\'>CSVs directory</a></b><br>\n')
-        start = appliance_results.keys()[0]
-        end = appliance_results.keys()[-1]
+        start = appliance_results.start
+        end = appliance_results.end
         timediff = end - start
         total_proc_count = 0
         for proc_name in process_results:
             total_proc_count += len(process_results[proc_name].keys())
-        growth = appliance_results[end]['used'] - appliance_results[start]['used']
-        max_used_memory = 0
-        for ts in appliance_results:
-            if appliance_results[ts]['used'] > max_used_memory:
-                max_used_memory = appliance_results[ts]['used']
+        growth = appliance_results.end_value('used') - appliance_results.start_value('used')
+        max_used_memory = numpy.frombuffer(appliance_results.column('used')).max()
         html_file.write('<table border="1">\n')
         html_file.write('<tr><td>\n')
         # Appliance Wide Results
@@ -570,9 +779,9 @@ def generate_summary_html(directory, version_string, appliance_results, process_
         html_file.write('<td>{}</td>\n'.format(start.replace(microsecond=0)))
         html_file.write('<td>{}</td>\n'.format(end.replace(microsecond=0)))
         html_file.write('<td>{}</td>\n'.format(unicode(timediff).partition('.')[0]))
-        html_file.write('<td>{}</td>\n'.format(round(appliance_results[end]['total'], 2)))
-        html_file.write('<td>{}</td>\n'.format(round(appliance_results[start]['used'], 2)))
-        html_file.write('<td>{}</td>\n'.format(round(appliance_results[end]['used'], 2)))
+        html_file.write('<td>{}</td>\n'.format(round(appliance_results.end_value('total'), 2)))
+        html_file.write('<td>{}</td>\n'.format(round(appliance_results.start_value('used'), 2)))
+        html_file.write('<td>{}</td>\n'.format(round(appliance_results.end_value('used'), 2)))
         html_file.write('<td>{}</td>\n'.format(round(growth, 2)))
         html_file.write('<td>{}</td>\n'.format(round(max_used_memory, 2)))
         html_file.write('<td>{}</td>\n'.format(total_proc_count))
@@ -748,11 +957,8 @@ def generate_summary_html(directory, version_string, appliance_results, process_
         html_file.write('<img src=\'graphs/{}\'>\n'.format(file_name))
         file_name = '{}-appliance_swap.png'.format(version_string)
         # Check for swap usage through out time frame:
-        max_swap_used = 0
-        for ts in appliance_results:
-            swap_used = appliance_results[ts]['swap_total'] - appliance_results[ts]['swap_free']
-            if swap_used > max_swap_used:
-                max_swap_used = swap_used
+        max_swap_used = (numpy.frombuffer(appliance_results.column('swap_total')) -
+            numpy.frombuffer(appliance_results.column('swap_free'))).max()
         if max_swap_used < 10:  # Less than 10MiB Max, then hide graph
             html_file.write('<br><a href=\'graphs/{}\'>Swap Graph '.format(file_name))
             html_file.write('(Hidden, max_swap_used < 10 MiB)</a>\n')
@@ -778,8 +984,9 @@ def generate_summary_html(directory, version_string, appliance_results, process_
         for ordered_name in process_order:
             if ordered_name in process_results:
                 for pid in process_results[ordered_name]:
-                    start = process_results[ordered_name][pid].keys()[0]
-                    end = process_results[ordered_name][pid].keys()[-1]
+                    samples = process_results[ordered_name][pid]
+                    start = samples.start
+                    end = samples.end
                     timediff = end - start
                     html_file.write('<tr>\n')
                     if len(process_results[ordered_name]) > 1:
@@ -794,19 +1001,13 @@ def generate_summary_html(directory, version_string, appliance_results, process_
                     html_file.write('<td>{}</td>\n'.format(start.replace(microsecond=0)))
                     html_file.write('<td>{}</td>\n'.format(end.replace(microsecond=0)))
                     html_file.write('<td>{}</td>\n'.format(unicode(timediff).partition('.')[0]))
-                    rss_change = process_results[ordered_name][pid][end]['rss'] - \
-                        process_results[ordered_name][pid][start]['rss']
-                    html_file.write('<td>{}</td>\n'.format(
-                        round(process_results[ordered_name][pid][start]['rss'], 2)))
-                    html_file.write('<td>{}</td>\n'.format(
-                        round(process_results[ordered_name][pid][end]['rss'], 2)))
+                    rss_change = samples.end_value('rss') - samples.start_value('rss')
+                    html_file.write('<td>{}</td>\n'.format(round(samples.start_value('rss'), 2)))
+                    html_file.write('<td>{}</td>\n'.format(round(samples.end_value('rss'), 2)))
                     html_file.write('<td>{}</td>\n'.format(round(rss_change, 2)))
-                    pss_change = process_results[ordered_name][pid][end]['pss'] - \
-                        process_results[ordered_name][pid][start]['pss']
-                    html_file.write('<td>{}</td>\n'.format(
-                        round(process_results[ordered_name][pid][start]['pss'], 2)))
-                    html_file.write('<td>{}</td>\n'.format(
-                        round(process_results[ordered_name][pid][end]['pss'], 2)))
+                    pss_change = samples.end_value('pss') - samples.start_value('pss')
+                    html_file.write('<td>{}</td>\n'.format(round(samples.start_value('pss'), 2)))
+                    html_file.write('<td>{}</td>\n'.format(round(samples.end_value('pss'), 2)))
                     html_file.write('<td>{}</td>\n'.format(round(pss_change, 2)))
                     html_file.write('<td><a href=\'rawdata/{}-{}.csv\'>csv</a></td>\n'.format(
                         pid, ordered_name))
@@ -997,17 +1198,15 @@ def graph_appliance_measurements(graphs_path, ver, appliance_results, use_slab,
 
     starttime = time.time()
 
-    dates = appliance_results.keys()
-    total_memory_list = list(appliance_results[ts]['total'] for ts in appliance_results.keys())
-    free_memory_list = list(appliance_results[ts]['free'] for ts in appliance_results.keys())
-    used_memory_list = list(appliance_results[ts]['used'] for ts in appliance_results.keys())
-    buffers_memory_list = list(
-        appliance_results[ts]['buffers'] for ts in appliance_results.keys())
-    cache_memory_list = list(appliance_results[ts]['cached'] for ts in appliance_results.keys())
-    slab_memory_list = list(appliance_results[ts]['slab'] for ts in appliance_results.keys())
-    swap_total_list = list(appliance_results[ts]['swap_total'] for ts in
-        appliance_results.keys())
-    swap_free_list = list(appliance_results[ts]['swap_free'] for ts in appliance_results.keys())
+    dates = appliance_results.dates
+    total_memory_list = appliance_results.column('total')
+    free_memory_list = appliance_results.column('free')
+    used_memory_list = appliance_results.column('used')
+    buffers_memory_list = appliance_results.column('buffers')
+    cache_memory_list = appliance_results.column('cached')
+    slab_memory_list = appliance_results.column('slab')
+    swap_total_list = appliance_results.column('swap_total')
+    swap_free_list = appliance_results.column('swap_free')
 
     # Stack Plot Memory Usage
     file_name = graphs_path.join('{}-appliance_memory.png'.format(ver))
@@ -1123,12 +1322,11 @@ def graph_all_miq_workers(graph_file_path, process_results, provider_names):
     for process_name in process_results:
         if 'Worker' in process_name or 'Handler' in process_name or 'Catcher' in process_name:
             for process_pid in process_results[process_name]:
-                dates = process_results[process_name][process_pid].keys()
+                samples = process_results[process_name][process_pid]
+                dates = samples.dates
 
-                rss_samples = list(process_results[process_name][process_pid][ts]['rss']
-                        for ts in process_results[process_name][process_pid].keys())
-                vss_samples = list(process_results[process_name][process_pid][ts]['vss']
-                        for ts in process_results[process_name][process_pid].keys())
+                rss_samples = samples.column('rss')
+                vss_samples = samples.column('vss')
                 plt.plot(dates, rss_samples, linewidth=1, label='{} {} RSS'.format(process_pid,
                     process_name))
                 plt.plot(dates, vss_samples, linewidth=1, label='{} {} VSS'.format(
@@ -1158,17 +1356,13 @@ def graph_individual_process_measurements(graph_file_path, process_results, prov
 
             file_name = graph_file_path.join('{}-{}.png'.format(process_name, process_pid))
 
-            dates = process_results[process_name][process_pid].keys()
-            rss_samples = list(process_results[process_name][process_pid][ts]['rss']
-                    for ts in process_results[process_name][process_pid].keys())
-            pss_samples = list(process_results[process_name][process_pid][ts]['pss']
-                    for ts in process_results[process_name][process_pid].keys())
-            uss_samples = list(process_results[process_name][process_pid][ts]['uss']
-                    for ts in process_results[process_name][process_pid].keys())
-            vss_samples = list(process_results[process_name][process_pid][ts]['vss']
-                    for ts in process_results[process_name][process_pid].keys())
-            swap_samples = list(process_results[process_name][process_pid][ts]['swap']
-                    for ts in process_results[process_name][process_pid].keys())
+            samples = process_results[process_name][process_pid]
+            dates = samples.dates
+            rss_samples = samples.column('rss')
+            pss_samples = samples.column('pss')
+            uss_samples = samples.column('uss')
+            vss_samples = samples.column('vss')
+            swap_samples = samples.column('swap')
 
             fig, ax = plt.subplots()
             plt.title('Provider(s)/Size: {}\nProcess/Worker: {}\nPID: {}'.format(provider_names,
@@ -1243,18 +1437,14 @@ def graph_same_miq_workers(graph_file_path, process_results, provider_names):
             plt.ylabel('Memory (MiB)')
 
             for process_pid in process_results[process_name]:
-                dates = process_results[process_name][process_pid].keys()
-
-                rss_samples = list(process_results[process_name][process_pid][ts]['rss']
-                        for ts in process_results[process_name][process_pid].keys())
-                pss_samples = list(process_results[process_name][process_pid][ts]['pss']
-                        for ts in process_results[process_name][process_pid].keys())
-                uss_samples = list(process_results[process_name][process_pid][ts]['uss']
-                        for ts in process_results[process_name][process_pid].keys())
-                vss_samples = list(process_results[process_name][process_pid][ts]['vss']
-                        for ts in process_results[process_name][process_pid].keys())
-                swap_samples = list(process_results[process_name][process_pid][ts]['swap']
-                        for ts in process_results[process_name][process_pid].keys())
+                samples = process_results[process_name][process_pid]
+                dates = samples.dates
+
+                rss_samples = samples.column('rss')
+                pss_samples = samples.column('pss')
+                uss_samples = samples.column('uss')
+                vss_samples = samples.column('vss')
+                swap_samples = samples.column('swap')
                 plt.plot(dates, rss_samples, linewidth=1, label='{} RSS'.format(process_pid))
                 plt.plot(dates, pss_samples, linewidth=1, label='{} PSS'.format(process_pid))
                 plt.plot(dates, uss_samples, linewidth=1, label='{} USS'.format(process_pid))
@@ -1306,8 +1496,22 @@ def summary_csv_measurement_dump(csv_file, process_results, measurement):
     for ordered_name in process_order:
         if ordered_name in process_results:
             for process_pid in sorted(process_results[ordered_name]):
-                start = process_results[ordered_name][process_pid].keys()[0]
-                end = process_results[ordered_name][process_pid].keys()[-1]
+                samples = process_results[ordered_name][process_pid]
                 csv_file.write('{},{},{},{}\n'.format(ordered_name, process_pid,
-                    round(process_results[ordered_name][process_pid][start][measurement], 2),
-                    round(process_results[ordered_name][process_pid][end][measurement], 2)))
+                    round(samples.start_value(measurement), 2),
+                    round(samples.end_value(measurement), 2)))
+
+
+def summary_csv_statistics_dump(csv_file, process_results, measurement):
+    csv_file.write('---------------------------------------------\n')
+    csv_file.write('Per Process {} Memory Statistics\n'.format(measurement.upper()))
+    csv_file.write('---------------------------------------------\n')
+    csv_file.write('Process/Worker Type,PID,Samples,Minimum,Maximum,Average,Growth (MiB/hour)\n')
+    for ordered_name in process_order:
+        if ordered_name in process_results:
+            for process_pid in sorted(process_results[ordered_name]):
+                samples = process_results[ordered_name][process_pid]
+                minimum, maximum, average, growth = samples.statistics(measurement)
+                csv_file.write('{},{},{},{},{},{},{}\n'.format(ordered_name, process_pid,
+                    len(samples), round(minimum, 2), round(maximum, 2), round(average, 2),
+                    round(growth, 4)))
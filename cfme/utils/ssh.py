@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
+import codecs
 import gevent
 import socket
 import sys
+import threading
+import weakref
 from subprocess import check_call
+from time import time
 
 import attr
 import diaper
@@ -11,7 +15,11 @@ import iso8601
 import paramiko
 import re
 from cached_property import cached_property
+from collections import deque
+from concurrent import futures
+from gevent import select
 from os import path as os_path
+from paramiko.pipe import make_or_pipe, make_pipe
 from scp import SCPClient
 
 from cfme.utils import conf, ports
@@ -28,6 +36,16 @@ import six
 # in seconds (float)
 RUNCMD_TIMEOUT = 1200.0
 
+# Size of the reads of command output, in bytes
+READ_CHUNK_SIZE = 65536
+
+# Longest wait for output before checking the exit status again, in seconds (float)
+# Output on stdout or stderr and the end of the output wake the wait up earlier
+READ_WAIT = 1.0
+
+# Size of the sftp reads of the tailed file, in bytes
+TAIL_CHUNK_SIZE = 1048576
+
 
 @attr.s(frozen=True)
 class SSHResult(object):
@@ -96,6 +114,159 @@ _ssh_pubkey_file = project_path.join('.generated_ssh_key.pub')
 
 _client_session = []
 
+# Seconds a pooled transport may stay unused before it is probed prior to being reused
+TRANSPORT_IDLE_CHECK = 60.0
+
+
+@attr.s
+class _PooledTransport(object):
+    transport = attr.ib()
+    users = attr.ib(default=1)
+    last_used = attr.ib(default=attr.Factory(time))
+    # channels opened by the clients, see TransportPool.track_channel
+    channels = attr.ib(default=attr.Factory(weakref.WeakSet))
+
+
+class TransportPool(object):
+    """Shares one paramiko transport between all clients connecting to the same host and user
+
+    paramiko multiplexes any number of channels (commands, sftp, scp) over a single transport,
+    so the clients do not need to each pay for their own key exchange and authentication.
+    Transports are kept open when their last client closes, and probed before being reused if
+    they have been idle for longer than ``idle_check`` seconds.
+    """
+    def __init__(self, idle_check=TRANSPORT_IDLE_CHECK):
+        self.idle_check = idle_check
+        self._lock = threading.Lock()
+        self._transports = {}
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self.handshake_time = 0.0
+
+    @staticmethod
+    def key(connect_kwargs):
+        return tuple(
+            connect_kwargs.get(kwarg)
+            for kwarg in ('hostname', 'port', 'username', 'password', 'key_filename'))
+
+    def _healthy(self, pooled):
+        if not pooled.transport.is_active():
+            return False
+        if time() - pooled.last_used > self.idle_check:
+            try:
+                pooled.transport.send_ignore()
+            except (EOFError, socket.error, paramiko.SSHException):
+                return False
+            return pooled.transport.is_active()
+        return True
+
+    def acquire(self, key):
+        """Return a healthy pooled transport for ``key``, or ``None`` if a new one is needed"""
+        with self._lock:
+            pooled = self._transports.get(key)
+            if pooled is None:
+                return None
+            if not self._healthy(pooled):
+                logger.debug('Discarding dead pooled ssh transport to %s', key[0])
+                del self._transports[key]
+                pooled.transport.close()
+                return None
+            pooled.users += 1
+            pooled.last_used = time()
+            self.connections_reused += 1
+            return pooled.transport
+
+    def add(self, key, transport, handshake_time):
+        """Add a freshly connected transport, already in use by one client, to the pool
+
+        Another client may have pooled a transport for ``key`` while this one was connecting.
+        That transport is then reused, the new one is closed.
+
+        Returns:
+            The transport the client has to use.
+        """
+        with self._lock:
+            self.connections_opened += 1
+            self.handshake_time += handshake_time
+            pooled = self._transports.get(key)
+            if pooled is None or not pooled.transport.is_active():
+                self._transports[key] = _PooledTransport(transport)
+                return transport
+            pooled.users += 1
+            pooled.last_used = time()
+            self.connections_reused += 1
+        logger.debug('Closing duplicate ssh transport to %s', key[0])
+        transport.close()
+        return pooled.transport
+
+    def track_channel(self, transport, channel):
+        """Count ``channel`` opened on ``transport`` in the :py:meth:`stats` while it is open"""
+        with self._lock:
+            for pooled in self._transports.values():
+                if pooled.transport is transport:
+                    pooled.channels.add(channel)
+                    return
+
+    def release(self, transport):
+        """Return a transport to the pool, transports no longer pooled get closed"""
+        with self._lock:
+            for pooled in self._transports.values():
+                if pooled.transport is transport:
+                    pooled.users -= 1
+                    pooled.last_used = time()
+                    return
+        transport.close()
+
+    def close_all(self):
+        with self._lock:
+            transports, self._transports = self._transports, {}
+        for pooled in transports.values():
+            with diaper:
+                pooled.transport.close()
+
+    def stats(self, hostname=None):
+        """Usage statistics of the pool, optionally only for transports to ``hostname``"""
+        with self._lock:
+            pooled = [
+                pooled for key, pooled in self._transports.items()
+                if hostname is None or key[0] == hostname]
+            return {
+                'connections_opened': self.connections_opened,
+                'connections_reused': self.connections_reused,
+                'handshake_time': self.handshake_time,
+                'transports': len(pooled),
+                'clients': sum(p.users for p in pooled),
+                'channels_in_use': sum(
+                    1 for p in pooled for channel in p.channels if not channel.closed),
+            }
+
+
+transport_pool = TransportPool()
+
+
+class _OutputBuffer(object):
+    """Collects command output, keeping only its last ``tail_size`` characters if set"""
+    def __init__(self, tail_size=None):
+        self.tail_size = tail_size
+        self._chunks = deque()
+        self._size = 0
+
+    def append(self, chunk):
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        if self.tail_size is None:
+            return
+        # drop whole chunks that are entirely out of the tail
+        while self._chunks and self._size - len(self._chunks[0]) >= self.tail_size:
+            self._size -= len(self._chunks.popleft())
+
+    def getvalue(self):
+        """Returns the collected (unicode) output"""
+        output = u''.join(self._chunks)
+        if self.tail_size is not None:
+            output = output[-self.tail_size:] if self.tail_size else ''
+        return output
+
 
 class SSHClient(paramiko.SSHClient):
     """paramiko.SSHClient wrapper
@@ -111,6 +282,8 @@ class SSHClient(paramiko.SSHClient):
             app and ``container`` then specifies the name of the pod to interact with.
         stdout: If specified, overrides the system stdout file for streaming output.
         stderr: If specified, overrides the system stderr file for streaming output.
+        pooled: If ``True`` (default), the transport is shared through :py:data:`transport_pool`
+            with other clients connecting to the same host as the same user.
     """
     def __init__(self, stream_output=False, **connect_kwargs):
         super(SSHClient, self).__init__()
@@ -126,6 +299,7 @@ class SSHClient(paramiko.SSHClient):
         self.oc_password = connect_kwargs.pop('oc_password', False)
         self.f_stdout = connect_kwargs.pop('stdout', sys.stdout)
         self.f_stderr = connect_kwargs.pop('stderr', sys.stderr)
+        self._pooled = connect_kwargs.pop('pooled', True)
 
         # load the defaults for ssh
         default_connect_kwargs = {
@@ -204,6 +378,10 @@ class SSHClient(paramiko.SSHClient):
     def close(self):
         with diaper:
             _client_session.remove(self)
+        if self._pooled and self._transport is not None:
+            # shared with other clients, the pool decides when to really close it
+            transport, self._transport = self._transport, None
+            transport_pool.release(transport)
         super(SSHClient, self).close()
 
     @property
@@ -218,13 +396,24 @@ class SSHClient(paramiko.SSHClient):
             self._connect_kwargs['hostname'] = hostname
             self.close()
 
+        conn = None
         if not self.connected:
+            if self._pooled and self._transport is not None:
+                # the pooled transport died, this client no longer uses it
+                transport, self._transport = self._transport, None
+                transport_pool.release(transport)
             self._connect_kwargs.update(kwargs)
-            self._check_port()
-            # Only install ssh keys if they aren't installed (or currently being installed)
-            conn = super(SSHClient, self).connect(**self._connect_kwargs)
-        else:
-            conn = None
+            pool_key = TransportPool.key(self._connect_kwargs)
+            transport = transport_pool.acquire(pool_key) if self._pooled else None
+            if transport is not None:
+                self._transport = transport
+            else:
+                self._check_port()
+                handshake_start = time()
+                conn = super(SSHClient, self).connect(**self._connect_kwargs)
+                if self._pooled:
+                    self._transport = transport_pool.add(
+                        pool_key, self._transport, time() - handshake_start)
 
         self._after_connect()
         return conn
@@ -253,7 +442,10 @@ class SSHClient(paramiko.SSHClient):
             logger.warning(
                 'You are about to use sftp on a containerized appliance. It may not work.')
         self.connect()
-        return super(SSHClient, self).open_sftp(*args, **kwargs)
+        sftp = super(SSHClient, self).open_sftp(*args, **kwargs)
+        if self._pooled:
+            transport_pool.track_channel(self._transport, sftp.get_channel())
+        return sftp
 
     def get_transport(self, *args, **kwargs):
         if not self.connected:
@@ -261,7 +453,7 @@ class SSHClient(paramiko.SSHClient):
         return super(SSHClient, self).get_transport(*args, **kwargs)
 
     def run_command(self, command, timeout=RUNCMD_TIMEOUT, reraise=False, ensure_host=False,
-                    ensure_user=False, container=None):
+                    ensure_user=False, container=None, output_callback=None, tail_size=None):
         """Run a command over SSH.
 
         Args:
@@ -273,6 +465,9 @@ class SSHClient(paramiko.SSHClient):
             ensure_user: Ensure that the command is run as the user we logged in, so in case we are
                 not root, setting this to True will prevent from running sudo.
             container: allows to temporarily override default container
+            output_callback: called with every ``(text, is_stderr)`` chunk of output as it arrives
+            tail_size: if set, only the last ``tail_size`` characters of the output are kept in
+                the result, to bound memory for commands with huge output
         Returns:
             A :py:class:`SSHResult` instance.
         """
@@ -281,13 +476,17 @@ class SSHClient(paramiko.SSHClient):
         try:
             with gevent.Timeout(timeout):
                 return self._run_command(command, timeout, reraise, ensure_host, ensure_user,
-                                         container)
+                                         container, output_callback, tail_size)
         except gevent.Timeout:
             logger.error("command %s couldn't finish in given timeout %s", command, timeout)
             raise
 
-    def _run_command(self, command, timeout=RUNCMD_TIMEOUT, reraise=False, ensure_host=False,
-                     ensure_user=False, container=None):
+    def _prepare_command(self, command, ensure_host=False, ensure_user=False, container=None):
+        """Wrap the command for pods, containers and sudo
+
+        Returns:
+            A tuple of the command to run and whether it uses sudo
+        """
         if isinstance(command, dict):
             command = VersionPicker(command).pick(self.vmdb_version)
         original_command = command
@@ -312,72 +511,88 @@ class SSHClient(paramiko.SSHClient):
 
         if command != original_command:
             logger.info("> Actually running command %r", command)
-        command += '\n'
-
-        output = []
+        return command + '\n', uses_sudo
+
+    def _exec_session(self, command, uses_sudo, timeout):
+        transport = self.get_transport()
+        session = transport.open_session()
+        if self._pooled:
+            transport_pool.track_channel(transport, session)
+        if uses_sudo:
+            # We need a pseudo-tty for sudo
+            session.get_pty()
+        if timeout:
+            session.settimeout(float(timeout))
+        session.exec_command(command)
+        return session
+
+    @staticmethod
+    def _iter_session_output(session):
+        """Yield ``(text, is_stderr)`` chunks of the output of a command as it arrives
+
+        Output is read in chunks of up to :py:data:`READ_CHUNK_SIZE` bytes, waiting on a pipe set
+        by both the stdout and the stderr buffers of the channel between reads instead of polling
+        it. Ends once the command has exited and all of its output was read.
+        """
+        decoders = {
+            False: codecs.getincrementaldecoder('utf-8')('replace'),
+            True: codecs.getincrementaldecoder('utf-8')('replace'),
+        }
+        # The channel's own fileno only becomes readable on stdout data, the buffers set the
+        # or-ed halves of this pipe whenever they have data or got closed
+        output_pipe = make_pipe()
+        stdout_event, stderr_event = make_or_pipe(output_pipe)
+        session.in_buffer.set_event(stdout_event)
+        session.in_stderr_buffer.set_event(stderr_event)
         try:
-            session = self.get_transport().open_session()
-            if uses_sudo:
-                # We need a pseudo-tty for sudo
-                session.get_pty()
-            if timeout:
-                session.settimeout(float(timeout))
-
-            session.exec_command(command)
-            stdout = session.makefile()
-            stderr = session.makefile_stderr()
-
-            def write_output(line, file):
-                output.append(line)
-                if self._streaming:
-                    file.write(line)
-
             while True:
+                got_data = False
+                if session.recv_ready():
+                    got_data = True
+                    yield decoders[False].decode(session.recv(READ_CHUNK_SIZE)), False
+                if session.recv_stderr_ready():
+                    got_data = True
+                    yield decoders[True].decode(session.recv_stderr(READ_CHUNK_SIZE)), True
+                if got_data:
+                    continue
                 if session.exit_status_ready():
                     break
-                no_data = 0
-                # While the program is running loop through collecting line by line so that we don't
-                # fill the buffers up without a newline.
-                # Also, note that for long running programs if we try to read output when there
-                # is none (and in the case of stderr may never be any)
-                # we risk blocking so long that the write buffer on the remote side will fill
-                # and the remote program will block on a write.
-                # The blocking on our side occurs in paramiko's buffered_pipe.py's read() call,
-                # which will block if its internal buffer is empty.
-                if session.recv_ready():
-                    try:
-                        line = next(stdout)
-                        write_output(line, self.f_stdout)
-                    except StopIteration:
-                        pass
-                else:
-                    no_data += 1
+                select.select([output_pipe], [], [], READ_WAIT)
+        finally:
+            output_pipe.close()
 
-                if session.recv_stderr_ready():
-                    try:
-                        line = next(stderr)
-                        write_output(line, self.f_stderr)
-                    except StopIteration:
-                        pass
-                else:
-                    no_data += 1
+        # The exit status is sent after all of the output, so whatever is still in flight ends
+        # with an EOF shortly; reading until then does not risk blocking on a running command
+        for is_stderr, recv in ((False, session.recv), (True, session.recv_stderr)):
+            while True:
+                data = recv(READ_CHUNK_SIZE)
+                if not data:
+                    break
+                yield decoders[is_stderr].decode(data), is_stderr
+            tail = decoders[is_stderr].decode(b'', final=True)
+            if tail:
+                yield tail, is_stderr
 
-                if no_data == 2:
-                    gevent.sleep(0.01)
+    def _run_command(self, command, timeout=RUNCMD_TIMEOUT, reraise=False, ensure_host=False,
+                     ensure_user=False, container=None, output_callback=None, tail_size=None):
+        command, uses_sudo = self._prepare_command(command, ensure_host, ensure_user, container)
 
-            # When the program finishes, we need to grab the rest of the output that is left.
-            # Also, we don't have the issue of blocking reads because since the command is
-            # finished, any pending reads of SSH encrypted data will finish shortly and put in
-            # the buffer or for an empty file EOF will be reached as it will be closed.
-            for line in stdout:
-                write_output(line, self.f_stdout)
-            for line in stderr:
-                write_output(line, self.f_stderr)
+        output = _OutputBuffer(tail_size)
+        try:
+            session = self._exec_session(command, uses_sudo, timeout)
+            for chunk, is_stderr in self._iter_session_output(session):
+                if not chunk:
+                    continue
+                output.append(chunk)
+                if self._streaming:
+                    (self.f_stderr if is_stderr else self.f_stdout).write(chunk)
+                if output_callback is not None:
+                    output_callback(chunk, is_stderr)
 
             exit_status = session.recv_exit_status()
             if exit_status != 0:
                 logger.warning('Exit code %d!', exit_status)
-            return SSHResult(rc=exit_status, output=''.join(output), command=command)
+            return SSHResult(rc=exit_status, output=output.getvalue(), command=command)
         except paramiko.SSHException:
             if reraise:
                 raise
@@ -387,12 +602,42 @@ class SSHClient(paramiko.SSHClient):
             logger.exception(
                 "Command %r timed out. Output before it failed was:\n%r",
                 command,
-                ''.join(output))
+                output.getvalue())
             raise
 
         # Returning two things so tuple unpacking the return works even if the ssh client fails
         # Return whatever we have in the output
-        return SSHResult(rc=1, output=''.join(output), command=command)
+        return SSHResult(rc=1, output=output.getvalue(), command=command)
+
+    def iter_command_lines(self, command, timeout=RUNCMD_TIMEOUT, ensure_host=False,
+                           ensure_user=False, container=None):
+        """Run a command over SSH, yielding lines of its output as they arrive.
+
+        Meant for long running or very chatty commands (rake tasks, log greps) whose output
+        should be processed while they run rather than kept in memory. Lines of stdout and stderr
+        are yielded as they complete, without the trailing newline. Stopping the iteration
+        closes the channel.
+
+        Args:
+            See :py:meth:`run_command`
+        """
+        command, uses_sudo = self._prepare_command(command, ensure_host, ensure_user, container)
+        session = self._exec_session(command, uses_sudo, timeout)
+        pending = {False: '', True: ''}
+        try:
+            for chunk, is_stderr in self._iter_session_output(session):
+                lines = (pending[is_stderr] + chunk).split('\n')
+                pending[is_stderr] = lines.pop()
+                for line in lines:
+                    yield line.rstrip('\r')
+            for rest in pending.values():
+                if rest:
+                    yield rest.rstrip('\r')
+            exit_status = session.recv_exit_status()
+            if exit_status != 0:
+                logger.warning('Exit code %d!', exit_status)
+        finally:
+            session.close()
 
     def cpu_spike(self, seconds=60, cpus=2, **kwargs):
         """Creates a CPU spike of specific length and processes.
@@ -700,16 +945,76 @@ class SSHTail(SSHClient):
             yield line.rstrip()
 
     def raw_lines(self):
+        """Yield the lines appended to the remote file since the last call, newlines included
+
+        The new data is read over sftp in chunks of :py:data:`TAIL_CHUNK_SIZE`. A last line that
+        is not complete yet is left for the next call.
+        """
         with self as sshtail:
             fstat = sshtail._sftp_client.stat(self._remote_filename)
-            if self._remote_file_size is not None:
-                if self._remote_file_size < fstat.st_size:
-                    remote_file = self._sftp_client.open(self._remote_filename, 'r')
-                    remote_file.seek(self._remote_file_size, 0)
-                    while (remote_file.tell() < fstat.st_size):
-                        line = remote_file.readline()  # Note the  missing rstrip() here!
-                        yield line
-            self._remote_file_size = fstat.st_size
+            end = fstat.st_size
+            if self._remote_file_size is not None and self._remote_file_size < fstat.st_size:
+                end = self._remote_file_size
+                for line, end in self._read_lines(self._remote_file_size, fstat.st_size):
+                    yield line
+            self._remote_file_size = end
+
+    def _read_lines(self, start, end):
+        # yields each complete line between the two offsets with the offset right after it
+        with self._sftp_client.open(self._remote_filename, 'rb') as remote_file:
+            remote_file.seek(start)
+            remote_file.prefetch(end)
+            offset, pending = start, b''
+            while offset + len(pending) < end:
+                data = remote_file.read(min(TAIL_CHUNK_SIZE, end - offset - len(pending)))
+                if not data:
+                    break
+                lines = (pending + data).split(b'\n')
+                pending = lines.pop()
+                for line in lines:
+                    offset += len(line) + 1
+                    yield line.decode('utf-8', 'replace') + '\n', offset
+
+    def grep_lines(self, pattern):
+        """Yield the appended lines which contain a match of ``pattern``, without the newlines
+
+        Unlike :py:meth:`raw_lines` the lines are filtered on the remote host with ``grep -P``,
+        so only the matching lines are transferred. ``pattern`` has to be a regular expression
+        grep understands as well as python does. If grep fails, all new lines are yielded.
+        Like in :py:meth:`raw_lines`, a last line that is not complete yet is left for the next
+        call.
+        """
+        start = self._remote_file_size
+        if start is None:
+            self.set_initial_file_end()
+            return
+        filename = quote(self._remote_filename)
+        # end is the offset right after the last complete line; the x appended to the new data
+        # makes the last line of the output 'x\n' exactly when the new data ends with a newline
+        result = self.run_command(
+            'size=$(stat -c %s {file}); '
+            'if [ "$size" -gt {start} ]; then '
+            'partial=$( (tail -c +{first} {file} | head -c $((size - {start})); echo x) '
+            '| tail -n 1 | wc -c); '
+            'end=$((size - partial + 2)); echo $end; '
+            'tail -c +{first} {file} | head -c $((end - {start})) | grep -aP -- {pattern}; '
+            'else echo $size; fi'.format(
+                file=filename, start=start, first=start + 1, pattern=quote(pattern)),
+            ensure_host=True)
+        lines = result.output.splitlines()
+        try:
+            end = int(lines.pop(0))
+        except (IndexError, ValueError):
+            end = None
+        if result.rc > 1 or end is None:
+            logger.warning('Remote filtering of %s failed, reading all new lines: %s',
+                           self._remote_filename, result.output)
+            for line in self:
+                yield line
+            return
+        self._remote_file_size = end
+        for line in lines:
+            yield line.rstrip()
 
     def raw_string(self):
         return ''.join(self)
@@ -732,6 +1037,83 @@ class SSHTail(SSHClient):
         return list(self)
 
 
+@attr.s(frozen=True)
+class HostCommandResults(object):
+    """Results of the commands run on one host by :py:func:`run_command_on_hosts`
+
+    ``results`` and ``durations`` hold a :py:class:`SSHResult` and the time it took in seconds
+    for every command that was run, ``error`` the exception if the host could not be reached or
+    a command raised. ``target`` is the target the commands were run on.
+    """
+    hostname = attr.ib()
+    results = attr.ib(default=attr.Factory(list))
+    durations = attr.ib(default=attr.Factory(list), repr=False)
+    error = attr.ib(default=None)
+    target = attr.ib(default=None, repr=False)
+
+    @property
+    def duration(self):
+        return sum(self.durations)
+
+    @property
+    def success(self):
+        return self.error is None and all(result.success for result in self.results)
+
+    @property
+    def failed(self):
+        return not self.success
+
+
+def run_command_on_hosts(targets, commands, max_workers=10, stop_on_failure=True, **kwargs):
+    """Run the same command(s) on several hosts concurrently.
+
+    Every host gets its commands run in order in a worker thread, at most ``max_workers`` hosts
+    at a time. A host failing does not affect the others.
+
+    .. code-block:: python
+
+        results = run_command_on_hosts(appliances, ['systemctl stop evmserverd', 'rm -f x'])
+        failed = [result.hostname for result in results if result.failed]
+
+    Args:
+        targets: :py:class:`SSHClient` instances, or objects with an ``ssh_client`` and a
+            ``hostname`` like appliances
+        commands: a command, or a list of commands to run one after another on each host
+        max_workers: how many hosts to run commands on at the same time
+        stop_on_failure: do not run further commands on a host once one of them failed
+        **kwargs: passed to :py:meth:`SSHClient.run_command`
+    Returns:
+        A list of :py:class:`HostCommandResults`, one for every target in the order of targets,
+        also when several targets are the same host
+    """
+    if isinstance(commands, (six.string_types, dict)):
+        commands = [commands]
+
+    def _hostname(target):
+        return getattr(target, 'hostname', None) or target._connect_kwargs['hostname']
+
+    def _run(target):
+        results, durations = [], []
+        try:
+            ssh_client = getattr(target, 'ssh_client', target)
+            for command in commands:
+                start = time()
+                result = ssh_client.run_command(command, **kwargs)
+                durations.append(time() - start)
+                results.append(result)
+                if result.failed and stop_on_failure:
+                    break
+        except (Exception, gevent.Timeout) as e:
+            logger.exception('Running commands on %s failed', _hostname(target))
+            return HostCommandResults(_hostname(target), results, durations, error=e,
+                                      target=target)
+        return HostCommandResults(_hostname(target), results, durations, target=target)
+
+    targets = list(targets)
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_run, targets))
+
+
 def keygen():
     """Generate temporary ssh keypair for appliance SSH auth
 
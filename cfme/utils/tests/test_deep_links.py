@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from cfme.utils.appliance.implementations.ui import CFMENavigateStep, navigator
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+SHOW_LIST = 'https://appliance/ems_infra/show_list'
+DASHBOARD = 'https://appliance/dashboard/show'
+
+
+class FakePlugin(object):
+    def ensure_page_safe(self):
+        pass
+
+
+class FakeWidgetastic(object):
+    def __init__(self):
+        self.url = DASHBOARD
+        self.plugin = FakePlugin()
+
+
+class FakeBrowser(object):
+    def __init__(self):
+        self.deep_links = {}
+        self.widgetastic = FakeWidgetastic()
+
+
+class FakeAppliance(object):
+    def __init__(self):
+        self.browser = FakeBrowser()
+
+
+class ProviderCollection(object):
+    def __init__(self, appliance):
+        self.appliance = appliance
+
+
+class Provider(object):
+    def __init__(self, appliance, name):
+        self.appliance = appliance
+        self.name = name
+
+
+class All(CFMENavigateStep):
+    """Step registered for both the collection and the providers"""
+    VIEW = object
+    DEEP_LINK = True
+    URL = SHOW_LIST
+    _name = 'All'
+
+    def am_i_here(self):
+        return self.appliance.browser.widgetastic.url == self.URL
+
+
+class Details(All):
+    _name = 'Details'
+
+
+@pytest.fixture
+def appliance():
+    return FakeAppliance()
+
+
+def step(step_class, obj):
+    return step_class(obj, navigator)
+
+
+def test_remembered_link_is_followed_for_any_object(appliance):
+    browser = appliance.browser
+    browser.widgetastic.url = SHOW_LIST
+    step(All, ProviderCollection(appliance)).remember_deep_link()
+    assert browser.deep_links == {(All, 'All'): SHOW_LIST}
+
+    browser.widgetastic.url = DASHBOARD
+    assert step(All, Provider(appliance, 'vsphere')).follow_deep_link()
+    assert browser.widgetastic.url == SHOW_LIST
+
+
+def test_no_link_to_follow(appliance):
+    assert not step(All, ProviderCollection(appliance)).follow_deep_link()
+    assert appliance.browser.widgetastic.url == DASHBOARD
+    assert appliance.browser.deep_links == {}
+
+
+def test_registrations_of_one_step_class_are_not_shared(appliance):
+    browser = appliance.browser
+    browser.widgetastic.url = SHOW_LIST
+    step(All, ProviderCollection(appliance)).remember_deep_link()
+    step(All, Provider(appliance, 'vsphere')).remember_deep_link()
+    step(All, Provider(appliance, 'rhevm')).remember_deep_link()
+
+    assert browser.deep_links == {(All, 'All'): SHOW_LIST}
+
+
+def test_link_shared_by_step_classes_is_dropped(appliance):
+    browser = appliance.browser
+    browser.widgetastic.url = SHOW_LIST
+    step(All, ProviderCollection(appliance)).remember_deep_link()
+    step(Details, Provider(appliance, 'vsphere')).remember_deep_link()
+
+    assert browser.deep_links == {(All, 'All'): None, (Details, 'Details'): None}
+    assert not step(All, ProviderCollection(appliance)).follow_deep_link()
+
+
+def test_link_not_leading_to_the_view_is_dropped(appliance):
+    browser = appliance.browser
+    browser.deep_links[(All, 'All')] = DASHBOARD
+    collection = ProviderCollection(appliance)
+
+    assert not step(All, collection).follow_deep_link()
+    assert browser.deep_links == {(All, 'All'): None}
+
+    # not recorded again once the step reaches its view the usual way
+    browser.widgetastic.url = SHOW_LIST
+    step(All, collection).remember_deep_link()
+    assert browser.deep_links == {(All, 'All'): None}
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import re
+
+import pytest
+
+from cfme.utils.events import Event, EventAttr, ExpectedEvents, RestEventListener
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+
+def event(**attrs):
+    return Event(None, *[EventAttr(**{name: value}) for name, value in attrs.items()])
+
+
+def got_event(event_id, event_type, target_type='VmOrTemplate', target_id=1):
+    return {'_data': {'id': event_id, 'event_type': event_type, 'target_type': target_type,
+                      'target_id': target_id}}
+
+
+def test_expected_events_candidates():
+    expected = ExpectedEvents()
+    expected.add(event(event_type='vm_create', target_type='VmOrTemplate'))
+    expected.add(event(event_type='vm_delete', target_type='VmOrTemplate'))
+    expected.add(event(target_type='Host'))
+    expected.add(Event(None, EventAttr(event_type='vm', cmp_func=lambda x, y: y.startswith(x))))
+
+    candidates = expected.candidates(Event(None).build_from_entity(got_event(1, 'vm_create')))
+    assert [exp_event['event'] for exp_event in candidates] == [
+        expected.expectations[0]['event'], expected.expectations[3]['event']]
+
+
+def test_expected_events_dispatch():
+    expected = ExpectedEvents()
+    callbacks = []
+    expected.add(event(event_type='vm_create', target_id=1), first_event=True,
+                 callback=lambda exp_event, got_event: callbacks.append(got_event))
+    expected.add(event(event_type='vm_create'))
+    expected.add(event(event_type='vm_delete'))
+
+    for event_id in (1, 2):
+        expected.dispatch(Event(None).build_from_entity(got_event(event_id, 'vm_create')))
+
+    assert [len(exp_event['matched_events']) for exp_event in expected] == [1, 2, 0]
+    assert len(callbacks) == 1
+    assert expected.waiting() == expected.expectations[1:]
+
+
+class FakeEntity(object):
+    """Entity of manageiq_client, reloaded with a request of its own"""
+    def __init__(self, event_streams, data):
+        self.event_streams = event_streams
+        self._data = data
+
+    @property
+    def id(self):
+        self.reload()
+        return self._data['id']
+
+    def reload(self):
+        self.event_streams.reloads += 1
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+class FakeEventStreams(object):
+    _href = 'https://appliance/api/event_streams'
+
+    def __init__(self, events):
+        self.events = events
+        self.reloads = 0
+
+    def query_string(self, **kwargs):
+        return [FakeEntity(self, self.events[-1]['_data'])] if self.events else []
+
+    def filter(self, q):
+        entities = [FakeEntity(self, event['_data']) for event in self.events]
+        for entity in entities:
+            entity.reload()
+        return entities
+
+
+class FakeRestApi(object):
+    def __init__(self, event_streams):
+        self.collections = self
+        self.event_streams = event_streams
+        self.queries = []
+
+    def get(self, url):
+        self.queries.append(url)
+        last_id = int(re.search(r'filter\[\]=id>(\d+)', url).group(1))
+        limit = int(re.search(r'limit=(\d+)', url).group(1))
+        resources = [event['_data'] for event in self.event_streams.events
+                     if event['_data']['id'] > last_id]
+        return {'resources': resources[:limit]}
+
+
+class FakeAppliance(object):
+    def __init__(self, event_streams):
+        self.rest_api = FakeRestApi(event_streams)
+
+
+def test_rest_event_listener_fetches_portion_once():
+    event_streams = FakeEventStreams([])
+    appliance = FakeAppliance(event_streams)
+    listener = RestEventListener(appliance)
+    for index in range(20):
+        listener(event_type='vm_create_{}'.format(index))
+    assert listener.get_next_portion() == []
+
+    event_streams.events = [got_event(1, 'vm_create_3'), got_event(2, 'vm_create_7')]
+    for got in listener.get_next_portion():
+        listener._expected.dispatch(got)
+
+    assert listener.get_next_portion() == []
+    # one query per portion and no request per event
+    assert len(appliance.rest_api.queries) == 3
+    assert event_streams.reloads == 0
+    matched = [index for index, exp_event in enumerate(listener.got_events)
+               if exp_event['matched_events']]
+    assert matched == [3, 7]
+
+
+def test_rest_event_listener_pages_by_id():
+    event_streams = FakeEventStreams([got_event(event_id, 'vm_create') for event_id in range(1, 6)])
+    appliance = FakeAppliance(event_streams)
+    listener = RestEventListener(appliance)
+    listener.PORTION_SIZE = 2
+
+    events = listener.get_next_portion()
+
+    assert [event.event_attrs['id'].value for event in events] == [1, 2, 3, 4, 5]
+    assert listener._last_processed_id == 5
+    assert len(appliance.rest_api.queries) == 3
+    assert event_streams.reloads == 0
@@ -36,3 +36,64 @@ def test_context_hack(monkeypatch):
     with pytest.raises(ValueError):
         with ip_a:
             raise ValueError("test")
+
+
+class FakeServer(object):
+    def __init__(self):
+        self.updates = []
+
+    def update_advanced_settings(self, settings_dict):
+        self.updates.append(settings_dict)
+
+
+@pytest.fixture
+def settings_appliance(monkeypatch):
+    ip_a = IPAppliance(hostname='1.2.3.4', version='5.9.1')
+    ip_a.fetched = 0
+    ip_a.fingerprint = (1, 1, None)
+
+    def fetch():
+        ip_a.fetched += 1
+        return {'server': {'role': 'database_operations'}, 'session': {'timeout': 3600}}
+
+    monkeypatch.setattr(ip_a, '_fetch_advanced_settings', fetch)
+    monkeypatch.setattr(ip_a, '_settings_fingerprint', lambda: ip_a.fingerprint)
+    monkeypatch.setattr(ip_a, 'server_id', lambda: 1)
+    monkeypatch.setattr(IPAppliance, 'server', FakeServer())
+    return ip_a
+
+
+def test_advanced_settings_cache(settings_appliance):
+    settings = settings_appliance.advanced_settings
+    settings['session']['timeout'] = 10
+    assert settings_appliance.advanced_settings['session'] == {'timeout': 3600}
+    assert settings_appliance.fetched == 1
+    # changed in the database
+    settings_appliance.fingerprint = (2, 2, None)
+    settings_appliance.advanced_settings
+    assert settings_appliance.fetched == 2
+    # changed by the appliance itself
+    settings_appliance.update_advanced_settings({'session': {'timeout': 10}})
+    settings_appliance.advanced_settings
+    assert settings_appliance.fetched == 3
+
+
+def test_batched_settings_update(settings_appliance):
+    with settings_appliance.batched_settings_update():
+        settings_appliance.update_advanced_settings({'session': {'timeout': 10}})
+        settings_appliance.update_advanced_settings({'server': {'role': 'ems_inventory'}})
+        with settings_appliance.batched_settings_update():
+            settings_appliance.update_advanced_settings({'session': {'interval': 60}})
+        assert settings_appliance.server.updates == []
+        assert settings_appliance.advanced_settings == {
+            'server': {'role': 'ems_inventory'}, 'session': {'timeout': 10, 'interval': 60}}
+    assert settings_appliance.server.updates == [
+        {'server': {'role': 'ems_inventory'}, 'session': {'timeout': 10, 'interval': 60}}]
+
+
+def test_batched_settings_update_error(settings_appliance):
+    with pytest.raises(ValueError):
+        with settings_appliance.batched_settings_update():
+            settings_appliance.update_advanced_settings({'session': {'timeout': 10}})
+            raise ValueError()
+    assert settings_appliance.server.updates == []
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import re
+from threading import Lock
+from time import sleep, time
+
+import pytest
+
+from cfme.utils.log_validator import LogValidator, _combined
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+
+class FakeTail(object):
+    """Remote file tail returning the lines appended with :py:meth:`append`"""
+    def __init__(self):
+        self._lines = []
+        self._lock = Lock()
+        self.grep_patterns = []
+
+    def append(self, *lines):
+        with self._lock:
+            self._lines.extend(lines)
+
+    def __iter__(self):
+        with self._lock:
+            lines, self._lines = self._lines, []
+        return iter(lines)
+
+    def wait_read(self, timeout=5):
+        """Waits until the appended lines were read"""
+        start = time()
+        while self._lines and time() - start < timeout:
+            sleep(0.01)
+        assert not self._lines
+
+    def grep_lines(self, pattern):
+        self.grep_patterns.append(pattern)
+        return (line for line in self if re.search(pattern, line))
+
+
+@pytest.fixture
+def validator_factory():
+    def _validator(**kwargs):
+        validator = LogValidator(
+            '/var/www/miq/vmdb/log/evm.log',
+            hostname='127.0.0.1', username='root', password='password', **kwargs)
+        validator._remote_file_tail = FakeTail()
+        return validator
+    return _validator
+
+
+def test_combined_regex():
+    combined = _combined(['.*ERROR.*', 'WARN'])
+    assert combined.match('[----] ERROR -- : boom')
+    assert combined.match('WARN something')
+    assert not combined.match('[----] INFO -- : WARN')
+    assert _combined([]) is None
+    # named groups can not be repeated in one regex, every pattern is checked on its own then
+    assert _combined(['(?P<level>ERROR)', '(?P<level>WARN)']) is None
+
+
+def test_validate_logs(validator_factory):
+    validator = validator_factory(
+        skip_patterns=['.*PARTICULAR_ERROR.*'], failure_patterns=['.*ERROR.*'],
+        matched_patterns=['.*PARTICULAR_INFO.*'])
+    validator._remote_file_tail.append(
+        'INFO -- : PARTICULAR_INFO', 'ERROR -- : PARTICULAR_ERROR', 'INFO -- : unrelated')
+    validator.validate_logs()
+    assert validator.matches == {'.*PARTICULAR_INFO.*': True}
+
+    validator._remote_file_tail.append('ERROR -- : another error')
+    with pytest.raises(pytest.fail.Exception):
+        validator.validate_logs()
+
+
+def test_validate_logs_missing_match(validator_factory):
+    validator = validator_factory(matched_patterns=['.*PARTICULAR_INFO.*'])
+    validator._remote_file_tail.append('INFO -- : unrelated')
+    with pytest.raises(pytest.fail.Exception):
+        validator.validate_logs()
+
+
+def test_server_side_filter(validator_factory):
+    validator = validator_factory(
+        skip_patterns=['.*SKIP.*'], failure_patterns=['.*ERROR.*'],
+        matched_patterns=['.*EXPECTED.*'], server_side_filter=True)
+    tail = validator._remote_file_tail
+    tail.append('EXPECTED line', 'SKIP this ERROR', 'unrelated')
+
+    validator.validate_logs()
+
+    assert tail.grep_patterns == ['^(?:.*SKIP.*)|^(?:.*ERROR.*)|^(?:.*EXPECTED.*)']
+    assert validator.matches == {'.*EXPECTED.*': True}
+
+
+def test_start_streaming_reports_failure(validator_factory):
+    validator = validator_factory(failure_patterns=['.*ERROR.*'])
+    validator.start_streaming(interval=0.01)
+    validator._remote_file_tail.append('ERROR -- : streamed error')
+    validator._remote_file_tail.wait_read()
+    with pytest.raises(pytest.fail.Exception):
+        validator.validate_logs()
+    assert validator._streaming_thread is None
+
+
+def test_start_streaming_reads_lines_while_running(validator_factory):
+    validator = validator_factory(matched_patterns=['.*EXPECTED.*'])
+    validator.start_streaming(interval=0.01)
+    validator._remote_file_tail.append('EXPECTED line')
+    validator._remote_file_tail.wait_read()
+    # the lines were read by the streaming thread, validate_logs gets no new ones
+    validator.validate_logs()
+    assert validator.matches == {'.*EXPECTED.*': True}
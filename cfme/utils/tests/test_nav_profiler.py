@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from cfme.utils.nav_profiler import NavigationProfiler
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def tick(self, seconds):
+        self.now += seconds
+
+
+def navigate(profiler, clock, destination, prerequisite=None):
+    """Simulates the spans of CFMENavigateStep.go, every span lasting one second"""
+    with profiler.span('navigate', destination):
+        with profiler.span('badness_check'):
+            clock.tick(1)
+        if prerequisite is not None:
+            with profiler.span('prerequisite'):
+                navigate(profiler, clock, *prerequisite)
+        with profiler.span('step'):
+            clock.tick(1)
+
+
+@pytest.fixture
+def profiled():
+    clock = Clock()
+    profiler = NavigationProfiler(clock=clock)
+    profiler.enabled = True
+    profiler.start_test('test_vms')
+    navigate(profiler, clock, 'Vm/Details', ('Vm/All', ('Server/LoggedIn',)))
+    navigate(profiler, clock, 'Vm/All')
+    profiler.finish_test()
+    return profiler
+
+
+def test_nav_profiler_aggregates(profiled):
+    assert profiled.destinations == {
+        'Vm/Details': [1, 6.0, 6.0], 'Vm/All': [2, 6.0, 4.0], 'Server/LoggedIn': [1, 2.0, 2.0]}
+    assert profiled.kinds['badness_check'] == [4, 4.0]
+    assert profiled.kinds['navigate'] == [4, 0.0]
+    assert profiled.chains == {'Vm/Details <- Vm/All <- Server/LoggedIn': [1, 6.0]}
+    assert profiled.tests == {'test_vms': [2, 8.0]}
+    assert ('navigate:Vm/Details;prerequisite;navigate:Vm/All;step 1000000' in
+            profiled.folded_stacks())
+
+
+def test_nav_profiler_merge(profiled, tmpdir):
+    dump = tmpdir.join('slave.json').strpath
+    profiled.dump(dump)
+    merged = NavigationProfiler()
+    merged.load(dump)
+    merged.load(dump)
+    assert merged.destinations['Vm/All'] == [4, 12.0, 4.0]
+    assert merged.tests == {'test_vms': [4, 16.0]}
+    assert 'Vm/Details <- Vm/All <- Server/LoggedIn' in merged.report()
+
+
+def test_nav_profiler_disabled():
+    profiler = NavigationProfiler()
+    with profiler.span('navigate', 'Vm/All'):
+        pass
+    assert profiler.destinations == {}
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from cfme.fixtures.parallelizer import scheduler
+
+
+@pytest.fixture
+def durations():
+    return scheduler.DurationStore({
+        'test_a.py::test_one[prov1]': 100.,
+        'test_a.py::test_two[prov1]': 100.,
+        'test_b.py::test_one': 10.,
+        'test_c.py::test_one': 30.,
+    })
+
+
+def test_unknown_test_costs_mean_duration(durations):
+    assert durations.cost('test_d.py::test_new') == 60.
+    assert scheduler.DurationStore().cost('test_d.py::test_new') == scheduler.DEFAULT_TEST_COST
+
+
+def test_schedule_longest_first_and_splits_oversized(durations):
+    groups = [
+        ['test_b.py::test_one'],
+        ['test_a.py::test_one[prov1]', 'test_a.py::test_two[prov1]'],
+        ['test_c.py::test_one'],
+    ]
+    costed = scheduler.schedule(groups, durations, slave_count=2)
+    assert costed == [
+        (100., ['test_a.py::test_one[prov1]']),
+        (100., ['test_a.py::test_two[prov1]']),
+        (30., ['test_c.py::test_one']),
+        (10., ['test_b.py::test_one']),
+    ]
+    assert scheduler.predict_makespan([cost for cost, _ in costed], 2) == 130.
+
+
+def test_without_cache():
+    # the cacheprovider plugin is disabled
+    durations = scheduler.DurationStore.from_cache(None)
+    assert durations.cost('test_a.py::test_one') == scheduler.DEFAULT_TEST_COST
+    durations.record('test_a.py::test_one', 5.)
+    durations.save(None)
+
+
+def test_merged_durations_are_smoothed(durations):
+    durations.record('test_b.py::test_one', 5.)
+    durations.record('test_b.py::test_one', 25.)
+    durations.record('test_d.py::test_new', 3.)
+    merged = durations.merged()
+    assert merged['test_b.py::test_one'] == 20.
+    assert merged['test_d.py::test_new'] == 3.
+    assert merged['test_c.py::test_one'] == 30.
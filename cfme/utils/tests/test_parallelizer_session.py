@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+import logging
+import signal
+from collections import deque
+
+import pytest
+
+from cfme.fixtures import parallelizer
+from cfme.fixtures.parallelizer import ParallelSession, SlaveDetail
+from cfme.fixtures.parallelizer.remote import SlaveManager
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+
+class FakeAppliance(object):
+    def __init__(self, url):
+        self.url = url
+
+
+class FakeTerminal(object):
+    def write_ensure_prefix(self, prefix, message, **markup):
+        pass
+
+
+class FakeHook(object):
+    def pytest_miq_node_shutdown(self, config, nodeinfo):
+        config.shutdown_nodes.append(nodeinfo)
+
+
+class FakeConfig(object):
+    def __init__(self):
+        self.hook = FakeHook()
+        self.shutdown_nodes = []
+
+
+class FakeSession(ParallelSession):
+    """Parallel session with the slaves given, recording the messages sent to them"""
+    def __init__(self, slaves, test_groups=()):
+        self.slaves = {slave.id: slave for slave in slaves}
+        self.appliances = [slave.appliance for slave in slaves]
+        self.idle_slaves = []
+        self.failed_slave_test_groups = deque()
+        self.added_appliances = deque()
+        self.retired_appliances = deque()
+        self.collection = [test for group in test_groups for test in group] or ['test']
+        self.test_groups = iter([list(group) for group in test_groups])
+        self._pool = []
+        self.provs = ['vsphere', 'rhevm']
+        self.used_prov = set()
+        self.sent_tests = 0
+        self.slave_spawn_count = 0
+        self.worker_config = {}
+        self.log = logging.getLogger(__name__)
+        self.terminal = FakeTerminal()
+        self.config = FakeConfig()
+        self.sent = []
+        self.shutdowns_monitored = []
+
+    def send(self, slave, event_data):
+        self.sent.append((slave.id, event_data))
+
+    def monitor_shutdown(self, slave):
+        self.shutdowns_monitored.append(slave.id)
+
+
+def slave(name, tests=(), provider=None):
+    slave = SlaveDetail(appliance=FakeAppliance(name), worker_config={}, id=name.encode('ascii'))
+    slave.tests.update(tests)
+    if provider is not None:
+        slave.provider_allocation.append(provider)
+    return slave
+
+
+def node_ids(name, count, prov='vsphere'):
+    return ['test_{}.py::test_{}[{}]'.format(name, i, prov) for i in range(count)]
+
+
+def test_idle_slave_gets_the_next_group():
+    idle = slave('idle')
+    session = FakeSession([idle], [node_ids('a', 2)])
+    session.idle_slaves.append(idle)
+
+    session._serve_idle_slaves()
+
+    assert session.sent == [(b'idle', node_ids('a', 2))]
+    assert idle.tests == set(node_ids('a', 2))
+    assert session.sent_tests == 2
+    assert session.idle_slaves == []
+
+
+def test_steal_threshold():
+    idle = slave('idle')
+    busy = slave('busy', node_ids('a', parallelizer.STEAL_THRESHOLD - 1))
+    session = FakeSession([idle, busy])
+    session.idle_slaves.append(idle)
+
+    session._serve_idle_slaves()
+
+    # not enough unstarted tests to release, the idle slave shuts down
+    assert session.sent == [(b'idle', [])]
+    assert busy.thief is None
+
+    busy.tests.update(node_ids('b', 1))
+    session.idle_slaves.append(idle)
+    session._serve_idle_slaves()
+    assert busy.thief is idle
+    assert session.idle_slaves == [idle]
+
+
+def test_victim_choice_prefers_shared_provider():
+    idle = slave('idle', provider='rhevm')
+    biggest = slave('biggest', node_ids('a', 10, 'vsphere'))
+    same_provider = slave('same', node_ids('b', 5, 'rhevm'))
+    smaller = slave('smaller', node_ids('c', 6, 'rhevm'))
+    session = FakeSession([idle, biggest, same_provider, smaller])
+
+    assert session._steal_victim(idle) is smaller
+    # a slave already robbed by another one is not a candidate
+    smaller.thief = slave('other')
+    assert session._steal_victim(idle) is same_provider
+    assert session._steal_victim(slave('nowhere')) is biggest
+
+
+def test_steal_replaces_one_ack():
+    idle = slave('idle')
+    busy = slave('busy', node_ids('a', 6))
+    session = FakeSession([idle, busy])
+    busy.thief = idle
+
+    session.ack(busy, 'message')
+    session.ack(busy, 'runtest_logstart')
+    session.ack(busy, 'runtest_logreport')
+
+    assert session.sent == [
+        (b'busy', 'ack message'), (b'busy', 'steal'), (b'busy', 'ack runtest_logreport')]
+
+
+def test_released_tests_go_to_the_thief():
+    idle = slave('idle')
+    busy = slave('busy', node_ids('a', 6, 'rhevm'))
+    session = FakeSession([idle, busy])
+    session.sent_tests = 6
+    session.idle_slaves.append(idle)
+    session._serve_idle_slaves()
+    session.ack(busy, 'runtest_logstart')
+    released = node_ids('a', 6, 'rhevm')[3:]
+
+    session._reassign_released(busy, released)
+
+    assert session.sent[-1] == (b'idle', released)
+    assert busy.tests == set(node_ids('a', 3, 'rhevm'))
+    assert idle.tests == set(released)
+    assert idle.provider_allocation == ['rhevm']
+    # moved, not counted twice
+    assert session.sent_tests == 6
+    assert (busy.thief, busy.steal_sent) == (None, False)
+    assert session.idle_slaves == []
+
+
+def test_nothing_released_serves_the_thief_again():
+    idle = slave('idle')
+    busy = slave('busy', node_ids('a', 4))
+    session = FakeSession([idle, busy])
+    session.idle_slaves.append(idle)
+    session._serve_idle_slaves()
+
+    session._reassign_released(busy, [])
+
+    assert busy.thief is None
+    assert session.idle_slaves == [idle]
+    session._serve_idle_slaves()
+    # asked again, the busy slave still has enough tests left
+    assert busy.thief is idle
+
+
+def test_released_tests_without_waiting_thief_are_requeued():
+    idle = slave('idle')
+    busy = slave('busy', node_ids('a', 6))
+    session = FakeSession([idle, busy])
+    session.sent_tests = 6
+    busy.thief = idle
+    released = node_ids('a', 6)[3:]
+
+    session._reassign_released(busy, released)
+
+    assert list(session.failed_slave_test_groups) == [released]
+    assert session.sent_tests == 3
+    assert session.next_tests(idle) == released
+
+
+def test_thief_is_freed_when_the_victim_shuts_down_first():
+    idle = slave('idle')
+    busy = slave('busy', node_ids('a', 4))
+    session = FakeSession([idle, busy])
+    session.idle_slaves.append(idle)
+    session._serve_idle_slaves()
+    assert busy.thief is idle
+
+    # the victim finished its tests and left before being asked to release any
+    del session.slaves[busy.id]
+    session._serve_idle_slaves()
+
+    assert session.sent == [(b'idle', [])]
+    assert session.idle_slaves == []
+
+
+def test_thief_is_freed_when_the_victim_runs_out_of_tests():
+    idle = slave('idle')
+    busy = slave('busy', node_ids('a', 4))
+    other = slave('other', node_ids('b', 5))
+    session = FakeSession([idle, busy])
+    session.idle_slaves.append(idle)
+    session._serve_idle_slaves()
+    assert busy.thief is idle
+
+    # the victim asks for tests before the steal was sent, like the runtest loop handles it
+    session.slaves[other.id] = other
+    busy.tests.clear()
+    busy.thief = None
+    session.idle_slaves.append(busy)
+    session._serve_idle_slaves()
+
+    # the thief is no longer waiting for the victim and robs another slave
+    assert other.thief is idle
+    assert session.sent == [(b'busy', [])]
+    assert session.idle_slaves == [idle]
+
+
+def test_slave_releases_the_later_half_of_its_unstarted_tests():
+    manager = SlaveManager.__new__(SlaveManager)
+    manager.log = logging.getLogger(__name__)
+    manager.pending = deque(node_ids('a', 5))
+    events = []
+    manager.send_event = lambda name, **kwargs: events.append((name, kwargs))
+
+    manager.release_tests()
+
+    assert list(manager.pending) == node_ids('a', 5)[:3]
+    assert events == [('released_tests', {'node_ids': node_ids('a', 5)[3:]})]
+
+
+class FakeProcess(object):
+    def __init__(self):
+        self.returncode = None
+        self.signals = []
+
+    def poll(self):
+        return self.returncode
+
+    def send_signal(self, signum):
+        self.signals.append(signum)
+
+    def kill(self):
+        self.returncode = -9
+
+
+@pytest.fixture
+def fake_start(monkeypatch):
+    def start(slave):
+        if not slave.forbid_restart:
+            slave.process = FakeProcess()
+    monkeypatch.setattr(SlaveDetail, 'start', start)
+
+
+def started(name, tests=()):
+    started_slave = slave(name, tests)
+    started_slave.start()
+    return started_slave
+
+
+def test_audit_adds_appliance(fake_start):
+    session = FakeSession([started('first')])
+    appliance = FakeAppliance('added')
+
+    session.add_appliance(appliance)
+    assert len(session.slaves) == 1
+    session._slave_audit()
+
+    added, = [s for s in session.slaves.values() if s.appliance is appliance]
+    assert added.process is not None
+    assert appliance in session.appliances
+    assert not session.added_appliances
+
+
+def test_audit_drain_retires_appliance(fake_start):
+    retired = started('retired', node_ids('a', 2))
+    session = FakeSession([retired, started('other')])
+
+    session.retire_appliance(retired.appliance)
+    session._slave_audit()
+
+    assert retired.retiring
+    assert not retired.forbid_restart
+    assert retired.process.signals == []
+    # the current tests are finished, then the slave gets no more and shuts down
+    retired.tests.clear()
+    session.idle_slaves.append(retired)
+    session._serve_idle_slaves()
+    assert session.sent == [(b'retired', [])]
+    assert session.idle_slaves == []
+
+
+def test_audit_retires_appliance_immediately(fake_start):
+    retired = started('retired', node_ids('a', 3))
+    session = FakeSession([retired, started('other')])
+    session.sent_tests = 3
+
+    session.retire_appliance(retired.appliance, drain=False)
+    session._slave_audit()
+
+    assert retired.forbid_restart
+    assert retired.process.signals == [signal.SIGINT]
+    assert session.shutdowns_monitored == [b'retired']
+    # still shutting down
+    assert retired.id in session.slaves
+    assert session.sent_tests == 3
+
+
+def test_audit_requeues_tests_of_interrupted_slave(fake_start):
+    retired = started('retired', node_ids('a', 3))
+    session = FakeSession([retired, started('other')])
+    session.sent_tests = 3
+    session.retire_appliance(retired.appliance, drain=False)
+    session._slave_audit()
+
+    # exits cleanly without finishing its tests
+    retired.process.returncode = 0
+    session._slave_audit()
+
+    assert retired.id not in session.slaves
+    assert session.config.shutdown_nodes == ['retired']
+    assert session.sent_tests == 0
+    assert sorted(session.next_tests(session.slaves[b'other'])) == node_ids('a', 3)
+    # not restarted
+    assert session.slave_spawn_count == 0
+
+
+def test_audit_respawns_crashed_slave(fake_start):
+    crashed = started('crashed', node_ids('a', 2))
+    session = FakeSession([crashed])
+    session.sent_tests = 2
+    crashed.process.returncode = 1
+
+    session._slave_audit()
+
+    assert crashed.process is not None and crashed.process.returncode is None
+    assert session.slave_spawn_count == 1
+    assert session.sent_tests == 0
+    assert list(session.failed_slave_test_groups) == [set(node_ids('a', 2))]
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import re
+
+import pytest
+
+from cfme.utils import perf_message_stats
+from cfme.utils.perf_message_stats import evm_to_messages
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+STAMP = '[----] I, [2017-01-01T10:00:{:02d}.000000 #{}:2abf2c]  INFO -- : '
+EVM_LOG = [
+    'Starting up\n',
+    STAMP.format(0, 100) + 'MIQ(MiqServer.heartbeat) Heartbeat...Complete\n',
+    STAMP.format(1, 100) + 'MIQ(MiqQueue.put) Message id: [1],  id: [], Zone: [default], '
+    'Command: [Metric::Capture.perf_capture_timer], Timeout: [600], '
+    'Args: [["2017-01-01T10:00:00Z", "hourly"]]\n',
+    STAMP.format(2, 100) + 'MIQ(MiqQueue.put) Message id: [2],  id: [], Zone: [default], '
+    'Command: [MiqServer.status_update], Timeout: [600], Args: []\n',
+    STAMP.format(3, 200) + 'MIQ(MiqQueue.get_via_drb) Message id: [1], Command: '
+    '[Metric::Capture.perf_capture_timer], Dequeued in: [2.5] seconds\n',
+    STAMP.format(4, 300) + 'MIQ(MiqQueue.get_via_drb) Message id: [2], Command: '
+    '[MiqServer.status_update], Dequeued in: [0.25] seconds\n',
+    STAMP.format(5, 200) + 'MIQ(MiqQueue.delivered) Message id: [1], State: [ok], '
+    'Delivered in [1.5] seconds\n',
+    STAMP.format(6, 300) + 'MIQ(MiqQueue.delivered) Message id: [3], State: [ok], '
+    'Delivered in [1.0] seconds\n',
+    'Shutting down\n',
+]
+FILTERS = {'-hourly': re.compile(r'\"[0-9\-]*T[0-9\:]*Z\",\s\"hourly\"')}
+
+
+@pytest.fixture
+def evm_log(tmpdir):
+    evm_log = tmpdir.join('evm.log')
+    evm_log.write(''.join(EVM_LOG))
+    return evm_log.strpath
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+@pytest.mark.parametrize('chunk_size', [64, 1024 * 1024])
+def test_evm_to_messages(monkeypatch, evm_log, processes, chunk_size):
+    monkeypatch.setattr(perf_message_stats, 'EVM_CHUNK_SIZE', chunk_size)
+    messages, msg_cmds, test_start, test_end, line_count = evm_to_messages(
+        evm_log, FILTERS, processes)
+
+    assert line_count == len(EVM_LOG)
+    assert test_start == '2017-01-01 10:00:00.000000'
+    assert test_end == '2017-01-01 10:00:06.000000'
+    assert sorted(messages) == ['1', '2']
+
+    timed = messages['1']
+    assert timed.msg_id == "'1'"
+    assert timed.msg_cmd == 'Metric::Capture.perf_capture_timer-hourly'
+    assert (timed.pid_put, timed.pid_get) == ('100', '200')
+    assert (timed.deq_time, timed.del_time, timed.total_time) == (2.5, 1.5, 4.0)
+    assert messages['2'].deq_time == 0.25
+    assert messages['2'].total_time == 0
+
+    assert msg_cmds['Metric::Capture.perf_capture_timer-hourly'] == {
+        'total': [4.0], 'queue': [2.5], 'execute': [1.5]}
+    assert msg_cmds['MiqServer.status_update'] == {'total': [], 'queue': [], 'execute': []}
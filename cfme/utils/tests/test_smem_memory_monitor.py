@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from datetime import datetime
+
+import pytest
+
+from cfme.utils.smem_memory_monitor import (
+    MemorySamples, SmemMemoryMonitor, appliance_measurements, process_measurements)
+from cfme.utils.ssh import SSHResult
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+START = 1500000000.0
+
+
+def sample(index):
+    return {'rss': 100.0 + index, 'pss': 90.0 + index, 'uss': 80.0 + index, 'vss': 500.0,
+            'swap': 0.0}
+
+
+@pytest.fixture(params=[None, 'spill'])
+def samples(request, tmpdir):
+    spill_dir = tmpdir.strpath if request.param else None
+    samples = MemorySamples(process_measurements, spill_dir, spill_size=4)
+    for index in range(10):
+        samples.append(START + index * 360, sample(index))
+    yield samples
+    samples.close()
+
+
+def test_memory_samples_columns(samples):
+    assert len(samples) == 10
+    assert list(samples.column('rss')) == [100.0 + index for index in range(10)]
+    assert list(samples.times) == [START + index * 360 for index in range(10)]
+    assert samples.start == datetime.fromtimestamp(START)
+    assert samples.end == datetime.fromtimestamp(START + 9 * 360)
+    assert (samples.start_value('uss'), samples.end_value('uss')) == (80.0, 89.0)
+
+
+def test_memory_samples_rows(samples):
+    rows = list(samples.rows())
+    assert len(rows) == 10
+    assert rows[5] == (datetime.fromtimestamp(START + 5 * 360), 105.0, 95.0, 85.0, 500.0, 0.0)
+
+
+def test_memory_samples_spill(tmpdir):
+    samples = MemorySamples(process_measurements, tmpdir.strpath, spill_size=4)
+    for index in range(9):
+        samples.append(START + index, sample(index))
+    assert samples.spilled == 8
+    assert len(tmpdir.listdir()) == 1
+    samples.close()
+    assert not tmpdir.listdir()
+
+
+def test_memory_samples_statistics(samples):
+    pytest.importorskip('numpy')
+    minimum, maximum, average, growth = samples.statistics('rss')
+    assert (minimum, maximum, average) == (100.0, 109.0, 104.5)
+    # one MiB every 6 minutes
+    assert growth == pytest.approx(10.0)
+
+
+MEMINFO = """MemTotal:        8000000 kB
+MemFree:         4000000 kB
+MemAvailable:    6000000 kB
+Buffers:           10240 kB
+Cached:           102400 kB
+SwapTotal:       1024000 kB
+SwapFree:        1024000 kB
+Slab:              51200 kB"""
+SMEM = """  101 10240 9216 8192 51200 0 ruby MiqGenericWorker id: 1
+  102 20480 19456 18432 102400 0 ruby MIQ Server
+  103 1024 1024 1024 4096 0 httpd /usr/sbin/httpd -DFOREGROUND"""
+
+
+def sampler_sample(number, workers=True):
+    lines = ['@@sample {} {}'.format(number, START + number), '@@meminfo', MEMINFO]
+    if workers:
+        lines.extend(['@@workers', ' 101 | MiqGenericWorker'])
+    lines.extend(['@@smem', SMEM, '@@end'])
+    return '\n'.join(lines)
+
+
+class FakeSSHClient(object):
+    def __init__(self, output):
+        self.output = output
+        self.commands = []
+
+    def run_command(self, command, **kwargs):
+        self.commands.append(command)
+        return SSHResult(command=command, rc=0, output=self.output)
+
+
+def test_start_sampler_falls_back_when_not_installed():
+    class FailingPutSSHClient(FakeSSHClient):
+        def put_file(self, local_file, remote_file='.', **kwargs):
+            raise IOError('No space left on device')
+
+    monitor = SmemMemoryMonitor(FailingPutSSHClient(''), {}, sampler_interval=0.5)
+
+    assert not monitor.start_sampler()
+    assert monitor.ssh_client.commands == []
+
+
+def test_fetch_samples():
+    output = '\n'.join([sampler_sample(2), sampler_sample(3, workers=False),
+                        sampler_sample(1), '@@sample 4 {}'.format(START + 4), '@@meminfo'])
+    monitor = SmemMemoryMonitor(FakeSSHClient(output), {}, sampler_interval=0.5)
+    appliance_results = MemorySamples(appliance_measurements)
+    process_results = OrderedDict()
+
+    last_sample, workers = monitor.fetch_samples(appliance_results, process_results, 1, {})
+
+    assert monitor.ssh_client.commands == [
+        'bash /var/tmp/smem-sampler.sh fetch /var/tmp/smem-samples 1']
+    # sample 1 was fetched before and sample 4 is still being written
+    assert last_sample == 3
+    assert workers == {'101': 'MiqGenericWorker'}
+    assert list(appliance_results.times) == [START + 2, START + 3]
+    assert appliance_results.end_value('used') == 3756.25
+    assert list(process_results) == ['MiqGenericWorker', 'MIQ Server (evm_server.rb)', 'httpd']
+    assert list(process_results['MiqGenericWorker']['101'].column('rss')) == [10.0, 10.0]
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import deque
+from time import sleep, time
+
+import pytest
+
+from cfme.utils import ssh
+from cfme.utils.ssh import SSHClient
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+
+class FakeBuffer(object):
+    def __init__(self, chunks):
+        self.chunks = deque(chunks)
+        self.event = None
+
+    def set_event(self, event):
+        self.event = event
+        if self.chunks:
+            event.set()
+        else:
+            event.clear()
+
+    def feed(self, chunk):
+        self.chunks.append(chunk)
+        self.event.set()
+
+    def read(self):
+        chunk = self.chunks.popleft() if self.chunks else b''
+        if not self.chunks and self.event is not None:
+            self.event.clear()
+        return chunk
+
+
+class FakeChannel(object):
+    """Channel of a command which already wrote all of its output and exited"""
+    def __init__(self, output, exit_status=0):
+        self.in_buffer = FakeBuffer([chunk for chunk, is_stderr in output if not is_stderr])
+        self.in_stderr_buffer = FakeBuffer([chunk for chunk, is_stderr in output if is_stderr])
+        self.exit_status = exit_status
+        self.exited = True
+        self.closed = False
+
+    def recv_ready(self):
+        return bool(self.in_buffer.chunks)
+
+    def recv_stderr_ready(self):
+        return bool(self.in_stderr_buffer.chunks)
+
+    def recv(self, size):
+        return self.in_buffer.read()
+
+    def recv_stderr(self, size):
+        return self.in_stderr_buffer.read()
+
+    def exit_status_ready(self):
+        return self.exited and not (self.in_buffer.chunks or self.in_stderr_buffer.chunks)
+
+    def recv_exit_status(self):
+        return self.exit_status
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def client():
+    client = SSHClient(hostname='127.0.0.1', username='root', password='password')
+    yield client
+    client.close()
+
+
+def run_on(client, monkeypatch, output, exit_status=0):
+    channel = FakeChannel(output, exit_status)
+    monkeypatch.setattr(client, '_exec_session', lambda *args: channel)
+    return channel
+
+
+def test_run_command_output_callback(client, monkeypatch):
+    # the multi byte character is split between two reads
+    snowman = u'☃'.encode('utf-8')
+    run_on(client, monkeypatch, [
+        (b'first\n' + snowman[:1], False), (b'error\n', True), (snowman[1:] + b'\n', False)], 3)
+    chunks = []
+
+    result = client.run_command('command', output_callback=lambda *chunk: chunks.append(chunk))
+
+    assert result.rc == 3
+    assert (u'error\n', True) in chunks
+    assert u''.join(chunk for chunk, is_stderr in chunks if not is_stderr) == u'first\n☃\n'
+
+
+def test_run_command_non_ascii_output(client, monkeypatch):
+    text = u'Přehled ┌─┐\n'
+    run_on(client, monkeypatch, [(text.encode('utf-8'), False)])
+    assert client.run_command('command').output == text
+
+    run_on(client, monkeypatch, [(text.encode('utf-8'), False)])
+    assert client.run_command('command', tail_size=4).output == text[-4:]
+
+
+def test_run_command_tail_size(client, monkeypatch):
+    run_on(client, monkeypatch, [(b'a' * 10, False), (b'b' * 10, False), (b'c' * 10, False)])
+
+    assert client.run_command('command', tail_size=15).output == 'b' * 5 + 'c' * 10
+    run_on(client, monkeypatch, [(b'abc', False)])
+    assert client.run_command('command', tail_size=0).output == ''
+
+
+def test_iter_command_lines(client, monkeypatch):
+    channel = run_on(client, monkeypatch, [
+        (b'one\r\ntw', False), (b'o\nthr', False), (b'warning\n', True), (b'ee', False)])
+
+    assert list(client.iter_command_lines('command')) == ['one', 'warning', 'two', 'three']
+    assert channel.closed
+
+
+def test_stderr_output_wakes_up_the_wait(client, monkeypatch):
+    monkeypatch.setattr(ssh, 'READ_WAIT', 30.0)
+    channel = run_on(client, monkeypatch, [])
+    channel.exited = False
+
+    def write_stderr():
+        sleep(0.1)
+        channel.exited = True
+        channel.in_stderr_buffer.feed(b'late error\n')
+
+    writer = threading.Thread(target=write_stderr)
+    start = time()
+    writer.start()
+    try:
+        assert list(client.iter_command_lines('command')) == ['late error']
+    finally:
+        writer.join()
+    assert time() - start < 10
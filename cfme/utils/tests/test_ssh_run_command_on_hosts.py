@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from cfme.utils.ssh import SSHResult, run_command_on_hosts
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+
+class FakeAppliance(object):
+    def __init__(self, hostname, failing_command=None, broken=False):
+        self.hostname = hostname
+        self.failing_command = failing_command
+        self.broken = broken
+        self.commands = []
+
+    @property
+    def ssh_client(self):
+        if self.broken:
+            raise Exception('SSH is unavailable')
+        return self
+
+    def run_command(self, command, **kwargs):
+        self.commands.append(command)
+        rc = 1 if command == self.failing_command else 0
+        return SSHResult(command=command, rc=rc, output=self.hostname)
+
+
+def test_run_command_on_hosts():
+    good = FakeAppliance('1.1.1.1')
+    failing = FakeAppliance('2.2.2.2', failing_command='first')
+    broken = FakeAppliance('3.3.3.3', broken=True)
+
+    results = run_command_on_hosts([good, failing, broken], ['first', 'second'], max_workers=2)
+
+    assert [result.hostname for result in results] == ['1.1.1.1', '2.2.2.2', '3.3.3.3']
+    assert [result.target for result in results] == [good, failing, broken]
+    good_result, failing_result, broken_result = results
+    assert good_result.success
+    assert [result.output for result in good_result.results] == ['1.1.1.1', '1.1.1.1']
+    assert len(good_result.durations) == 2
+    assert failing_result.failed
+    assert failing.commands == ['first']
+    assert broken_result.failed
+    assert broken_result.results == []
+    assert 'unavailable' in str(broken_result.error)
+
+
+def test_run_command_on_hosts_same_host_twice():
+    first = FakeAppliance('1.1.1.1')
+    second = FakeAppliance('1.1.1.1', failing_command='first')
+
+    results = run_command_on_hosts([first, second], 'first')
+
+    assert len(results) == 2
+    assert results[0].success
+    assert results[1].failed
+
+
+def test_run_command_on_hosts_single_command_continues_after_failure():
+    failing = FakeAppliance('2.2.2.2', failing_command='first')
+    results = run_command_on_hosts([failing], ['first', 'second'], stop_on_failure=False)
+    assert failing.commands == ['first', 'second']
+    assert results[0].failed
+
+    results = run_command_on_hosts([failing], 'second')
+    assert results[0].success
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import subprocess
+
+import pytest
+
+from cfme.utils.ssh import SSHResult, SSHTail
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+
+@pytest.fixture
+def local_tail(tmpdir, monkeypatch):
+    """SSHTail of a local file, running its commands locally"""
+    log = tmpdir.join('evm.log')
+    log.write('old match\n')
+    tail = SSHTail(log.strpath, hostname='127.0.0.1', username='root', password='password')
+
+    def run_locally(command, **kwargs):
+        process = subprocess.Popen(
+            ['bash', '-c', command], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0].decode('utf-8')
+        return SSHResult(rc=process.returncode, output=output, command=command)
+
+    monkeypatch.setattr(tail, 'run_command', run_locally)
+    tail._remote_file_size = log.size()
+    yield log, tail
+    tail.close()
+
+
+def test_grep_lines_leaves_incomplete_line(local_tail):
+    log, tail = local_tail
+    log.write('one match\nnothing\ntwo ma', mode='a')
+
+    assert list(tail.grep_lines('match')) == ['one match']
+
+    log.write('tch\nthree', mode='a')
+    assert list(tail.grep_lines('match')) == ['two match']
+    assert list(tail.grep_lines('match')) == []
+    assert tail._remote_file_size == log.size() - len('three')
+
+
+def test_grep_lines_without_new_lines(local_tail):
+    log, tail = local_tail
+    size = log.size()
+
+    assert list(tail.grep_lines('match')) == []
+    assert tail._remote_file_size == size
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from cfme.utils import ssh
+from cfme.utils.ssh import SSHClient, TransportPool
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+KEY = ('1.2.3.4', 22, 'root', 'password', None)
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.active = True
+
+    def is_active(self):
+        return self.active
+
+    def close(self):
+        self.active = False
+
+
+class FakeChannel(object):
+    closed = False
+
+
+def test_concurrently_connected_transport_is_closed():
+    pool = TransportPool()
+    first, second = FakeTransport(), FakeTransport()
+
+    assert pool.add(KEY, first, 1.) is first
+    assert pool.add(KEY, second, 1.) is first
+
+    assert not second.active
+    assert first.active
+    stats = pool.stats()
+    assert stats['transports'] == 1
+    assert stats['clients'] == 2
+    assert stats['connections_opened'] == 2
+    assert stats['connections_reused'] == 1
+
+
+def test_dead_transport_is_replaced():
+    pool = TransportPool()
+    first, second = FakeTransport(), FakeTransport()
+    pool.add(KEY, first, 1.)
+    first.close()
+
+    assert pool.add(KEY, second, 1.) is second
+    assert pool.acquire(KEY) is second
+
+
+def test_stats_count_tracked_open_channels():
+    pool = TransportPool()
+    transport = FakeTransport()
+    pool.add(KEY, transport, 1.)
+    channels = [FakeChannel(), FakeChannel()]
+    for channel in channels:
+        pool.track_channel(transport, channel)
+    pool.track_channel(FakeTransport(), FakeChannel())
+
+    assert pool.stats()['channels_in_use'] == 2
+    channels[0].closed = True
+    assert pool.stats()['channels_in_use'] == 1
+    assert pool.stats(hostname='5.6.7.8')['channels_in_use'] == 0
+
+
+def test_reconnect_releases_dead_transport(monkeypatch):
+    pool = TransportPool()
+    monkeypatch.setattr(ssh, 'transport_pool', pool)
+    dead, live = FakeTransport(), FakeTransport()
+    client = SSHClient(hostname=KEY[0], port=KEY[1], username=KEY[2], password=KEY[3])
+    pool.add(KEY, live, 1.)
+    pool.add(('5.6.7.8',) + KEY[1:], dead, 1.)
+    client._transport = dead
+    dead.close()
+
+    client.connect()
+
+    assert client._transport is live
+    assert pool.stats(hostname='5.6.7.8')['clients'] == 0
+    assert pool.stats(hostname=KEY[0])['clients'] == 2
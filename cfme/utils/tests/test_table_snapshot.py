@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import logging
+import re
+
+import pytest
+from widgetastic.exceptions import RowNotFound
+
+from widgetastic_manageiq import TableSnapshot
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+HEADERS = ['Name', 'State']
+ATTRIBUTIZED_HEADERS = ['name', 'state']
+
+
+class FakeBrowser(object):
+    """Browser returning the rows as the ``CELL_TEXTS`` script would"""
+    def __init__(self, rows_data):
+        self.rows_data = rows_data
+        self.scripts = []
+
+    def element(self, widget):
+        return widget
+
+    def execute_script(self, script, *args):
+        self.scripts.append(args)
+        return self.rows_data
+
+
+class FakeRow(object):
+    def __init__(self, table, row_pos, logger=None):
+        self.table = table
+        self.row_pos = row_pos
+
+
+class FakeTable(object):
+    ROWS = './tbody/tr[./td]|./tr[not(./th) and ./td]'
+    Row = FakeRow
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, rows_data, header_in_body=False):
+        self.browser = FakeBrowser(rows_data)
+        self._is_header_in_body = header_in_body
+
+    def map_column(self, column):
+        if isinstance(column, int):
+            return column
+        elif column in ATTRIBUTIZED_HEADERS:
+            return ATTRIBUTIZED_HEADERS.index(column)
+        return HEADERS.index(column)
+
+
+def row(preceding, *cells):
+    """Row data of the script, the cells are ``text`` or ``(textContent, innerText)``"""
+    cells = [cell if isinstance(cell, tuple) else (cell, cell) for cell in cells]
+    return [preceding, [text for text, _ in cells], [visible for _, visible in cells]]
+
+
+@pytest.fixture
+def table():
+    return FakeTable([
+        row(0, '  vm\n one ', 'on'),
+        row(1, 'vm two', ('off hidden-label', 'off')),
+        # a row with the cells of other columns missing
+        row(2, 'vm three'),
+        row(3, 'vm four', ('', ''))])
+
+
+def test_snapshot_reads_the_table_once(table):
+    snapshot = TableSnapshot(table)
+
+    assert len(snapshot) == 4
+    assert table.browser.scripts == [(table, table.ROWS)]
+
+
+def test_exact_filters_use_normalized_text_content(table):
+    snapshot = TableSnapshot(table)
+
+    assert snapshot.find(name='vm one') == [0]
+    assert snapshot.find(state='off hidden-label') == [1]
+    assert snapshot.find(state='off') == []
+    assert snapshot.find(('Name', 'vm two'), state='off hidden-label') == [1]
+
+
+def test_method_filters(table):
+    snapshot = TableSnapshot(table)
+
+    assert snapshot.find(name__startswith='vm t') == [1, 2]
+    assert snapshot.find(name__endswith='o') == [1]
+    assert snapshot.find(('State', 'contains', 'hidden')) == [1]
+    assert snapshot.find(name__contains='vm', state__contains='') == [0, 1, 3]
+    with pytest.raises(ValueError):
+        snapshot.find(name__matches='vm')
+
+
+def test_regexp_filters_use_visible_text(table):
+    snapshot = TableSnapshot(table)
+
+    assert snapshot.find(state=re.compile(r'^off$')) == [1]
+    assert snapshot.find(state=re.compile(r'hidden')) == []
+    assert snapshot.find(name=re.compile(r'^vm one$')) == [0]
+    # nothing visible, the textContent is used like Browser.text() does
+    assert snapshot.find(state=re.compile(r'^$')) == [3]
+    with pytest.raises(ValueError):
+        snapshot.find(('Name', 'contains', re.compile('vm')))
+
+
+def test_visible_text_falls_back_to_text_content():
+    snapshot = TableSnapshot(FakeTable([row(0, ('hidden  name', '\n'))]))
+
+    assert snapshot.find(name=re.compile(r'^hidden name$')) == [0]
+
+
+@pytest.mark.parametrize('header_in_body, positions', [(False, [2, 3]), (True, [1, 2])])
+def test_row_positions(table, header_in_body, positions):
+    table._is_header_in_body = header_in_body
+    snapshot = TableSnapshot(table)
+
+    rows = list(snapshot.rows(name__startswith='vm t'))
+
+    assert [r.row_pos for r in rows] == positions
+    assert all(r.table is table for r in rows)
+    assert snapshot.row(name='vm four').row_pos == positions[1] + 1
+    with pytest.raises(RowNotFound):
+        snapshot.row(name='vm five')
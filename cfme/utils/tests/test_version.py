@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 import pytest
 
-from cfme.utils.version import Version
+from cfme.utils.version import LOWEST, UPSTREAM, Version, VersionPicker, get_version
 
 GT = '>'
 LT = '<'
@@ -29,3 +29,40 @@ def test_version(v1, op, v2):
         assert v1 < v2
     elif op == EQ:
         assert v1 == v2
+
+
+VERSION_DICT = {LOWEST: 'lowest', '5.8': '5.8', '5.9.1': '5.9.1', UPSTREAM: 'upstream'}
+
+
+@pytest.mark.parametrize(('active_version', 'picked'), [
+    ('5.7.4', 'lowest'),
+    ('5.8', '5.8'),
+    ('5.9.0.22', '5.8'),
+    ('5.9.1', '5.9.1'),
+    ('5.10.0.1', '5.9.1'),
+    (UPSTREAM, 'upstream'),
+])
+def test_version_picker_pick(active_version, picked):
+    picker = VersionPicker(VERSION_DICT)
+    assert picker.pick(get_version(active_version)) == picked
+    # picked again from the memo
+    assert picker.pick(get_version(active_version)) == picked
+
+
+def test_version_picker_no_match():
+    assert VersionPicker({'5.9': '5.9'}).pick(Version('5.8.3')) is None
+
+
+def test_version_picker_descriptor():
+    class Appliance(object):
+        version = Version('5.9.2')
+
+    class Entity(object):
+        appliance = Appliance()
+        picked = VersionPicker(VERSION_DICT)
+
+    entity = Entity()
+    assert entity.picked == '5.9.1'
+    Appliance.version = Version('5.8.1')
+    assert entity.picked == '5.8'
+    assert isinstance(Entity.picked, VersionPicker)
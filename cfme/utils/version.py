@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from bisect import bisect_right
 from datetime import date, datetime
 
 from miq_version import (  # noqa
@@ -67,7 +68,19 @@ def appliance_has_netapp():
 
 
 class VersionPicker(VersionPick):
-    """An adopted version of :py:class:`widgetastic.utils.VersionPick` descriptor."""
+    """An adopted version of :py:class:`widgetastic.utils.VersionPick` descriptor.
+
+    The version keys are converted and sorted once, when the picker is created, and the picked
+    value is remembered for every appliance version, so picking the same version again is a
+    dictionary lookup. The version dictionary must not be changed after the picker is created.
+    """
+
+    def __init__(self, version_dict):
+        super(VersionPicker, self).__init__(version_dict)
+        v_dict = {get_version(k): v for (k, v) in self.version_dict.items()}
+        self._versions = sorted(v_dict)
+        self._values = [v_dict[version] for version in self._versions]
+        self._picked = {}
 
     def __get__(self, obj, cls=None):
         if obj is None:
@@ -89,11 +102,13 @@ class VersionPicker(VersionPick):
         Returns:
             A value from the version dictionary.
         """
-        # convert keys to Versions
         active_version = active_version or current_version()
-
-        v_dict = {get_version(k): v for (k, v) in self.version_dict.items()}
-        versions = v_dict.keys()
-        sorted_matching_versions = sorted((v for v in versions if v <= active_version),
-                                          reverse=True)
-        return v_dict.get(sorted_matching_versions[0]) if sorted_matching_versions else None
+        try:
+            return self._picked[active_version]
+        except KeyError:
+            pass
+        # the highest version lower than or equal to the active version
+        index = bisect_right(self._versions, get_version(active_version)) - 1
+        value = self._values[index] if index >= 0 else None
+        self._picked[active_version] = value
+        return value
@@ -0,0 +1,79 @@
+#!/bin/bash
+# Samples appliance memory, per process memory (smem) and the evm worker pids together into a
+# ring buffer of files on the appliance, so cfme/utils/smem_memory_monitor.py can fetch many
+# samples with a single ssh command.
+#
+# Usage:
+#   smem-sampler.sh start <directory> <interval> <ring size> <workers every> <miq server id>
+#   smem-sampler.sh fetch <directory> <last fetched sample #>
+#   smem-sampler.sh stop <directory>
+#
+# Every sample is a file with sections starting with @@<name> lines:
+#   @@sample <sample #> <epoch time>, @@meminfo, @@workers (every <workers every> samples
+#   only), @@smem and a closing @@end.
+
+command=$1
+dir=$2
+
+case $command in
+start)
+  interval=$3
+  ring=$4
+  workers_every=$5
+  server_id=$6
+  "$0" stop "$dir"
+  rm -rf "$dir"
+  mkdir -p "$dir"
+  echo "$ring" > "$dir/ring"
+  nohup setsid "$0" run "$dir" "$interval" "$ring" "$workers_every" "$server_id" \
+    > /dev/null 2>&1 < /dev/null &
+  echo $! > "$dir/pid"
+  ;;
+run)
+  interval=$3
+  ring=$4
+  workers_every=$5
+  server_id=$6
+  seq=0
+  while true; do
+    seq=$((seq + 1))
+    started=$(date +%s.%N)
+    {
+      echo "@@sample $seq $started"
+      echo "@@meminfo"
+      cat /proc/meminfo
+      if [ $(((seq - 1) % workers_every)) -eq 0 ]; then
+        echo "@@workers"
+        psql -t -q -d vmdb_production \
+          -c "select pid,type from miq_workers where miq_server_id = '$server_id'"
+      fi
+      echo "@@smem"
+      smem -c 'pid rss pss uss vss swap name command' | sed 1d
+      echo "@@end"
+    } > "$dir/sample.tmp"
+    # mv is atomic, a fetch never sees a partially written sample
+    mv "$dir/sample.tmp" "$dir/$((seq % ring)).sample"
+    sleep "$(awk -v started="$started" -v now="$(date +%s.%N)" -v interval="$interval" \
+      'BEGIN { left = interval - (now - started); print (left > 0) ? left : 0 }')"
+  done
+  ;;
+fetch)
+  last=$3
+  ring=$(cat "$dir/ring")
+  for sample in "$dir"/*.sample; do
+    [ -e "$sample" ] && head -n 1 "$sample"
+  done | awk -v last="$last" '$2 > last { print $2 }' | sort -n | while read -r seq; do
+    cat "$dir/$((seq % ring)).sample" 2> /dev/null
+  done
+  ;;
+stop)
+  if [ -e "$dir/pid" ]; then
+    kill -- "-$(cat "$dir/pid")" 2> /dev/null || kill "$(cat "$dir/pid")" 2> /dev/null
+    rm -f "$dir/pid"
+  fi
+  ;;
+*)
+  echo "Usage: $0 start|fetch|stop <directory> ..."
+  exit 1
+  ;;
+esac
@@ -0,0 +1,101 @@
+#!/usr/bin/env python2
+"""Benchmark the evm.log message parser of cfme.utils.perf_message_stats
+
+Generates a synthetic evm.log of the requested size (unless an existing log is given) and times
+:py:func:`cfme.utils.perf_message_stats.evm_to_messages` with each of the requested process
+counts.
+
+Example:
+    scripts/perf_evm_parser_benchmark.py --size-mb 2048 --processes 1 4 8
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime
+from datetime import timedelta
+from time import time
+
+from cfme.utils.perf_message_stats import evm_to_messages
+
+STAMP = '[----] I, [{}T{} #{}:2abf2c]  INFO -- : '
+PUT = ('MIQ(MiqQueue.put) Message id: [{id}],  id: [], Zone: [default], '
+       'Role: [ems_metrics_coordinator], Server: [], Ident: [generic], Target id: [], '
+       'Instance id: [], Task id: [], Command: [{cmd}], Timeout: [600], Priority: [20], '
+       'State: [ready], Deliver On: [], Data: [], '
+       'Args: [["2017-01-01T10:00:00Z", "hourly"]]\n')
+GET = ('MIQ(MiqQueue.get_via_drb) Message id: [{id}], MiqWorker id: [3], Zone: [default], '
+       'Role: [], Server: [], Ident: [generic], Target id: [], Instance id: [], Task id: [], '
+       'Command: [{cmd}], Timeout: [600], Priority: [20], State: [dequeue], Deliver On: [], '
+       'Data: [], '
+       'Args: [], Dequeued in: [{deq:.6f}] seconds\n')
+DELIVERED = ('MIQ(MiqQueue.delivered) Message id: [{id}], State: [ok], Delivered in '
+             '[{dlv:.6f}] seconds\n')
+NOISE = ['MIQ(MiqServer#heartbeat) Heartbeat [2017-01-01 10:00:00 UTC]...Complete\n',
+         'MIQ(ManageIQ::Providers::Vmware::InfraManager::Refresher#refresh) EMS: [vsphere], '
+         'id: [1] Refreshing targets for EMS...Complete\n',
+         'Q-task_id([job_dispatcher]) MIQ(JobProxyDispatcher.dispatch) Complete - Timings: '
+         '{:total_time=>0.0123}\n',
+         '<PolicyEngine> Resolving policy [Host compliance], event [host_compliance_check]\n']
+# average number of other log lines per MiqQueue message line
+NOISE_RATIO = 8
+COMMANDS = ['Metric::Capture.perf_capture_timer', 'MiqServer.status_update',
+            'EmsRefresh.refresh', 'Storage.scan_timer', 'MiqAlert.evaluate_alerts']
+
+
+def generate_log(path, size):
+    """Write roughly ``size`` bytes of evm.log lines to ``path``"""
+    written, msg_id = 0, 0
+    stamp_time = datetime(2017, 1, 1)
+    with open(path, 'w') as log:
+        while written < size:
+            msg_id += 1
+            stamp_time += timedelta(milliseconds=250)
+            stamp = STAMP.format(stamp_time.strftime('%Y-%m-%d'),
+                                 stamp_time.strftime('%H:%M:%S.%f'), random.randint(1000, 9000))
+            values = {'id': msg_id, 'cmd': random.choice(COMMANDS), 'deq': random.random(),
+                      'dlv': random.random() * 10}
+            lines = []
+            for message in (PUT, GET, DELIVERED):
+                lines.append(stamp + message.format(**values))
+                lines.extend(stamp + random.choice(NOISE) for _ in range(NOISE_RATIO))
+            chunk = ''.join(lines)
+            log.write(chunk)
+            written += len(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--evm-log', help='Existing evm.log to parse instead of a generated one')
+    parser.add_argument('--size-mb', type=int, default=1024,
+                        help='Size of the generated evm.log in MiB')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1],
+                        help='Process counts to benchmark the parser with')
+    args = parser.parse_args()
+
+    evm_log = args.evm_log
+    if evm_log is None:
+        handle, evm_log = tempfile.mkstemp(prefix='evm-benchmark-', suffix='.log')
+        os.close(handle)
+        print('Generating {} MiB evm.log at {}'.format(args.size_mb, evm_log))
+        generate_log(evm_log, args.size_mb * 1024 * 1024)
+    size_mb = os.path.getsize(evm_log) / 1024.0 / 1024.0
+
+    try:
+        for processes in args.processes:
+            starttime = time()
+            messages, msg_cmds, test_start, test_end, line_count = evm_to_messages(
+                evm_log, {}, processes)
+            timediff = time() - starttime
+            print('{} process(es): {} lines, {} messages in {:.2f}s ({:.1f} MiB/s)'.format(
+                processes, line_count, len(messages), timediff, size_mb / timediff))
+    finally:
+        if args.evm_log is None:
+            os.remove(evm_log)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
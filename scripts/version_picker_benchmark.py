@@ -0,0 +1,96 @@
+#!/usr/bin/env python2
+"""Benchmark the picks of cfme.utils.version.VersionPicker
+
+Builds a view and a plain class with many :py:class:`cfme.utils.version.VersionPicker`
+attributes, the way the UI views and models use them, and times reading all the attributes
+repeatedly with the memoized picker and with the former pick, which converted and sorted the
+version keys on every access.
+
+Example:
+    scripts/version_picker_benchmark.py --attributes 50 --rounds 2000 --version 5.9.2.4
+"""
+import argparse
+import sys
+from time import time
+
+from widgetastic.browser import Browser
+from widgetastic.widget import View
+
+from cfme.utils.version import LOWEST, UPSTREAM, Version, VersionPicker, get_version
+
+VERSION_DICT = {LOWEST: 'lowest', '5.7': '5.7', '5.8': '5.8', '5.8.2': '5.8.2', '5.9': '5.9',
+                '5.9.1': '5.9.1', '5.10': '5.10', UPSTREAM: 'upstream'}
+
+
+class FormerVersionPicker(VersionPicker):
+    """VersionPicker picking like it did before the picks were memoized"""
+
+    def pick(self, active_version=None):
+        v_dict = {get_version(k): v for (k, v) in self.version_dict.items()}
+        versions = v_dict.keys()
+        sorted_matching_versions = sorted((v for v in versions if v <= active_version),
+                                          reverse=True)
+        return v_dict.get(sorted_matching_versions[0]) if sorted_matching_versions else None
+
+
+class BenchmarkBrowser(Browser):
+    def __init__(self, version):
+        super(BenchmarkBrowser, self).__init__(None)
+        self.version = version
+
+    @property
+    def product_version(self):
+        return self.version
+
+
+class BenchmarkAppliance(object):
+    def __init__(self, version):
+        self.version = version
+
+
+class BenchmarkEntity(object):
+    def __init__(self, appliance):
+        self.appliance = appliance
+
+
+def picker_class(base, picker, attributes):
+    """Class with ``attributes`` picker attributes named pick0, pick1, ..."""
+    return type('Benchmark{}'.format(base.__name__), (base,), {
+        'pick{}'.format(i): picker(dict(VERSION_DICT)) for i in range(attributes)})
+
+
+def time_reads(obj, attributes, rounds):
+    names = ['pick{}'.format(i) for i in range(attributes)]
+    starttime = time()
+    for _ in range(rounds):
+        for name in names:
+            getattr(obj, name)
+    return time() - starttime
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--attributes', type=int, default=50,
+                        help='Number of picker attributes of every class')
+    parser.add_argument('--rounds', type=int, default=2000,
+                        help='How many times all the attributes are read')
+    parser.add_argument('--version', default='5.9.2.4', help='Appliance version to pick for')
+    args = parser.parse_args()
+
+    version = Version(args.version)
+    reads = args.attributes * args.rounds
+    for picker in (FormerVersionPicker, VersionPicker):
+        objects = [
+            ('view', picker_class(View, picker, args.attributes)(BenchmarkBrowser(version))),
+            ('entity', picker_class(BenchmarkEntity, picker, args.attributes)(
+                BenchmarkAppliance(version)))]
+        for kind, obj in objects:
+            timediff = time_reads(obj, args.attributes, args.rounds)
+            print('{} {}: {} picks in {:.3f}s ({:.2f}us per pick)'.format(
+                picker.__name__, kind, reads, timediff, timediff / reads * 1000000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,7 +10,7 @@ from django_object_actions import DjangoObjectActions
 # Register your models here.
 from appliances.models import (
     Provider, Template, Appliance, Group, AppliancePool, DelayedProvisionTask,
-    MismatchVersionMailer, UserApplianceQuota, User, BugQuery, GroupShepherd)
+    MismatchVersionMailer, UserApplianceQuota, User, BugQuery, GroupShepherd, PoolDemand)
 from appliances import tasks
 from sprout.log import create_logger
 
@@ -54,6 +54,12 @@ class GroupShepherdAdmin(Admin):
     pass
 
 
+@register_for(PoolDemand)
+class PoolDemandAdmin(Admin):
+    list_display = [
+        "requested_on", "group", "owner", "count", "preconfigured", "version", "provider_type"]
+
+
 @register_for(Appliance)
 class ApplianceAdmin(Admin):
     objectactions = ["power_off", "power_on", "suspend", "kill"]
@@ -172,6 +178,9 @@ class ProviderAdmin(Admin):
         "id", "working", "num_simultaneous_provisioning", "remaining_provisioning_slots",
         "provisioning_load", "show_ip_address", "appliance_load"]
 
+    def get_queryset(self, request):
+        return Provider.with_load(super(ProviderAdmin, self).get_queryset(request))
+
     def remaining_provisioning_slots(self, instance):
         return str(instance.remaining_provisioning_slots)
 
@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import inspect
 import json
 import re
 from celery import chain
 from celery.result import AsyncResult
 from datetime import datetime
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import transaction
 from django.http import HttpResponse
@@ -12,12 +14,20 @@ from django.shortcuts import render
 from ipware.ip import get_ip
 
 from appliances.models import (
-    Appliance, AppliancePool, Provider, Group, Template, User, GroupShepherd)
+    Appliance, AppliancePool, Provider, Group, Template, User, GroupShepherd, TemplateIndex,
+    APPLIANCES_STATE)
 from appliances.tasks import (
     appliance_power_on, appliance_power_off, appliance_suspend, appliance_rename,
     connect_direct_lun, disconnect_direct_lun, mark_appliance_ready, wait_appliance_ready)
+from sprout import redis
 from sprout.log import create_logger
 
+#: Longest time in seconds request_check waits for a change. The gunicorn workers are sync
+#: (see sprout.sh) and a waiting check holds one, so the clients repeat the short waits.
+REQUEST_CHECK_MAX_WAIT = 2
+#: How long in seconds a result is cached for, the state changes usually invalidate it sooner
+API_CACHE_TIMEOUT = 300
+
 
 def json_response(data):
     return HttpResponse(json.dumps(data), content_type="application/json")
@@ -170,23 +180,50 @@ def has_template(template_name, preconfigured):
     return query.count() > 0
 
 
+def cached_result(key, state_name, compute):
+    """Returns ``compute()`` cached until the named state changes, its etag and the state version.
+
+    See :py:meth:`sprout.RedisWrapper.state_version` for the states.
+    """
+    # Read before computing, a change made meanwhile then only makes the next call recompute
+    state_version = redis.state_version(state_name)
+    etag = hashlib.sha1("{}/{}".format(key, state_version)).hexdigest()
+    cache_key = "sprout-api-{}".format(etag)
+    result = cache.get(cache_key)
+    if result is None:
+        result = compute()
+        cache.set(cache_key, result, API_CACHE_TIMEOUT)
+    return result, etag, state_version
+
+
 @jsonapi.method
-def list_appliances(used=False):
+def list_appliances(used=False, offset=0, limit=None, fields=None, etag=None):
     """Returns list of appliances.
 
     Args:
         used: Whether to report used or unused appliances
+        offset: Skip this many appliances (ordered by id)
+        limit: Return at most this many appliances
+        fields: Return only these fields of the appliances
+        etag: The etag of the previous result, makes the result a dictionary with ``etag``,
+            ``modified`` and ``appliances`` (``None`` when not modified)
     """
-    query = Appliance.objects
+    query = Appliance.objects.order_by('id')
     if used:
         query = query.exclude(appliance_pool__owner=None)
     else:
         query = query.filter(appliance_pool__owner=None)
-    result = []
-    for appliance in query:
-        result.append(appliance.serialized)
-
-    return result
+    if limit is None:
+        query = query[offset:]
+    else:
+        query = query[offset:offset + limit]
+    result, new_etag, _ = cached_result(
+        'list_appliances/{!r}/{!r}/{!r}/{!r}'.format(bool(used), offset, limit, fields),
+        APPLIANCES_STATE, lambda: Appliance.serialize_many(query, fields))
+    if etag is None:
+        return result
+    modified = etag != new_etag
+    return {"etag": new_etag, "modified": modified, "appliances": result if modified else None}
 
 
 @jsonapi.authenticated_method
@@ -195,27 +232,19 @@ def num_shepherd_appliances(user, group, version=None, date=None, provider=None)
     group = Group.objects.get(id=group)
     if provider is not None:
         provider = Provider.objects.get(id=provider)
+    index = TemplateIndex.get()
+    index_filters = {"group": group.id}
+    if provider is not None:
+        index_filters["provider"] = provider.id
     if version is None:
-        if provider is None:
-            try:
-                version = Template.get_versions(template_group=group)[0]
-            except IndexError:
-                # No version
-                pass
-        else:
-            try:
-                version = Template.get_versions(template_group=group, provider=provider)[0]
-            except IndexError:
-                # No version
-                pass
+        try:
+            version = index.versions(**index_filters)[0]
+        except IndexError:
+            # No version
+            pass
     if date is None:
-        filter_kwargs = {"template_group": group}
-        if provider is not None:
-            filter_kwargs["provider"] = provider
-        if version is not None:
-            filter_kwargs["version"] = version
         try:
-            date = Template.get_dates(**filter_kwargs)[0]
+            date = index.dates(version=version, **index_filters)[0]
         except IndexError:
             # No date
             pass
@@ -243,23 +272,34 @@ def request_appliances(
 
 
 @jsonapi.authenticated_method
-def request_check(user, request_id):
-    """Return status of the appliance pool"""
+def request_check(
+        user, request_id, state_version=None, timeout=REQUEST_CHECK_MAX_WAIT, fields=None):
+    """Return status of the appliance pool
+
+    Pass the ``state_version`` from the previous result to wait (``timeout`` seconds at most)
+    until the pool changes instead of polling. ``fields`` limits the fields of the appliances.
+    """
     request = AppliancePool.objects.get(id=request_id)
     if user != request.owner and not user.is_staff:
         raise Exception("This pool belongs to a different user!")
-    return {
-        "fulfilled": request.fulfilled,
-        "finished": request.finished,
-        "preconfigured": request.preconfigured,
-        "yum_update": request.yum_update,
-        "progress": int(round(request.percent_finished * 100)),
-        "appliances": [
-            appliance.serialized
-            for appliance
-            in request.appliances
-        ],
-    }
+    state_name = AppliancePool.state_name(request.id)
+    if state_version is not None:
+        redis.wait_state_change(state_name, state_version, min(timeout, REQUEST_CHECK_MAX_WAIT))
+
+    def check():
+        pool = AppliancePool.objects.get(id=request_id)
+        return {
+            "fulfilled": pool.fulfilled,
+            "finished": pool.finished,
+            "preconfigured": pool.preconfigured,
+            "yum_update": pool.yum_update,
+            "progress": int(round(pool.percent_finished * 100)),
+            "appliances": Appliance.serialize_many(pool.appliances, fields),
+        }
+
+    result, _, state_version = cached_result(
+        'request_check/{}/{!r}'.format(request.id, fields), state_name, check)
+    return dict(result, state_version=state_version)
 
 
 @jsonapi.authenticated_method
@@ -327,7 +367,7 @@ def set_number_free_appliances(user, group, n):
 @jsonapi.method
 def available_cfme_versions(preconfigured=True):
     """Lists all versions that are available"""
-    return Template.get_versions(preconfigured=preconfigured)
+    return TemplateIndex.get().versions(preconfigured=preconfigured)
 
 
 @jsonapi.method
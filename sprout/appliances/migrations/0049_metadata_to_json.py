@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+import yaml
+from django.db import migrations, models
+
+METADATA_MODELS = [
+    'DelayedProvisionTask', 'Provider', 'Group', 'GroupShepherd', 'Template', 'Appliance',
+    'AppliancePool']
+
+
+def metadata_yaml_to_json(apps, schema_editor):
+    # Need to replicate the functionality from the model here
+    for model_name in METADATA_MODELS:
+        model = apps.get_model("appliances", model_name)
+        for o in model.objects.using(schema_editor.connection.alias).all():
+            # The same canonical JSON as appliances.models.dump_metadata writes
+            o.object_meta_data = json.dumps(
+                yaml.load(o.object_meta_data) or {}, sort_keys=True, separators=(',', ':'))
+            o.save(update_fields=['object_meta_data'])
+
+
+def metadata_json_to_yaml(apps, schema_editor):
+    for model_name in METADATA_MODELS:
+        model = apps.get_model("appliances", model_name)
+        for o in model.objects.using(schema_editor.connection.alias).all():
+            o.object_meta_data = yaml.dump(yaml.load(o.object_meta_data))
+            o.save(update_fields=['object_meta_data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appliances', '0048_openshift_project_made_bigger'),
+    ]
+
+    operations = [
+        migrations.RunPython(metadata_yaml_to_json, metadata_json_to_yaml),
+    ] + [
+        migrations.AlterField(
+            model_name=model_name.lower(),
+            name='object_meta_data',
+            field=models.TextField(default='{}'),
+        )
+        for model_name in METADATA_MODELS
+    ]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('appliances', '0049_metadata_to_json'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PoolDemand',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False,
+                                        verbose_name='ID')),
+                ('preconfigured', models.BooleanField(default=True)),
+                ('version', models.CharField(blank=True, max_length=32, null=True)),
+                ('provider_type', models.CharField(blank=True, max_length=32, null=True)),
+                ('count', models.IntegerField()),
+                ('requested_on', models.DateTimeField(db_index=True,
+                                                      default=django.utils.timezone.now)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                            to='appliances.Group')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                            to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-requested_on'],
+            },
+        ),
+        migrations.AddField(
+            model_name='groupshepherd',
+            name='predictive',
+            field=models.BooleanField(
+                default=False,
+                help_text='Size the pools from the recent demand, the pool sizes are then the '
+                          'maximums.'),
+        ),
+        migrations.AddField(
+            model_name='groupshepherd',
+            name='min_pool_size',
+            field=models.IntegerField(
+                default=0,
+                help_text='How many appliances to keep spinned at least when the demand is '
+                          'predicted.'),
+        ),
+    ]
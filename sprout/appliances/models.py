@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 import base64
+import json
+import math
 import re
 import yaml
 import six
@@ -15,20 +17,23 @@ from wrapanapi.exceptions import VMInstanceNotFound
 
 from cached_property import cached_property
 from celery import chain
+from collections import namedtuple
 from contextlib import contextmanager
+from copy import deepcopy
 from datetime import timedelta, date
 from django.contrib.auth.models import User, Group as DjangoGroup
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models, transaction
 from django.db.models import Q
-from django.db.models.signals import pre_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
 from json_field import JSONField
 
 from cached_property import threaded_cached_property
 
-from sprout import critical_section, redis
+from sprout import critical_section, redis, settings
 from sprout.log import create_logger
 
 from cfme.utils.appliance import Appliance as CFMEAppliance, IPAppliance
@@ -63,10 +68,30 @@ def apply_if_not_none(o, meth, *args, **kwargs):
     return getattr(o, meth)(*args, **kwargs)
 
 
+def dump_metadata(value):
+    """Canonical JSON representation of the metadata, see :py:class:`MetadataMixin`."""
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def load_metadata(raw):
+    try:
+        return json.loads(raw)
+    except ValueError:
+        # Stored before the metadata were migrated to JSON
+        return yaml.load(raw)
+
+
 class MetadataMixin(models.Model):
+    """Adds a free-form dictionary of metadata to the model.
+
+    The metadata are stored as canonical JSON (:py:func:`dump_metadata`) and parsed once per
+    instance and stored value. :py:attr:`metadata` returns a copy of the parsed dictionary, use
+    :py:attr:`edit_metadata` or the setter to change the metadata. :py:meth:`filter_metadata`
+    looks the objects up by their metadata in the query.
+    """
     class Meta:
         abstract = True
-    object_meta_data = models.TextField(default=yaml.dump({}))
+    object_meta_data = models.TextField(default=dump_metadata({}))
     created_on = models.DateTimeField(default=timezone.now, editable=False)
     modified_on = models.DateTimeField(default=timezone.now)
 
@@ -85,6 +110,29 @@ class MetadataMixin(models.Model):
         new_self = type(self).objects.get(pk=self.pk)
         self.__dict__.update(new_self.__dict__)
 
+    @classmethod
+    def update_changed(cls, changes, chunk_size=500, **fields):
+        """Writes only the changed fields of the changed rows.
+
+        Rows with the same changes are updated together in a single query.
+
+        Args:
+            changes: Dictionary of pk -> dictionary of changed field names and their new values.
+            chunk_size: Maximum number of rows updated by a single query.
+            **fields: Fields to set on all the changed rows, eg. ``modified_on``.
+        Returns:
+            Number of the updated rows.
+        """
+        grouped = {}
+        for pk, changed in changes.items():
+            grouped.setdefault(tuple(sorted(changed.items())), []).append(pk)
+        updated = 0
+        for changed, pks in grouped.items():
+            values = dict(fields, **dict(changed))
+            for i in range(0, len(pks), chunk_size):
+                updated += cls.objects.filter(pk__in=pks[i:i + chunk_size]).update(**values)
+        return updated
+
     @property
     @contextmanager
     def metadata_lock(self):
@@ -93,13 +141,49 @@ class MetadataMixin(models.Model):
 
     @property
     def metadata(self):
-        return yaml.load(self.object_meta_data)
+        raw = self.object_meta_data
+        cached = self.__dict__.get('_metadata_cache')
+        if cached is None or cached[0] != raw:
+            cached = self._metadata_cache = (raw, load_metadata(raw))
+        return deepcopy(cached[1])
 
     @metadata.setter
     def metadata(self, value):
         if not isinstance(value, dict):
             raise TypeError("You can store only dict in metadata!")
-        self.object_meta_data = yaml.dump(value)
+        self.object_meta_data = dump_metadata(value)
+
+    @classmethod
+    def metadata_q(cls, *keys, **metadata):
+        """Q object pre-filtering the objects whose metadata contain the ``keys`` and the passed
+        keys with their values.
+
+        The canonical JSON of the metadata is matched as text, so a key nested deeper in the
+        metadata can match too, :py:meth:`filter_metadata` checks the found objects.
+        """
+        q = Q()
+        for key in keys:
+            q &= Q(object_meta_data__contains='{}:'.format(dump_metadata(key)))
+        for key, value in metadata.items():
+            q &= Q(object_meta_data__contains='{}:{}'.format(
+                dump_metadata(key), dump_metadata(value)))
+        return q
+
+    @classmethod
+    def filter_metadata(cls, *keys, **metadata):
+        """Returns a list of the objects whose metadata contain the ``keys`` and the passed keys
+        with their values. Pass ``queryset`` to look up only among its objects."""
+        queryset = metadata.pop('queryset', None)
+        if queryset is None:
+            queryset = cls.objects.all()
+        found = []
+        for o in queryset.filter(cls.metadata_q(*keys, **metadata)):
+            o_metadata = o.metadata
+            if all(key in o_metadata for key in keys) and all(
+                    key in o_metadata and o_metadata[key] == value
+                    for key, value in metadata.items()):
+                found.append(o)
+        return found
 
     @property
     @contextmanager
@@ -202,15 +286,53 @@ class Provider(MetadataMixin):
         else:
             return get_mgmt(self.id)
 
+    @classmethod
+    def with_load(cls, queryset=None):
+        """Annotates the providers with the counts that the load and slot properties use.
+
+        The counts of all the providers come from a single aggregate query, so ``free``, ``load``
+        and friends of the returned providers do not query the database again. The counts are a
+        snapshot, use :py:meth:`account_new_appliance` to keep them up to date when provisioning
+        using the snapshot.
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+        appliance = 'provider_templates__appliance__id'
+        provisioning = models.When(
+            provider_templates__appliance__ready=False,
+            provider_templates__appliance__marked_for_deletion=False,
+            provider_templates__appliance__ip_address=None,
+            then=appliance)
+        preparing = models.When(provider_templates__ready=False, then='provider_templates__id')
+        return queryset.annotate(
+            snapshot_currently_managing=models.Count(appliance, distinct=True),
+            snapshot_currently_provisioning=models.Count(models.Case(provisioning), distinct=True),
+            snapshot_templates_preparing=models.Count(models.Case(preparing), distinct=True))
+
+    @classmethod
+    def load_snapshot(cls, queryset=None):
+        """Returns a dictionary of provider id -> provider annotated by :py:meth:`with_load`."""
+        return {provider.id: provider for provider in cls.with_load(queryset)}
+
+    def account_new_appliance(self):
+        """Counts an appliance just created on this provider into the load snapshot."""
+        if hasattr(self, 'snapshot_currently_managing'):
+            self.snapshot_currently_managing += 1
+            self.snapshot_currently_provisioning += 1
+
     @property
     def num_currently_provisioning(self):
-        return len(
-            Appliance.objects.filter(
-                ready=False, marked_for_deletion=False, template__provider=self, ip_address=None))
+        if hasattr(self, 'snapshot_currently_provisioning'):
+            return self.snapshot_currently_provisioning
+        return Appliance.objects.filter(
+            ready=False, marked_for_deletion=False, template__provider=self,
+            ip_address=None).count()
 
     @property
     def num_templates_preparing(self):
-        return len(Template.objects.filter(provider=self, ready=False))
+        if hasattr(self, 'snapshot_templates_preparing'):
+            return self.snapshot_templates_preparing
+        return Template.objects.filter(provider=self, ready=False).count()
 
     @property
     def remaining_configuring_slots(self):
@@ -230,7 +352,9 @@ class Provider(MetadataMixin):
 
     @property
     def num_currently_managing(self):
-        return len(Appliance.objects.filter(template__provider=self))
+        if hasattr(self, 'snapshot_currently_managing'):
+            return self.snapshot_currently_managing
+        return Appliance.objects.filter(template__provider=self).count()
 
     @property
     def currently_managed_appliances(self):
@@ -343,20 +467,21 @@ class Provider(MetadataMixin):
             except ObjectDoesNotExist:
                 continue
 
+    @staticmethod
+    def _usage_by_owner(appliances):
+        """Counts the appliances per owner with one aggregate query, the biggest user first."""
+        counts = appliances.filter(appliance_pool__owner__isnull=False)\
+            .order_by().values_list('appliance_pool__owner')\
+            .annotate(count=models.Count('id'))
+        counts = dict(counts)
+        users = User.objects.in_bulk(counts.keys())
+        usage = [(users[user_id], count) for user_id, count in counts.items()]
+        usage.sort(key=lambda item: item[1], reverse=True)
+        return usage
+
     @property
     def user_usage(self):
-        per_user_usage = {}
-        for appliance in Appliance.objects.filter(template__provider=self):
-            if appliance.owner is None:
-                continue
-            owner = appliance.owner
-            if owner not in per_user_usage:
-                per_user_usage[owner] = 1
-            else:
-                per_user_usage[owner] += 1
-        per_user_usage = per_user_usage.items()
-        per_user_usage.sort(key=lambda item: item[1], reverse=True)
-        return per_user_usage
+        return self._usage_by_owner(Appliance.objects.filter(template__provider=self))
 
     @property
     def free_shepherd_appliances(self):
@@ -365,19 +490,12 @@ class Provider(MetadataMixin):
 
     @classmethod
     def complete_user_usage(cls, user_perspective=None):
-        result = {}
         if user_perspective is None or user_perspective.is_superuser or user_perspective.is_staff:
             perspective_filter = {}
         else:
             perspective_filter = {'user_groups__in': user_perspective.groups.all()}
-        for provider in cls.objects.filter(hidden=False, **perspective_filter):
-            for user, count in provider.user_usage:
-                if user not in result:
-                    result[user] = 0
-                result[user] += count
-        result = result.items()
-        result.sort(key=lambda item: item[1], reverse=True)
-        return result
+        providers = cls.objects.filter(hidden=False, **perspective_filter)
+        return cls._usage_by_owner(Appliance.objects.filter(template__provider__in=providers))
 
     def cleanup(self):
         """Put any cleanup tasks that might help the application stability here"""
@@ -492,6 +610,44 @@ class Group(MetadataMixin):
             type(self).__name__, self.id)
 
 
+def predicted_demand(requests, now, lookahead, history_days):
+    """Predicts the demand in the ``lookahead`` window starting at ``now``.
+
+    The prediction is the bigger one of the demand in the last window and the average demand
+    in the same window of the previous ``history_days`` days of the same kind (workdays or
+    weekends).
+
+    Args:
+        requests: Iterable of ``(requested_on, count)`` of the requests before ``now``.
+        now: Start of the predicted window.
+        lookahead: :py:class:`datetime.timedelta` length of the window.
+        history_days: How many days back the requests go.
+    """
+    recent = 0
+    per_day = {}
+    for requested_on, count in requests:
+        if requested_on >= now - lookahead:
+            recent += count
+        # Which day before falls into its window, if any (whole days rounded up)
+        days_before = -(requested_on - now).days
+        window_start = now - timedelta(days=days_before)
+        if window_start <= requested_on < window_start + lookahead:
+            per_day[days_before] = per_day.get(days_before, 0) + count
+
+    def is_weekend(t):
+        return t.weekday() >= 5
+
+    same_kind_days = [
+        day for day in range(1, history_days)
+        if is_weekend(now - timedelta(days=day)) == is_weekend(now)]
+    if same_kind_days:
+        seasonal = float(sum(per_day.get(day, 0) for day in same_kind_days))
+        seasonal /= len(same_kind_days)
+    else:
+        seasonal = 0.0
+    return max(recent, seasonal)
+
+
 class GroupShepherd(MetadataMixin):
     template_group = models.ForeignKey(Group, on_delete=models.CASCADE)
     user_group = models.ForeignKey(DjangoGroup, on_delete=models.CASCADE)
@@ -499,6 +655,10 @@ class GroupShepherd(MetadataMixin):
         help_text="How many appliances to keep spinned for quick taking.")
     unconfigured_template_pool_size = models.IntegerField(default=0,
         help_text="How many appliances to keep spinned for quick taking - unconfigured ones.")
+    predictive = models.BooleanField(default=False,
+        help_text="Size the pools from the recent demand, the pool sizes are then the maximums.")
+    min_pool_size = models.IntegerField(default=0,
+        help_text="How many appliances to keep spinned at least when the demand is predicted.")
 
     class Meta:
         ordering = ['template_group', 'user_group', 'id']
@@ -521,12 +681,53 @@ class GroupShepherd(MetadataMixin):
             self.appliances.filter(
                 template__preconfigured=preconfigured, appliance_pool=None,
                 marked_for_deletion=False))
-        wanted_pool_size = (
-            self.template_pool_size if preconfigured else self.unconfigured_template_pool_size)
+        wanted_pool_size = self.wanted_pool_size(preconfigured)
         if wanted_pool_size == 0:
             return 100
         return int(round((float(appliances_in_shepherd) / float(wanted_pool_size)) * 100.0))
 
+    def predict_demand(self, preconfigured, version=None, provider_types=None, now=None):
+        """Predicts how many appliances the pools will request in the next lookahead window.
+
+        See :py:func:`predicted_demand`, following both the bursts starting now and the
+        recurring ones like nightly runs.
+
+        Args:
+            preconfigured: Whether to predict the configured or unconfigured appliances.
+            version: Count only the requests for this version (or for the latest one).
+            provider_types: Count only the requests for these provider types (or for any).
+            now: Time to predict the demand for, the current time by default.
+        """
+        now = now or timezone.now()
+        lookahead = timedelta(**settings.SHEPHERD_DEMAND_LOOKAHEAD)
+        history_days = settings.SHEPHERD_DEMAND_HISTORY_DAYS
+        demand = PoolDemand.objects.filter(
+            group=self.template_group, owner__groups=self.user_group, preconfigured=preconfigured,
+            requested_on__gte=now - timedelta(days=history_days), requested_on__lt=now)
+        if version is not None:
+            demand = demand.filter(Q(version=None) | Q(version=version))
+        if provider_types is not None:
+            demand = demand.filter(Q(provider_type=None) | Q(provider_type__in=provider_types))
+        return predicted_demand(
+            demand.values_list('requested_on', 'count'), now, lookahead, history_days)
+
+    def wanted_pool_size(self, preconfigured, **demand_filters):
+        """How many appliances to keep in the shepherd.
+
+        The configured pool size unless the pool sizes are :py:attr:`predictive`, then the
+        predicted demand (see :py:meth:`predict_demand`) with some headroom, limited by the
+        configured pool size and :py:attr:`min_pool_size`.
+        """
+        if preconfigured:
+            pool_size = self.template_pool_size
+        else:
+            pool_size = self.unconfigured_template_pool_size
+        if not self.predictive:
+            return pool_size
+        demand = self.predict_demand(preconfigured, **demand_filters)
+        predicted = int(math.ceil(demand * settings.SHEPHERD_DEMAND_HEADROOM))
+        return min(pool_size, max(self.min_pool_size, predicted))
+
     def shepherd_appliances(self, preconfigured=True):
         return self.appliances.filter(
             appliance_pool=None, ready=True, marked_for_deletion=False,
@@ -546,6 +747,31 @@ class GroupShepherd(MetadataMixin):
             self.template_pool_size, self.unconfigured_template_pool_size)
 
 
+class PoolDemand(models.Model):
+    """Appliances requested by a pool, kept after the pool is gone for predicting the demand."""
+    group = models.ForeignKey(Group, on_delete=models.CASCADE)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    preconfigured = models.BooleanField(default=True)
+    version = models.CharField(max_length=32, null=True, blank=True)
+    provider_type = models.CharField(max_length=32, null=True, blank=True)
+    count = models.IntegerField()
+    requested_on = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        ordering = ['-requested_on']
+
+    @classmethod
+    def cleanup(cls):
+        """Forgets the requests older than the demand prediction looks."""
+        cls.objects.filter(
+            requested_on__lt=timezone.now() - timedelta(
+                days=settings.SHEPHERD_DEMAND_HISTORY_DAYS)).delete()
+
+    def __unicode__(self):
+        return "{} {}x {}/{} {}".format(
+            type(self).__name__, self.count, self.group.id, self.version, self.requested_on)
+
+
 class Template(MetadataMixin):
     VM = 'virtual_machine'
     DOCKER_VM = 'docker_vm'
@@ -727,6 +953,124 @@ class Template(MetadataMixin):
             type(self).__name__, self.version, self.name, self.provider.id)
 
 
+TemplateIndexRow = namedtuple(
+    'TemplateIndexRow',
+    ['group', 'version', 'date', 'provider', 'preconfigured', 'template_type', 'ready', 'usable',
+     'exists', 'ga_released'])
+IndexedProvider = namedtuple(
+    'IndexedProvider', ['working', 'disabled', 'provider_type', 'user_groups'])
+
+
+class TemplateIndex(object):
+    """Index of the groups, versions, dates and providers of all the templates.
+
+    Built with two queries and cached until a template or a provider changes, so the pickers of
+    the views and the API do not query and sort the templates on every request. Use
+    :py:meth:`get` to get the current one.
+    """
+    CACHE_TIMEOUT = 3600
+    _current = (None, None)
+
+    def __init__(self, rows, providers):
+        self.rows = rows
+        self.providers = providers
+
+    @classmethod
+    def build(cls):
+        rows = [
+            TemplateIndexRow(*values) for values in Template.objects.order_by().values_list(
+                'template_group', 'version', 'date', 'provider', 'preconfigured', 'template_type',
+                'ready', 'usable', 'exists', 'ga_released')]
+        providers = {
+            provider_id: IndexedProvider(working, disabled, provider_type, set())
+            for provider_id, working, disabled, provider_type in Provider.objects.values_list(
+                'id', 'working', 'disabled', 'provider_type')}
+        for provider_id, user_group in Provider.user_groups.through.objects.values_list(
+                'provider', 'group'):
+            providers[provider_id].user_groups.add(user_group)
+        return cls(rows, providers)
+
+    @classmethod
+    def get(cls):
+        """Returns the current index, built again only after the templates change."""
+        state_version = redis.state_version(TEMPLATES_STATE)
+        current_version, index = cls._current
+        if current_version == state_version:
+            return index
+        cache_key = "sprout-template-index-{}".format(state_version)
+        index = cache.get(cache_key)
+        if index is None:
+            index = cls.build()
+            cache.set(cache_key, index, cls.CACHE_TIMEOUT)
+        cls._current = (state_version, index)
+        return index
+
+    def filter(self, group=None, version=None, date=None, provider=None, preconfigured=None,
+               template_type=None, provider_type=None, user_groups=None, exists=None,
+               available=False):
+        """Returns the rows of the templates matching the filters, ``None`` matches anything.
+
+        Args:
+            group: Template group id.
+            user_groups: Ids of user groups, one of them has to be able to use the provider.
+            available: Only the ready, usable and existing templates on working providers.
+        """
+        if user_groups is not None:
+            user_groups = set(user_groups)
+        for row in self.rows:
+            if group is not None and row.group != group:
+                continue
+            if version is not None and row.version != version:
+                continue
+            if date is not None and row.date != date:
+                continue
+            if provider is not None and row.provider != provider:
+                continue
+            if preconfigured is not None and row.preconfigured != preconfigured:
+                continue
+            if template_type is not None and row.template_type != template_type:
+                continue
+            if exists is not None and row.exists != exists:
+                continue
+            indexed_provider = self.providers.get(row.provider)
+            if indexed_provider is None:
+                # Deleted while the index was being built
+                continue
+            if provider_type is not None and indexed_provider.provider_type != provider_type:
+                continue
+            if user_groups is not None and not (indexed_provider.user_groups & user_groups):
+                continue
+            if available and not (
+                    row.ready and row.usable and row.exists and indexed_provider.working and
+                    not indexed_provider.disabled):
+                continue
+            yield row
+
+    def versions(self, **filters):
+        """Versions of the matching templates, the latest first. See :py:meth:`filter`."""
+        versions = {row.version for row in self.filter(**filters) if row.version is not None}
+        return sorted(versions, key=Version, reverse=True)
+
+    def dates(self, **filters):
+        """Dates of the matching templates, the latest first. See :py:meth:`filter`."""
+        return sorted({row.date for row in self.filter(**filters)}, reverse=True)
+
+    def provider_ids(self, **filters):
+        """Sorted ids of the providers of the matching templates. See :py:meth:`filter`."""
+        return sorted({row.provider for row in self.filter(**filters)})
+
+    def ga_version(self, version):
+        return any(row.ga_released for row in self.filter(version=version))
+
+    def latest_dates(self):
+        """Dictionary of group id -> date of the latest template in the group."""
+        latest = {}
+        for row in self.rows:
+            if row.group not in latest or row.date > latest[row.group]:
+                latest[row.group] = row.date
+        return latest
+
+
 class Appliance(MetadataMixin):
     class Meta:
         permissions = (('can_modify_hw', 'Can modify HW configuration'), )
@@ -904,15 +1248,37 @@ class Appliance(MetadataMixin):
                 appliance.ram = params['ram']
                 appliance.save()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        appliance = super(Appliance, cls).from_db(db, field_names, values)
+        # Remember the pool, so it can be notified when the appliance leaves it
+        appliance._loaded_appliance_pool_id = appliance.__dict__.get('appliance_pool_id')
+        return appliance
+
+    @classmethod
+    def serialize_many(cls, appliances, fields=None):
+        """Serializes the appliances, see :py:attr:`serialized`.
+
+        The templates are fetched together with the appliances, so there is no query per
+        appliance.
+
+        Args:
+            appliances: Queryset of the appliances.
+            fields: Serialize only these fields, all of them when not specified.
+        """
+        result = []
+        for appliance in appliances.select_related('template'):
+            serialized = appliance.serialized
+            if fields is not None:
+                serialized = {field: serialized[field] for field in fields}
+            result.append(serialized)
+        return result
+
     @property
     def serialized(self):
-        try:
-            pool_id = self.appliance_pool.id
-        except AttributeError:
-            pool_id = None
         return dict(
             id=self.id,
-            pool_id=pool_id,
+            pool_id=self.appliance_pool_id,
             ready=self.ready,
             name=self.name,
             ip_address=self.ip_address,
@@ -923,13 +1289,13 @@ class Appliance(MetadataMixin):
             datetime_leased=apply_if_not_none(self.datetime_leased, "isoformat"),
             leased_until=apply_if_not_none(self.leased_until, "isoformat"),
             template_name=self.template.original_name,
-            template_id=self.template.id,
-            provider=self.template.provider.id,
+            template_id=self.template_id,
+            provider=self.template.provider_id,
             marked_for_deletion=self.marked_for_deletion,
             uuid=self.uuid,
             template_version=self.template.version,
             template_build_date=self.template.date.isoformat(),
-            template_group=self.template.template_group.id,
+            template_group=self.template.template_group_id,
             template_sprout_name=self.template.name,
             preconfigured=self.preconfigured,
             lun_disk_connected=self.lun_disk_connected,
@@ -1038,11 +1404,11 @@ class Appliance(MetadataMixin):
                 appliance.save()
                 self.logger.info("Status changed: {}".format(status))
 
-    def set_power_state(self, power_state):
+    def set_power_state(self, power_state, changed_on=None):
         if power_state != self.power_state:
             self.logger.info("Changed power state to {}".format(power_state))
             self.power_state = power_state
-            self.power_state_changed = timezone.now()
+            self.power_state_changed = changed_on or timezone.now()
             if power_state in self.RESET_SWAP_STATES:
                 # Reset some values
                 self.swap = 0
@@ -1062,7 +1428,7 @@ class Appliance(MetadataMixin):
         """
         from appliances.tasks import (
             appliance_power_on, mark_appliance_ready, wait_appliance_ready, appliance_yum_update,
-            appliance_reboot)
+            appliance_reboot, appliance_ready_next_step, free_appliance_shepherd)
         limit = custom_limit if custom_limit is not None else pool.total_count
         appliances = []
         if limit <= 0:
@@ -1090,6 +1456,7 @@ class Appliance(MetadataMixin):
                             tasks.append(wait_appliance_ready.si(appliance.id))
                         else:
                             tasks.append(mark_appliance_ready.si(appliance.id))
+                        tasks.append(appliance_ready_next_step.si(appliance.id))
                         chain(*tasks)()
                         appliances.append(appliance)
                         # We have the break twice, to be sure. For each for loop.
@@ -1097,6 +1464,9 @@ class Appliance(MetadataMixin):
                             break
                 if len(appliances) >= limit:
                     break
+            if appliances:
+                # Replenish the shepherd right away instead of waiting for the next run
+                transaction.on_commit(free_appliance_shepherd.delay)
         return len(appliances)
 
     @classmethod
@@ -1355,9 +1725,13 @@ class AppliancePool(MetadataMixin):
         if num_appliances == 0:
             req_params['finished'] = True
         req = cls(**req_params)
+        req.metadata = {"lease_time": time_leased}
         if not req.possible_templates:
             raise Exception("No possible templates! (pool params: {})".format(str(req_params)))
         req.save()
+        PoolDemand(
+            group=group, owner=owner, preconfigured=preconfigured, version=version,
+            provider_type=provider_type, count=num_appliances).save()
         cls.class_logger(req.pk).info("Created")
         if num_appliances > 0:
             # Only if we have any appliances to request
@@ -1409,10 +1783,24 @@ class AppliancePool(MetadataMixin):
 
     @property
     def possible_provisioning_templates(self):
+        return self.provisioning_templates()
+
+    def provisioning_templates(self, providers=None):
+        """Templates that can be provisioned from now, the best match first.
+
+        Args:
+            providers: Load snapshot from :py:meth:`Provider.load_snapshot`. Taken for the
+                providers of the possible templates when not specified.
+        """
+        templates = self.possible_templates
+        if providers is None:
+            providers = Provider.load_snapshot(
+                Provider.objects.filter(id__in={tpl.provider_id for tpl in templates}))
         return sorted(
-            filter(lambda tpl: tpl.provider.free, self.possible_templates),
+            filter(lambda tpl: providers[tpl.provider_id].free, templates),
             # Sort by date and load to pick the best match (least loaded provider)
-            key=lambda tpl: (tpl.date, 1.0 - tpl.provider.appliance_load), reverse=True)
+            key=lambda tpl: (tpl.date, 1.0 - providers[tpl.provider_id].appliance_load),
+            reverse=True)
 
     @property
     def possible_providers(self):
@@ -1469,6 +1857,17 @@ class AppliancePool(MetadataMixin):
     def broken_with_no_appliances(self):
         return (not self.finished) and self.age >= timedelta(days=1) and self.current_count == 0
 
+    @staticmethod
+    def state_name(pool_id):
+        """Name of the state version of the pool, see :py:meth:`sprout.RedisWrapper.state_version`.
+        """
+        return "pool-{}".format(pool_id)
+
+    @property
+    def lease_time(self):
+        """Lease time in minutes applied on the appliances when the pool gets fulfilled."""
+        return self.metadata.get("lease_time")
+
     @property
     def queued_provision_tasks(self):
         return DelayedProvisionTask.objects.filter(pool=self).order_by("id")
@@ -1558,9 +1957,9 @@ class AppliancePool(MetadataMixin):
     def num_possible_provisioning_slots(self):
         providers = set([])
         for template in self.possible_provisioning_templates:
-            providers.add(template.provider)
+            providers.add(template.provider_id)
         slots = 0
-        for provider in providers:
+        for provider in Provider.with_load(Provider.objects.filter(id__in=providers)):
             slots += provider.remaining_provisioning_slots
         return slots
 
@@ -1568,9 +1967,9 @@ class AppliancePool(MetadataMixin):
     def num_possible_appliance_slots(self):
         providers = set([])
         for template in self.possible_templates:
-            providers.add(template.provider)
+            providers.add(template.provider_id)
         slots = 0
-        for provider in providers:
+        for provider in Provider.with_load(Provider.objects.filter(id__in=providers)):
             slots += provider.remaining_appliance_slots
         return slots
 
@@ -1589,6 +1988,50 @@ class AppliancePool(MetadataMixin):
             self.id, self.group.id, self.total_count)
 
 
+#: Name of the state (see :py:meth:`sprout.RedisWrapper.state_version`) of all the appliances
+APPLIANCES_STATE = "appliances"
+#: Name of the state of all the templates and providers, see :py:class:`TemplateIndex`
+TEMPLATES_STATE = "templates"
+
+
+def notify_state_changed(name):
+    """Bumps the named state version once the current transaction commits."""
+    transaction.on_commit(lambda: redis.state_changed(name))
+
+
+def notify_pool_changed(pool_id):
+    """Wakes up the clients long-polling the pool once the current transaction commits."""
+    if pool_id is not None:
+        notify_state_changed(AppliancePool.state_name(pool_id))
+
+
+@receiver(post_save, sender=Appliance)
+@receiver(post_delete, sender=Appliance)
+def appliance_pool_changed(sender, instance, **kwargs):
+    notify_state_changed(APPLIANCES_STATE)
+    notify_pool_changed(instance.appliance_pool_id)
+    loaded_pool_id = getattr(instance, '_loaded_appliance_pool_id', None)
+    if loaded_pool_id != instance.appliance_pool_id:
+        # The appliance left the pool
+        notify_pool_changed(loaded_pool_id)
+    # The pool stored now, the instance may be saved again in another pool
+    instance._loaded_appliance_pool_id = instance.appliance_pool_id
+
+
+@receiver(post_save, sender=AppliancePool)
+def pool_changed(sender, instance, **kwargs):
+    notify_pool_changed(instance.id)
+
+
+@receiver(post_save, sender=Template)
+@receiver(post_delete, sender=Template)
+@receiver(post_save, sender=Provider)
+@receiver(post_delete, sender=Provider)
+@receiver(m2m_changed, sender=Provider.user_groups.through)
+def templates_changed(sender, **kwargs):
+    notify_state_changed(TEMPLATES_STATE)
+
+
 class MismatchVersionMailer(models.Model):
     provider = models.ForeignKey(Provider, on_delete=models.CASCADE)
     template_name = models.CharField(max_length=64)
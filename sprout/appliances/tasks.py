@@ -29,7 +29,8 @@ import socket
 
 from appliances.models import (
     Provider, Group, Template, Appliance, AppliancePool, DelayedProvisionTask,
-    MismatchVersionMailer, User, GroupShepherd)
+    MismatchVersionMailer, User, GroupShepherd, PoolDemand, APPLIANCES_STATE, TEMPLATES_STATE,
+    notify_pool_changed, notify_state_changed)
 from sprout import settings, redis
 from sprout.irc_bot import send_message
 from sprout.log import create_logger
@@ -202,6 +203,9 @@ def kill_appliance_delete(self, appliance_id, _delete_already_issued=False):
             self.retry(args=(appliance_id, True), countdown=5, max_retries=60)
         self.logger.info("Removing appliance from database {}".format(appliance_id))
         appliance.delete()
+        if DelayedProvisionTask.objects.exists():
+            # The provider has a free slot now
+            process_delayed_provision_tasks.delay()
     except ObjectDoesNotExist:
         self.logger.error("Can't kill appliance {}. it doesn't exist".format(appliance_id))
         # Appliance object already not there
@@ -465,7 +469,7 @@ def prepare_template_deploy(self, template_id):
         if template.vm_mgmt is None or not template.vm_mgmt.exists:
             template.set_status("Deploying the template.")
             provider_data = template.provider.provider_data
-            kwargs = provider_data["sprout"]
+            kwargs = dict(provider_data["sprout"])
             kwargs["power_on"] = True
             if "datastore" not in kwargs and "allowed_datastore" in provider_data:
                 kwargs["datastore"] = provider_data["allowed_datastore"]
@@ -703,11 +707,17 @@ def request_appliance_pool(self, appliance_pool_id, time_minutes):
 @singleton_task()
 def apply_lease_times_after_pool_fulfilled(self, appliance_pool_id, time_minutes):
     pool = AppliancePool.objects.get(id=appliance_pool_id)
+    if pool.finished:
+        # Already finished by appliance_ready_next_step
+        return
     if pool.fulfilled:
-        pool.logger.info("Applying lease time and renaming appliances")
-        for appliance in pool.appliances:
-            apply_lease_times.delay(appliance.id, time_minutes)
         with transaction.atomic():
+            pool = AppliancePool.objects.select_for_update().get(id=appliance_pool_id)
+            if pool.finished:
+                return
+            pool.logger.info("Applying lease time and renaming appliances")
+            for appliance in pool.appliances:
+                apply_lease_times.delay(appliance.id, time_minutes)
             pool.finished = True
             pool.save(update_fields=['finished'])
             pool.logger.info("Pool {} setup is finished".format(appliance_pool_id))
@@ -741,6 +751,8 @@ def process_delayed_provision_tasks(self):
     Goes one task by one and when some of them can be provisioned, it starts the provisioning and
     then deletes the task.
     """
+    # Load of all the providers, taken once for all the tasks
+    providers = Provider.load_snapshot()
     for task in DelayedProvisionTask.objects.order_by("id"):
         if task.pool.not_needed_anymore:
             task.delete()
@@ -749,7 +761,7 @@ def process_delayed_provision_tasks(self):
         appliances_given = Appliance.give_to_pool(task.pool, 1)
         if appliances_given == 0:
             # No free appliance in shepherd, so do it on our own
-            tpls = task.pool.possible_provisioning_templates
+            tpls = task.pool.provisioning_templates(providers)
             if task.provider_to_avoid is not None:
                 filtered_tpls = filter(lambda tpl: tpl.provider != task.provider_to_avoid, tpls)
                 if filtered_tpls:
@@ -759,6 +771,7 @@ def process_delayed_provision_tasks(self):
                 # This will cause additional rejects until the provider quota is met
             if tpls:
                 clone_template_to_pool(tpls[0].id, task.pool.id, task.lease_time)
+                providers[tpls[0].provider_id].account_new_appliance()
                 task.delete()
             else:
                 # Try freeing up some space in provider
@@ -777,6 +790,23 @@ def process_delayed_provision_tasks(self):
             task.delete()
 
 
+@logged_task()
+def appliance_ready_next_step(self, appliance_id):
+    """Ends the provisioning chains of appliances. Moves the pool fulfillment forward right away
+    instead of leaving it for the periodic tasks."""
+    try:
+        appliance = Appliance.objects.get(id=appliance_id)
+    except ObjectDoesNotExist:
+        return
+    pool = appliance.appliance_pool
+    if pool is None:
+        # A new appliance in shepherd can be given to the pools waiting for one
+        if DelayedProvisionTask.objects.exists():
+            process_delayed_provision_tasks.delay()
+    elif not pool.finished and pool.lease_time is not None and pool.fulfilled:
+        apply_lease_times_after_pool_fulfilled.delay(pool.id, pool.lease_time)
+
+
 @logged_task()
 def replace_clone_to_pool(
         self, version, date, appliance_pool_id, time_minutes, exclude_template_id):
@@ -855,6 +885,7 @@ def clone_template_to_appliance(self, appliance_id, lease_time_minutes=None, yum
         tasks.append(appliance_set_hostname.si(appliance_id))
     else:
         tasks.append(mark_appliance_ready.si(appliance_id))
+    tasks.append(appliance_ready_next_step.si(appliance_id))
     workflow = chain(*tasks)
     if Appliance.objects.get(id=appliance_id).appliance_pool is not None:
         # Case of the appliance pool
@@ -1261,10 +1292,18 @@ def refresh_appliances(self):
         refresh_appliances_provider.delay(provider.id)
 
 
+#: Appliance fields refresh_appliances_provider reads and may change
+REFRESH_FIELDS = (
+    'name', 'uuid', 'ip_address', 'power_state', 'power_state_changed', 'swap', 'ssh_failed')
+
+
 @singleton_task(soft_time_limit=180)
 def refresh_appliances_provider(self, provider_id):
     """Downloads the list of VMs from the provider, then matches them by name or UUID with
     appliances stored in database.
+
+    The VM state is compared with the appliances in memory and only the changed appliances are
+    written, all in one transaction.
     """
     self.logger.info("Refreshing appliances in {}".format(provider_id))
     provider = Provider.objects.get(id=provider_id, working=True, disabled=False)
@@ -1278,29 +1317,50 @@ def refresh_appliances_provider(self, provider_id):
         dict_vms[vm.name] = vm
         if vm.uuid:
             uuid_vms[vm.uuid] = vm
-    for appliance in Appliance.objects.filter(template__provider=provider):
-        if appliance.uuid is not None and appliance.uuid in uuid_vms:
-            vm = uuid_vms[appliance.uuid]
-            # Using the UUID and change the name if it changed
-            appliance.name = vm.name
-            appliance.ip_address = vm.ip
-            appliance.set_power_state(Appliance.POWER_STATES_MAPPING.get(
-                vm.state, Appliance.Power.UNKNOWN))
-            appliance.save()
-        elif appliance.name in dict_vms:
-            vm = dict_vms[appliance.name]
-            # Using the name, and then retrieve uuid
-            appliance.uuid = vm.uuid
-            appliance.ip_address = vm.ip
-            appliance.set_power_state(Appliance.POWER_STATES_MAPPING.get(
-                vm.state, Appliance.Power.UNKNOWN))
-            appliance.save()
-            self.logger.info("Retrieved UUID for appliance {}/{}: {}".format(
-                appliance.id, appliance.name, appliance.uuid))
-        else:
-            # Orphaned :(
-            appliance.set_power_state(Appliance.Power.ORPHANED)
-            appliance.save()
+    now = timezone.now()
+    examined = 0
+    changes = {}
+    with transaction.atomic():
+        appliances = Appliance.objects\
+            .filter(template__provider=provider)\
+            .only('appliance_pool', *REFRESH_FIELDS)\
+            .select_for_update()
+        for appliance in appliances:
+            examined += 1
+            before = {field: getattr(appliance, field) for field in REFRESH_FIELDS}
+            if appliance.uuid is not None and appliance.uuid in uuid_vms:
+                vm = uuid_vms[appliance.uuid]
+                # Using the UUID and change the name if it changed
+                appliance.name = vm.name
+                appliance.ip_address = vm.ip
+                appliance.set_power_state(Appliance.POWER_STATES_MAPPING.get(
+                    vm.state, Appliance.Power.UNKNOWN), now)
+            elif appliance.name in dict_vms:
+                vm = dict_vms[appliance.name]
+                # Using the name, and then retrieve uuid
+                appliance.uuid = vm.uuid
+                appliance.ip_address = vm.ip
+                appliance.set_power_state(Appliance.POWER_STATES_MAPPING.get(
+                    vm.state, Appliance.Power.UNKNOWN), now)
+                if appliance.uuid != before['uuid']:
+                    self.logger.info("Retrieved UUID for appliance {}/{}: {}".format(
+                        appliance.id, appliance.name, appliance.uuid))
+            else:
+                # Orphaned :(
+                appliance.set_power_state(Appliance.Power.ORPHANED, now)
+            changed = {
+                field: getattr(appliance, field) for field, value in before.items()
+                if getattr(appliance, field) != value}
+            if changed:
+                changes[appliance.id] = changed
+                # Bulk updates do not send the signals
+                notify_pool_changed(appliance.appliance_pool_id)
+        Appliance.update_changed(changes, modified_on=now)
+        if changes:
+            notify_state_changed(APPLIANCES_STATE)
+    self.logger.info("Refreshed appliances in {}: {} examined, {} changed".format(
+        provider_id, examined, len(changes)))
+    return {'examined': examined, 'changed': len(changes)}
 
 
 @singleton_task()
@@ -1336,19 +1396,22 @@ def check_templates_in_provider(self, provider_id):
         return
     # Check Sprout template existence
     # expiration_time = (timezone.now() - timedelta(**settings.BROKEN_APPLIANCE_GRACE_TIME))
-    for template in Template.objects.filter(provider=provider):
-        with transaction.atomic():
-            tpl = Template.objects.get(pk=template.pk)
-            exists = tpl.name in templates
-            tpl.exists = exists
-            tpl.save(update_fields=['exists'])
-        # if not exists:
-        #     if len(Appliance.objects.filter(template=template).all()) == 0\
-        #             and template.status_changed < expiration_time:
-        #         # No other appliance is made from this template so no need to keep it
-        #         with transaction.atomic():
-        #             tpl = Template.objects.get(pk=template.pk)
-        #             tpl.delete()
+    templates = set(templates)
+    examined = 0
+    changes = {}
+    with transaction.atomic():
+        for template_id, name, exists in Template.objects\
+                .filter(provider=provider)\
+                .select_for_update()\
+                .values_list('id', 'name', 'exists'):
+            examined += 1
+            if (name in templates) != exists:
+                changes[template_id] = {'exists': not exists}
+        Template.update_changed(changes)
+        if changes:
+            notify_state_changed(TEMPLATES_STATE)
+    self.logger.info("Checked templates in {}: {} examined, {} changed".format(
+        provider_id, examined, len(changes)))
 
 
 @singleton_task()
@@ -1395,6 +1458,8 @@ def generic_shepherd(self, preconfigured):
     appliances. For each template group, it keeps the last template's appliances spinned up in
     required quantity. If new template comes out of the door, it automatically kills the older
     running template's appliances and spins up new ones. Sorts the groups by the fulfillment."""
+    # Load of all the providers, taken once for the whole pass
+    providers = Provider.load_snapshot()
     for gs in sorted(
             GroupShepherd.objects.all(), key=lambda g: g.get_fulfillment_percentage(preconfigured)):
         prov_filter = {'provider__user_groups': gs.user_group}
@@ -1448,23 +1513,34 @@ def generic_shepherd(self, preconfigured):
         # If we then want to delete some templates, better kill the eldest. status_changed
         # says which one was provisioned when, because nothing else then touches that field.
         appliances.sort(key=lambda appliance: appliance.status_changed)
-        pool_size = gs.template_pool_size if preconfigured else gs.unconfigured_template_pool_size
+        pool_size = gs.wanted_pool_size(
+            preconfigured, version=filter_keep.get('version'),
+            provider_types={providers[t.provider_id].provider_type for t in possible_templates})
         if len(appliances) < pool_size and possible_templates_for_provision:
             # There must be some templates in order to run the provisioning
             # Provision ONE appliance at time for each group, that way it is possible to maintain
-            # reasonable balancing
+            # reasonable balancing. Predicted bursts get more of them at once.
+            if gs.predictive:
+                provision_count = min(
+                    pool_size - len(appliances), settings.SHEPHERD_MAX_PROVISION_PER_PASS)
+            else:
+                provision_count = 1
             with transaction.atomic():
-                # Now look for templates that are on non-busy providers
-                tpl_free = filter(
-                    lambda t: t.provider.free,
-                    possible_templates_for_provision)
-                if tpl_free:
-                    chosen_template = sorted(tpl_free, key=lambda t: t.provider.appliance_load)[0]
+                for _ in range(provision_count):
+                    # Now look for templates that are on non-busy providers
+                    tpl_free = filter(
+                        lambda t: providers[t.provider_id].free,
+                        possible_templates_for_provision)
+                    if not tpl_free:
+                        break
+                    chosen_template = sorted(
+                        tpl_free, key=lambda t: providers[t.provider_id].appliance_load)[0]
                     new_appliance_name = gen_appliance_name(chosen_template.id)
                     appliance = Appliance(
                         template=chosen_template,
                         name=new_appliance_name)
                     appliance.save()
+                    providers[chosen_template.provider_id].account_new_appliance()
                     self.logger.info(
                         "Adding an appliance to shepherd: {}/{}".format(appliance.id,
                                                                         appliance.name))
@@ -1497,6 +1573,7 @@ def generic_shepherd(self, preconfigured):
 def free_appliance_shepherd(self):
     generic_shepherd(self, True)
     generic_shepherd(self, False)
+    PoolDemand.cleanup()
 
 
 @singleton_task()
@@ -1680,12 +1757,9 @@ def scavenge_managed_providers_from_appliance(self, appliance_id):
 @singleton_task()
 def calculate_provider_management_usage(self, appliance_ids):
     results = {}
-    for appliance_id in filter(lambda id: id is not None, appliance_ids):
-        try:
-            appliance = Appliance.objects.get(id=appliance_id)
-        except ObjectDoesNotExist:
-            # Deleted in meanwhile
-            continue
+    # Deleted in meanwhile are not found
+    scavenged = Appliance.objects.filter(id__in=[id for id in appliance_ids if id is not None])
+    for appliance in Appliance.filter_metadata('managed_providers', queryset=scavenged):
         for provider_key in appliance.managed_providers:
             if provider_key not in results:
                 results[provider_key] = []
@@ -1992,8 +2066,10 @@ def synchronize_untracked_vms_in_provider(self, provider_id):
     if not hasattr(provider_api, 'list_vms'):
         # This provider does not have VMs
         return
+    tracked_names = set(
+        Appliance.objects.filter(template__provider=provider).values_list('name', flat=True))
     for vm in sorted(provider_api.list_vms()):
-        if Appliance.objects.filter(name=vm.name, template__provider=provider).count() != 0:
+        if vm.name in tracked_names:
             continue
         # We have an untracked VM. Let's investigate
         try:
@@ -2150,7 +2226,7 @@ def process_docker_images_from_url_group(self, group_id, version, docker_version
         if age > group.template_obsolete_days:
             self.logger.info('Ignoring old template {} (age {} days)'.format(pull_url, age))
             return
-    for provider in Provider.objects.filter(working=True, disabled=False):
+    for provider in Provider.with_load(Provider.objects.filter(working=True, disabled=False)):
         if not provider.container_base_template:
             # 11:30 PM, TODO put this check in a query
             continue
@@ -1,4 +1,486 @@
 # -*- coding: utf-8 -*-
-# from django.test import TestCase
+import json
+from datetime import date, datetime, timedelta
+from importlib import import_module
 
-# Create your tests here.
+import yaml
+from django.apps import apps
+from django.contrib.auth.models import Group as UserGroup, User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from appliances import api, models, tasks
+from appliances.models import (
+    Appliance, AppliancePool, Group, Provider, Template, TemplateIndex, dump_metadata,
+    load_metadata, predicted_demand)
+
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class FakeRedis(object):
+    """Keeps the state versions of :py:class:`sprout.RedisWrapper` in memory"""
+    def __init__(self):
+        self.versions = {}
+        self.waits = []
+        self.on_wait = None
+
+    def state_version(self, name):
+        return self.versions.get(name, 0)
+
+    def state_changed(self, name):
+        self.versions[name] = self.state_version(name) + 1
+        return self.versions[name]
+
+    def wait_state_change(self, name, version, timeout):
+        self.waits.append((name, version, timeout))
+        if self.on_wait is not None:
+            self.on_wait()
+        return self.state_version(name)
+
+
+class SproutTestMixin(object):
+    """Runs with the state versions in :py:class:`FakeRedis`, use with the local cache"""
+    def setUp(self):
+        self.redis = FakeRedis()
+        for module in (api, models):
+            self.addCleanup(setattr, module, 'redis', module.redis)
+            module.redis = self.redis
+        self.addCleanup(setattr, models.TemplateIndex, '_current', (None, None))
+        self.user = User.objects.create_user('user', password='password')
+        self.group = Group.objects.create(id='downstream-59z')
+
+    def create_template(self, provider, version='5.9.0.1', date=date(2018, 6, 1), **kwargs):
+        kwargs.setdefault('name', 'cfme-{}-{}-{}'.format(version, date, provider.id))
+        kwargs.setdefault('template_group', self.group)
+        return Template.objects.create(
+            provider=provider, version=version, date=date, original_name=kwargs['name'], **kwargs)
+
+    def create_appliance(self, template, owner=None, **kwargs):
+        if owner is not None:
+            kwargs['appliance_pool'] = AppliancePool.objects.create(
+                total_count=1, group=self.group, owner=owner)
+        return Appliance.objects.create(
+            template=template, name='appliance-{}'.format(Appliance.objects.count()), **kwargs)
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class SproutTestCase(SproutTestMixin, TestCase):
+    pass
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class SproutTransactionTestCase(SproutTestMixin, TransactionTestCase):
+    """The state versions change only once the transactions commit, these tests commit them"""
+
+
+class PredictedDemandTestCase(SimpleTestCase):
+    # Wednesday
+    now = datetime(2018, 6, 13, 20, 0)
+    lookahead = timedelta(hours=2)
+
+    def predict(self, requests, now=None, history_days=8):
+        return predicted_demand(requests, now or self.now, self.lookahead, history_days)
+
+    def test_no_requests(self):
+        self.assertEqual(self.predict([]), 0)
+
+    def test_recent_burst(self):
+        requests = [(self.now - timedelta(hours=1), 3), (self.now - timedelta(hours=3), 10)]
+        self.assertEqual(self.predict(requests), 3)
+
+    def test_same_window_of_previous_workdays(self):
+        # Tuesday and Monday in the window, Monday out of it, Sunday is a weekend day
+        requests = [
+            (self.now - timedelta(days=1, minutes=-30), 5),
+            (self.now - timedelta(days=2), 5),
+            (self.now - timedelta(days=2, minutes=1), 100),
+            (self.now - timedelta(days=3, minutes=-30), 100)]
+        # 5 workdays among the last 7 days
+        self.assertEqual(self.predict(requests), 2.0)
+
+    def test_same_window_of_previous_weekend_days(self):
+        saturday = datetime(2018, 6, 16, 20, 0)
+        requests = [
+            (saturday - timedelta(days=1, minutes=-30), 100),
+            (saturday - timedelta(days=6, minutes=-30), 4)]
+        # Sunday and the previous Saturday are the weekend days among the last 7 days
+        self.assertEqual(self.predict(requests, now=saturday), 2.0)
+
+    def test_history_days(self):
+        requests = [(self.now - timedelta(days=1, minutes=-30), 6)]
+        self.assertEqual(self.predict(requests, history_days=2), 6.0)
+        self.assertEqual(self.predict(requests, history_days=1), 0)
+
+
+class RequestCheckTestCase(SproutTestCase):
+    request_check = staticmethod(api.jsonapi._methods['request_check'])
+
+    def setUp(self):
+        super(RequestCheckTestCase, self).setUp()
+        self.pool = AppliancePool.objects.create(total_count=1, group=self.group, owner=self.user)
+        self.state_name = AppliancePool.state_name(self.pool.id)
+
+    def test_returns_right_away_without_state_version(self):
+        result = self.request_check(self.user, self.pool.id)
+
+        self.assertEqual(self.redis.waits, [])
+        self.assertEqual(result['state_version'], self.redis.state_version(self.state_name))
+        self.assertFalse(result['finished'])
+        self.assertEqual(result['appliances'], [])
+
+    def test_waits_shortly_for_the_change(self):
+        state_version = self.request_check(self.user, self.pool.id)['state_version']
+
+        def finish_pool():
+            AppliancePool.objects.filter(id=self.pool.id).update(finished=True)
+            self.redis.state_changed(self.state_name)
+        self.redis.on_wait = finish_pool
+        result = self.request_check(self.user, self.pool.id, state_version, timeout=60)
+
+        self.assertEqual(
+            self.redis.waits, [(self.state_name, state_version, api.REQUEST_CHECK_MAX_WAIT)])
+        self.assertEqual(result['state_version'], state_version + 1)
+        # not the cached result of the previous state version
+        self.assertTrue(result['finished'])
+
+    def test_returns_unchanged_pool_after_the_wait(self):
+        state_version = self.request_check(self.user, self.pool.id)['state_version']
+
+        result = self.request_check(self.user, self.pool.id, state_version, timeout=1)
+
+        self.assertEqual(self.redis.waits, [(self.state_name, state_version, 1)])
+        self.assertEqual(result['state_version'], state_version)
+        self.assertFalse(result['finished'])
+
+    def test_pool_of_another_user(self):
+        other = User.objects.create_user('other', password='password')
+        with self.assertRaises(Exception):
+            self.request_check(other, self.pool.id)
+
+
+class MetadataTestCase(SproutTestCase):
+    def test_dump_metadata_is_canonical(self):
+        self.assertEqual(dump_metadata({'b': [1, 2], 'a': {'d': None, 'c': u'x'}}),
+                         '{"a":{"c":"x","d":null},"b":[1,2]}')
+
+    def test_load_metadata(self):
+        self.assertEqual(load_metadata('{"a":[1,2]}'), {'a': [1, 2]})
+        # stored before the migration to JSON
+        self.assertEqual(load_metadata(yaml.dump({'a': [1, 2], 'b': 'c d'})),
+                         {'a': [1, 2], 'b': 'c d'})
+
+    def test_metadata_returns_a_copy(self):
+        self.group.metadata = {'templates': ['a']}
+        self.group.metadata['templates'].append('b')
+        self.group.metadata['other'] = 1
+
+        self.assertEqual(self.group.metadata, {'templates': ['a']})
+        self.group.object_meta_data = dump_metadata({'templates': ['c']})
+        self.assertEqual(self.group.metadata, {'templates': ['c']})
+
+    def test_filter_metadata(self):
+        found = Group.objects.create(id='found')
+        found.metadata = {'provider': 'vsphere', 'count': 2}
+        found.save()
+        nested = Group.objects.create(id='nested')
+        nested.metadata = {'other': {'provider': 'vsphere', 'count': 2}}
+        nested.save()
+
+        self.assertEqual(Group.filter_metadata('provider'), [found])
+        self.assertEqual(Group.filter_metadata(provider='vsphere', count=2), [found])
+        self.assertEqual(Group.filter_metadata(provider='rhevm'), [])
+        self.assertEqual(
+            Group.filter_metadata('provider', queryset=Group.objects.exclude(id='found')), [])
+        # the query matches the text of the nested metadata too
+        self.assertEqual(set(Group.objects.filter(Group.metadata_q('provider'))), {found, nested})
+
+    def test_metadata_migration_round_trip(self):
+        migration = import_module('appliances.migrations.0049_metadata_to_json')
+
+        class SchemaEditor(object):
+            pass
+        schema_editor = SchemaEditor()
+        schema_editor.connection = connection
+        metadata = {'templates': ['a', 'b'], 'count': 2}
+        Group.objects.filter(id=self.group.id).update(object_meta_data=yaml.dump(metadata))
+
+        migration.metadata_yaml_to_json(apps, schema_editor)
+        self.assertEqual(
+            Group.objects.get(id=self.group.id).object_meta_data, dump_metadata(metadata))
+        migration.metadata_json_to_yaml(apps, schema_editor)
+        raw = Group.objects.get(id=self.group.id).object_meta_data
+        self.assertEqual(yaml.load(raw), metadata)
+        self.assertRaises(ValueError, json.loads, raw)
+
+
+class ProviderLoadTestCase(SproutTestCase):
+    def setUp(self):
+        super(ProviderLoadTestCase, self).setUp()
+        self.vsphere = Provider.objects.create(id='vsphere', working=True)
+        self.rhevm = Provider.objects.create(id='rhevm', working=True)
+        Provider.objects.create(id='empty', working=True)
+        ready = self.create_template(self.vsphere, ready=True)
+        self.create_template(self.vsphere, version='5.9.0.2', ready=False)
+        self.create_template(self.rhevm, ready=True)
+        self.create_appliance(ready)
+        self.create_appliance(ready, owner=self.user, ready=True, ip_address='10.0.0.1')
+        self.create_appliance(ready, owner=self.user, marked_for_deletion=True)
+        self.other = User.objects.create_user('other', password='password')
+        self.create_appliance(
+            Template.objects.get(provider=self.rhevm), owner=self.other, ip_address='10.0.0.2')
+
+    def load(self, provider):
+        return (provider.num_currently_managing, provider.num_currently_provisioning,
+                provider.num_templates_preparing)
+
+    def test_with_load_matches_the_counts(self):
+        expected = {'vsphere': (3, 1, 1), 'rhevm': (1, 0, 0), 'empty': (0, 0, 0)}
+        for provider in Provider.with_load():
+            self.assertEqual(self.load(provider), expected[provider.id])
+            self.assertEqual(self.load(Provider.objects.get(id=provider.id)), expected[provider.id])
+
+    def test_load_snapshot_queries_once(self):
+        with self.assertNumQueries(1):
+            snapshot = Provider.load_snapshot(Provider.objects.filter(working=True))
+            loads = {provider_id: (self.load(provider), provider.free)
+                     for provider_id, provider in snapshot.items()}
+        self.assertEqual(sorted(loads), ['empty', 'rhevm', 'vsphere'])
+
+    def test_account_new_appliance(self):
+        vsphere = Provider.load_snapshot()['vsphere']
+
+        vsphere.account_new_appliance()
+
+        self.assertEqual(self.load(vsphere), (4, 2, 1))
+        # not annotated, counted from the database anyway
+        self.vsphere.account_new_appliance()
+        self.assertEqual(self.load(self.vsphere), (3, 1, 1))
+
+    def test_user_usage(self):
+        self.assertEqual(self.vsphere.user_usage, [(self.user, 2)])
+        self.assertEqual(Provider.complete_user_usage(), [(self.user, 2), (self.other, 1)])
+        self.rhevm.hidden = True
+        self.rhevm.save()
+        self.assertEqual(Provider.complete_user_usage(), [(self.user, 2)])
+
+
+class FakeVM(object):
+    def __init__(self, name, uuid, ip, state):
+        self.name = name
+        self.uuid = uuid
+        self.ip = ip
+        self.state = state
+
+
+class FakeProviderAPI(object):
+    def __init__(self, vms):
+        self.vms = vms
+
+    def list_vms(self):
+        return self.vms
+
+
+class ProviderRefreshTestCase(SproutTestCase):
+    def setUp(self):
+        super(ProviderRefreshTestCase, self).setUp()
+        self.provider = Provider.objects.create(id='vsphere', working=True)
+        self.template = self.create_template(self.provider, ready=True)
+
+    def refresh(self, *vms):
+        self.addCleanup(setattr, Provider, 'api', Provider.api)
+        Provider.api = FakeProviderAPI(list(vms))
+        return tasks.refresh_appliances_provider(self.provider.id)
+
+    def test_update_changed_groups_the_same_changes(self):
+        appliances = [self.create_appliance(self.template) for _ in range(5)]
+        changes = {appliance.id: {'power_state': 'on'} for appliance in appliances[:3]}
+        changes[appliances[3].id] = {'power_state': 'off', 'swap': 5}
+
+        with self.assertNumQueries(3):
+            updated = Appliance.update_changed(changes, chunk_size=2, description='refreshed')
+
+        self.assertEqual(updated, 4)
+        self.assertEqual(
+            [(a.power_state, a.swap, a.description) for a in Appliance.objects.order_by('id')],
+            [('on', None, 'refreshed')] * 3 + [('off', 5, 'refreshed'), ('unknown', None, '')])
+
+    def test_refresh_writes_only_the_changed_appliances(self):
+        by_uuid = self.create_appliance(self.template, uuid='1234', power_state='on')
+        by_name = self.create_appliance(self.template)
+        unchanged = self.create_appliance(
+            self.template, uuid='5678', ip_address='10.0.0.3', power_state='on')
+        orphaned = self.create_appliance(self.template)
+        modified_on = unchanged.modified_on
+
+        result = self.refresh(
+            FakeVM('renamed', '1234', '10.0.0.1', 'poweredOff'),
+            FakeVM(by_name.name, '9999', '10.0.0.2', 'poweredOn'),
+            FakeVM(unchanged.name, '5678', '10.0.0.3', 'poweredOn'))
+
+        self.assertEqual(result, {'examined': 4, 'changed': 3})
+        by_uuid.reload()
+        self.assertEqual((by_uuid.name, by_uuid.ip_address, by_uuid.power_state),
+                         ('renamed', '10.0.0.1', Appliance.Power.OFF))
+        by_name.reload()
+        self.assertEqual((by_name.uuid, by_name.ip_address, by_name.power_state),
+                         ('9999', '10.0.0.2', Appliance.Power.ON))
+        orphaned.reload()
+        self.assertEqual(orphaned.power_state, Appliance.Power.ORPHANED)
+        unchanged.reload()
+        self.assertEqual(unchanged.modified_on, modified_on)
+        self.assertGreater(by_name.modified_on, modified_on)
+
+
+class StateChangeTestCase(SproutTransactionTestCase):
+    list_appliances = staticmethod(api.jsonapi._methods['list_appliances'])
+    request_check = staticmethod(api.jsonapi._methods['request_check'])
+
+    def setUp(self):
+        super(StateChangeTestCase, self).setUp()
+        self.template = self.create_template(Provider.objects.create(id='vsphere'))
+        self.appliance = self.create_appliance(self.template, owner=self.user)
+        self.pool = self.appliance.appliance_pool
+
+    def test_appliance_save_bumps_the_states(self):
+        versions = dict(self.redis.versions)
+        other_pool = AppliancePool.objects.create(total_count=1, group=self.group, owner=self.user)
+
+        self.appliance.appliance_pool = other_pool
+        self.appliance.save()
+
+        for name in (models.APPLIANCES_STATE, AppliancePool.state_name(self.pool.id)):
+            self.assertEqual(self.redis.state_version(name), versions[name] + 1)
+        self.assertEqual(
+            self.redis.state_version(AppliancePool.state_name(other_pool.id)),
+            # created and the appliance joined
+            2)
+
+    def test_cached_result(self):
+        computed = []
+
+        def compute():
+            computed.append(len(computed))
+            return computed[-1]
+
+        first = api.cached_result('key', 'state', compute)
+        self.assertEqual(api.cached_result('key', 'state', compute), first)
+        self.redis.state_changed('state')
+        second = api.cached_result('key', 'state', compute)
+
+        self.assertEqual((first[0], second[0]), (0, 1))
+        self.assertNotEqual(first[1], second[1])
+        self.assertEqual((first[2], second[2]), (0, 1))
+
+    def test_list_appliances_cache_is_invalidated(self):
+        listed = self.list_appliances(used=True, etag='none')
+        self.assertEqual([a['name'] for a in listed['appliances']], [self.appliance.name])
+        # the bulk updates do not notify, the result stays cached
+        Appliance.objects.filter(id=self.appliance.id).update(name='renamed')
+        unchanged = self.list_appliances(used=True, etag=listed['etag'])
+        self.assertEqual(unchanged, {'etag': listed['etag'], 'modified': False, 'appliances': None})
+
+        Appliance.objects.get(id=self.appliance.id).save()
+
+        changed = self.list_appliances(used=True, etag=listed['etag'])
+        self.assertTrue(changed['modified'])
+        self.assertEqual([a['name'] for a in changed['appliances']], ['renamed'])
+        self.assertEqual(self.list_appliances(fields=['name']), [])
+
+    def test_request_check_cache_is_invalidated(self):
+        checked = self.request_check(self.user, self.pool.id, fields=['ready'])
+        self.assertEqual(checked['appliances'], [{'ready': False}])
+        Appliance.objects.filter(id=self.appliance.id).update(ready=True)
+        self.assertEqual(self.request_check(self.user, self.pool.id, fields=['ready']), checked)
+
+        Appliance.objects.get(id=self.appliance.id).save()
+
+        changed = self.request_check(self.user, self.pool.id, fields=['ready'])
+        self.assertEqual(changed['appliances'], [{'ready': True}])
+        self.assertEqual(changed['state_version'], checked['state_version'] + 1)
+
+
+class TemplateIndexTestCase(SproutTestCase):
+    def setUp(self):
+        super(TemplateIndexTestCase, self).setUp()
+        self.testers = UserGroup.objects.create(name='testers')
+        vsphere = Provider.objects.create(id='vsphere', working=True, provider_type='virtualcenter')
+        vsphere.user_groups.add(self.testers)
+        rhevm = Provider.objects.create(id='rhevm', working=True, provider_type='rhevm')
+        broken = Provider.objects.create(id='broken', working=False, provider_type='rhevm')
+        broken.user_groups.add(self.testers)
+        upstream = Group.objects.create(id='upstream')
+        usable = dict(ready=True, usable=True, exists=True)
+        for provider in (vsphere, rhevm, broken):
+            self.create_template(provider, '5.9.0.10', date(2018, 6, 2), **usable)
+            self.create_template(provider, '5.9.0.9', date(2018, 6, 1), ga_released=True, **usable)
+        self.create_template(vsphere, '5.9.1.0', date(2018, 6, 3), ready=False)
+        self.create_template(rhevm, '5.9.0.10', date(2018, 5, 30), exists=False, ready=True)
+        self.create_template(
+            vsphere, None, date(2018, 6, 4), template_group=upstream, name='miq-nightly', **usable)
+        self.index = TemplateIndex.build()
+
+    def templates(self, available=False, user_groups=None, **kwargs):
+        filters = dict(kwargs)
+        if available:
+            filters.update(
+                ready=True, usable=True, exists=True, provider__working=True,
+                provider__disabled=False)
+        if user_groups is not None:
+            filters['provider__user_groups__in'] = user_groups
+        return filters
+
+    def test_versions_match_the_queries(self):
+        for index_filters, query_filters in [
+                ({}, {}),
+                ({'group': self.group.id}, {'template_group': self.group}),
+                ({'group': 'upstream'}, {'template_group': 'upstream'}),
+                ({'group': self.group.id, 'available': True},
+                 self.templates(available=True, template_group=self.group)),
+                ({'provider_type': 'rhevm'}, {'provider__provider_type': 'rhevm'}),
+                ({'user_groups': [self.testers.id], 'available': True},
+                 self.templates(available=True, user_groups=[self.testers.id])),
+                ({'provider': 'rhevm', 'exists': True}, {'provider': 'rhevm', 'exists': True})]:
+            self.assertEqual(
+                self.index.versions(**index_filters), Template.get_versions(**query_filters))
+
+    def test_dates_match_the_queries(self):
+        for index_filters, query_filters in [
+                ({'group': self.group.id}, {'template_group': self.group}),
+                ({'version': '5.9.0.10'}, {'version': '5.9.0.10'}),
+                ({'version': '5.9.0.10', 'available': True},
+                 self.templates(available=True, version='5.9.0.10')),
+                ({'provider': 'vsphere', 'preconfigured': True},
+                 {'provider': 'vsphere', 'preconfigured': True})]:
+            self.assertEqual(self.index.dates(**index_filters), Template.get_dates(**query_filters))
+
+    def test_provider_ids_match_the_queries(self):
+        for index_filters, query_filters in [
+                ({}, {}),
+                ({'version': '5.9.0.10', 'available': True},
+                 self.templates(available=True, version='5.9.0.10')),
+                ({'date': date(2018, 6, 4)}, {'date': date(2018, 6, 4)})]:
+            self.assertEqual(
+                self.index.provider_ids(**index_filters),
+                sorted(set(Template.objects.filter(**query_filters).values_list(
+                    'provider', flat=True))))
+
+    def test_ga_version_and_latest_dates(self):
+        self.assertTrue(self.index.ga_version('5.9.0.9'))
+        self.assertEqual(self.index.ga_version('5.9.0.10'), Template.ga_version('5.9.0.10'))
+        self.assertEqual(
+            self.index.latest_dates(),
+            {self.group.id: date(2018, 6, 3), 'upstream': date(2018, 6, 4)})
+
+    def test_index_is_built_again_after_a_change(self):
+        index = TemplateIndex.get()
+        with self.assertNumQueries(0):
+            self.assertIs(TemplateIndex.get(), index)
+        # another process with the index in the cache only
+        TemplateIndex._current = (None, None)
+        with self.assertNumQueries(0):
+            self.assertEqual(TemplateIndex.get().rows, index.rows)
+
+        Provider.objects.filter(id='rhevm').update(disabled=True)
+        self.redis.state_changed(models.TEMPLATES_STATE)
+
+        self.assertEqual(TemplateIndex.get().provider_ids(available=True), ['vsphere'])
@@ -18,7 +18,7 @@ from django.shortcuts import render, redirect
 from appliances.api import json_response
 from appliances.models import (
     Provider, AppliancePool, Appliance, Group, Template, MismatchVersionMailer, User, BugQuery,
-    GroupShepherd)
+    GroupShepherd, TemplateIndex)
 from appliances.tasks import (appliance_power_on, appliance_power_off, appliance_suspend,
     anyvm_power_on, anyvm_power_off, anyvm_suspend, anyvm_delete, delete_template_from_provider,
     appliance_rename, wait_appliance_ready, mark_appliance_ready, appliance_reboot,
@@ -87,7 +87,8 @@ def providers(request, provider_id=None):
             return go_home(request)
     else:
         try:
-            provider = Provider.objects.filter(id=provider_id, **user_filter).distinct().first()
+            provider = Provider.with_load(
+                Provider.objects.filter(id=provider_id, **user_filter).distinct()).first()
             if provider is None:
                 messages.error(
                     request,
@@ -203,21 +204,13 @@ def versions_for_group(request):
         except ObjectDoesNotExist:
             versions = []
         else:
-            filters = {
-                'template_group': group,
-                'ready': True,
-                'usable': True,
-                'exists': True,
-                'provider__working': True,
-                'provider__disabled': False,
-                'provider__user_groups__in': request.user.groups.all(),
-                'preconfigured': preconfigured,
-                'template_type': template_type
-            }
-
+            index = TemplateIndex.get()
             versions = [
-                (version, Template.ga_version(version))
-                for version in Template.get_versions(**filters)]
+                (version, index.ga_version(version))
+                for version in index.versions(
+                    group=group.id, preconfigured=preconfigured, template_type=template_type,
+                    user_groups=request.user.groups.values_list('id', flat=True),
+                    available=True)]
             if versions:
                 if versions[0][1]:
                     latest_version = '{} (GA)'.format(versions[0][0])
@@ -242,27 +235,24 @@ def date_for_group_and_version(request):
             dates = []
         else:
             version = request.POST.get("version")
+            index = TemplateIndex.get()
             filters = {
-                "template_group": group,
-                "ready": True,
-                "exists": True,
-                "usable": True,
+                "group": group.id,
                 "preconfigured": preconfigured,
-                "provider__working": True,
-                'provider__disabled': False,
-                "provider__user_groups__in": request.user.groups.all(),
-                'template_type': template_type
+                "user_groups": request.user.groups.values_list('id', flat=True),
+                "template_type": template_type,
+                "available": True,
             }
 
             if version == "latest":
                 try:
-                    versions = Template.get_versions(**filters)
+                    versions = index.versions(**filters)
                     filters["version"] = versions[0]
                 except IndexError:
                     pass  # No such thing as version for this template group
             else:
                 filters["version"] = version
-            dates = Template.get_dates(**filters)
+            dates = index.dates(**filters)
             if dates:
                 latest_date = dates[0]
     return render(request, 'appliances/_dates.html', locals())
@@ -290,21 +280,18 @@ def providers_for_date_group_and_version(request):
             providers = []
         else:
             version = request.POST.get("version")
+            index = TemplateIndex.get()
             filters = {
-                "template_group": group,
-                "ready": True,
-                "exists": True,
-                "usable": True,
+                "group": group.id,
                 "preconfigured": preconfigured,
-                "provider__working": True,
-                "provider__disabled": False,
-                "provider__user_groups__in": request.user.groups.all(),
+                "user_groups": request.user.groups.values_list('id', flat=True),
                 "template_type": template_type,
+                "available": True,
             }
 
             if version == "latest":
                 try:
-                    versions = Template.get_versions(**filters)
+                    versions = index.versions(**filters)
                     filters["version"] = versions[0]
                 except IndexError:
                     pass  # No such thing as version for this template group
@@ -313,15 +300,14 @@ def providers_for_date_group_and_version(request):
             date = request.POST.get("date")
             if date == "latest":
                 try:
-                    dates = Template.get_dates(**filters)
+                    dates = index.dates(**filters)
                     filters["date"] = dates[0]
                 except IndexError:
                     pass  # No such thing as date for this template group
             else:
-                filters["date"] = parser.parse(date)
-            providers = Template.objects.filter(**filters).values("provider").distinct()
-            providers = sorted([p.values()[0] for p in providers])
-            providers = list(Provider.objects.filter(id__in=providers))
+                filters["date"] = parser.parse(date).date()
+            providers = list(Provider.with_load(
+                Provider.objects.filter(id__in=index.provider_ids(**filters)).order_by('id')))
             if provider_type is None:
                 providers = list(providers)
             else:
@@ -334,7 +320,7 @@ def providers_for_date_group_and_version(request):
                 appl_filter = dict(
                     appliance_pool=None, ready=True, template__provider=provider,
                     template__preconfigured=filters["preconfigured"],
-                    template__template_group=filters["template_group"],
+                    template__template_group=group,
                     template__template_type=filters["template_type"])
                 if "date" in filters:
                     appl_filter["template__date"] = filters["date"]
@@ -409,11 +395,10 @@ def my_appliances(request, show_user="my"):
         end_index -= start_index
         start_index = 0
     pages = pages[start_index:end_index]
-    available_groups = Group.objects.filter(
-        id__in=Template.objects.values_list('template_group', flat=True).distinct())
+    latest_dates = TemplateIndex.get().latest_dates()
     group_tuples = []
-    for grp in available_groups:
-        group_tuples.append((grp.templates.order_by('-date')[0].date, grp))
+    for grp in Group.objects.filter(id__in=list(latest_dates)):
+        group_tuples.append((latest_dates[grp.id], grp))
     group_tuples.sort(key=lambda gt: gt[0], reverse=True)
     template_types = [t for t in Template.TEMPLATE_TYPES]
     can_order_pool = show_user == "my"
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
+import time
 from contextlib import contextmanager
 try:
     import six.moves.cPickle as pickle
@@ -97,6 +98,50 @@ class RedisWrapper(object):
     def renaming_appliances(self):
         return self.get("renaming_appliances") or set([])
 
+    @staticmethod
+    def _state_key(name):
+        return "sprout-state-{}".format(name)
+
+    def state_version(self, name):
+        """Returns the number of changes of the named state, see :py:meth:`state_changed`.
+
+        The states are eg. ``pool-<id>`` for the appliance pools or ``appliances``.
+        """
+        return int(self.client.get(self._state_key(name)) or 0)
+
+    def state_changed(self, name):
+        """Bumps the version of the named state and wakes up whoever waits for it to change.
+
+        The counter and the notification are atomic on their own, so the lock is not needed.
+        """
+        key = self._state_key(name)
+        version = self.client.incr(key)
+        self.client.publish(key, version)
+        return version
+
+    def wait_state_change(self, name, version, timeout):
+        """Waits until the version of the named state differs from ``version``.
+
+        Returns:
+            The current version of the state, ``version`` if the timeout passed first.
+        """
+        key = self._state_key(name)
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(key)
+        try:
+            # Subscribed first, so a change right after this check is not missed
+            current = self.state_version(name)
+            deadline = time.time() + timeout
+            while current == version:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                if pubsub.get_message(timeout=remaining) is not None:
+                    current = self.state_version(name)
+            return current
+        finally:
+            pubsub.close()
+
 
 redis = RedisWrapper(redis_client)
 sprout_path = project_path.join("sprout")
@@ -166,6 +166,18 @@ ORPHANED_APPLIANCE_GRACE_TIME = dict(
     minutes=45,
 )
 
+# Predictive shepherd pool sizes (GroupShepherd.predictive)
+# How far ahead the demand is predicted, roughly the time it takes to spin up an appliance
+SHEPHERD_DEMAND_LOOKAHEAD = dict(
+    hours=1,
+)
+# How many days of the requests the prediction learns from
+SHEPHERD_DEMAND_HISTORY_DAYS = 14
+# Multiplier of the predicted demand
+SHEPHERD_DEMAND_HEADROOM = 1.2
+# Most appliances provisioned for a group shepherd in one pass when the demand grows
+SHEPHERD_MAX_PROVISION_PER_PASS = 5
+
 # Celery beat
 CELERYBEAT_SCHEDULE = {
     'check-templates': {
@@ -14,8 +14,8 @@ from jsmin import jsmin
 from lxml.html import document_fromstring
 from selenium.common.exceptions import WebDriverException
 from wait_for import TimedOutError, wait_for
-from widgetastic.exceptions import NoSuchElementException, WidgetOperationFailed
-from widgetastic.log import logged
+from widgetastic.exceptions import NoSuchElementException, RowNotFound, WidgetOperationFailed
+from widgetastic.log import create_item_logger, logged
 from widgetastic.utils import (
     ParametrizedLocator,
     Parameter,
@@ -524,6 +524,185 @@ class Table(VanillaTable):
             self.logger.debug("sort_by(%r, %r): order already selected", column, order)
 
 
+def _normalize_space(text):
+    """Mimics XPath normalize-space() the table row filters use"""
+    return " ".join(text.split())
+
+
+def _visible_text(text, visible):
+    """Mimics the ``Browser.text()`` of a cell, its visible text or ``textContent`` if hidden"""
+    return _normalize_space(visible if visible and visible.strip() else text)
+
+
+class TableSnapshot(object):
+    """Texts of all the cells of a table read in one javascript call
+
+    The rows are looked up in the snapshot with the same filters as ``Table.row()`` accepts
+    (``column=value``, ``column__contains``, ``column__startswith``, ``column__endswith``,
+    regexps and the tuple filters) except the ``_row__`` ones, see :py:meth:`supports`. The exact
+    matches are looked up in an index of the texts of the column, built when first needed. The
+    regexps match the visible text of the cells like ``row[column].text`` does, the other filters
+    the ``textContent`` like the XPath of ``Table.row()`` does. The row widgets are created only
+    for the matching rows.
+
+    The snapshot reflects the table when it was taken, take a new one when the table changes
+    (e.g. after moving to another page).
+
+    Args:
+        table: widgetastic ``Table`` widget
+    """
+
+    CELL_TEXTS = jsmin(
+        """
+        var rows = document.evaluate(
+            arguments[1], arguments[0], null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        var result = [];
+        for (var i = 0; i < rows.snapshotLength; i++) {
+            var row = rows.snapshotItem(i);
+            var preceding = 0;
+            for (var e = row.previousElementSibling; e; e = e.previousElementSibling) {
+                preceding++;
+            }
+            var cells = [];
+            var visibleCells = [];
+            for (var j = 0; j < row.children.length; j++) {
+                if (row.children[j].tagName.toLowerCase() === "td") {
+                    cells.push(row.children[j].textContent);
+                    visibleCells.push(row.children[j].innerText);
+                }
+            }
+            result.push([preceding, cells, visibleCells]);
+        }
+        return result;
+    """
+    )
+
+    MATCHERS = {
+        None: lambda text, value: text == value,
+        "contains": lambda text, value: value in text,
+        "startswith": lambda text, value: text.startswith(value),
+        "endswith": lambda text, value: text.endswith(value),
+    }
+
+    def __init__(self, table):
+        self.table = table
+        self.rows_data = [
+            (
+                preceding,
+                [_normalize_space(text) for text in cells],
+                [_visible_text(text, visible) for text, visible in zip(cells, visible_cells)],
+            )
+            for preceding, cells, visible_cells in table.browser.execute_script(
+                self.CELL_TEXTS, table.browser.element(table), table.ROWS
+            )
+        ]
+        self._indexes = {}
+
+    def __len__(self):
+        return len(self.rows_data)
+
+    @staticmethod
+    def supports(*extra_filters, **filters):
+        """Whether the filters can be looked up in a snapshot"""
+        return not any(column.startswith("_row__") for column in filters)
+
+    def _filters(self, extra_filters, filters):
+        """Converts the filters to ``(column position, method, value)`` like ``Table.row()``"""
+        result = []
+        for filter_column, value in filters.items():
+            if "__" in filter_column:
+                column, method = filter_column.rsplit("__", 1)
+            else:
+                column, method = filter_column, None
+            result.append((column, method, value))
+        for argfilter in extra_filters:
+            if not isinstance(argfilter, (tuple, list)):
+                raise TypeError("Wrong type passed into tuplefilters (expected tuple or list)")
+            if len(argfilter) == 2:
+                column, value = argfilter
+                method = None
+            elif len(argfilter) == 3:
+                column, method, value = argfilter
+            else:
+                raise ValueError(
+                    "tuple filters can only be (column, string) or (column, method, string)"
+                )
+            result.append((column, method, value))
+
+        processed = []
+        for column, method, value in result:
+            if isinstance(value, re._pattern_type):
+                if method is not None:
+                    raise ValueError("Regexp filters do not take a method ({})".format(method))
+                processed.append((self.table.map_column(column), "regexp", value))
+            elif method in self.MATCHERS:
+                processed.append(
+                    (self.table.map_column(column), method, _normalize_space(six.text_type(value)))
+                )
+            else:
+                raise ValueError("Unknown method {}".format(method))
+        return processed
+
+    def index(self, column):
+        """Returns ``{text: [row numbers of the snapshot]}`` of the column at position ``column``"""
+        if column not in self._indexes:
+            index = {}
+            for number, (_, cells, _) in enumerate(self.rows_data):
+                if column < len(cells):
+                    index.setdefault(cells[column], []).append(number)
+            self._indexes[column] = index
+        return self._indexes[column]
+
+    def find(self, *extra_filters, **filters):
+        """Returns the row numbers of the snapshot of the rows matching the filters"""
+        processed = self._filters(extra_filters, filters)
+        exact = [f for f in processed if f[1] is None]
+        if exact:
+            column, _, value = exact[0]
+            candidates = self.index(column).get(value, [])
+            processed.remove(exact[0])
+        else:
+            candidates = range(len(self.rows_data))
+
+        found = []
+        for number in candidates:
+            _, cells, visible_cells = self.rows_data[number]
+            for column, method, value in processed:
+                if column >= len(cells):
+                    break
+                if method == "regexp":
+                    if value.search(visible_cells[column]) is None:
+                        break
+                elif not self.MATCHERS[method](cells[column], value):
+                    break
+            else:
+                found.append(number)
+        return found
+
+    def row_widget(self, number):
+        """Creates the row widget of the row ``number`` of the snapshot"""
+        preceding = self.rows_data[number][0]
+        # same positioning as Table._filtered_rows does
+        row_pos = preceding if self.table._is_header_in_body else preceding + 1
+        return self.table.Row(
+            self.table, row_pos, logger=create_item_logger(self.table.logger, row_pos)
+        )
+
+    def rows(self, *extra_filters, **filters):
+        """Generates the row widgets of the rows matching the filters"""
+        for number in self.find(*extra_filters, **filters):
+            yield self.row_widget(number)
+
+    def row(self, *extra_filters, **filters):
+        """Returns the row widget of the first row matching the filters, like ``Table.row()``"""
+        try:
+            return six.next(self.rows(*extra_filters, **filters))
+        except StopIteration:
+            raise RowNotFound(
+                "Row not found when using filters {!r}/{!r}".format(extra_filters, filters)
+            )
+
+
 class SummaryTable(VanillaTable):
     """Table used in Provider, VM, Host, ... summaries.
 
@@ -1658,15 +1837,22 @@ class PaginationPane(View, ReportDataControllerMixin):
     def find_row_on_pages(self, table, *args, **kwargs):
         """Find first row matching filters provided by kwargs on the given table widget
 
+        The cells of every page are read at once into a :py:class:`TableSnapshot` which the row
+        is looked up in, unless the filters aren't supported by the snapshot.
+
         Args:
             table: Table widget object
             args: Filters to be passed to table.row()
             kwargs: Filters to be passed to table.row()
         """
+        use_snapshot = isinstance(table, VanillaTable) and TableSnapshot.supports(*args, **kwargs)
         self.first_page()
         for _ in self.pages():
             try:
-                row = table.row(*args, **kwargs)
+                if use_snapshot:
+                    row = TableSnapshot(table).row(*args, **kwargs)
+                else:
+                    row = table.row(*args, **kwargs)
             except IndexError:
                 continue
             if not row:
@@ -2758,6 +2944,23 @@ class FileInput(BaseFileInput):
         return super(FileInput, self).fill(value)
 
 
+def normalize_entity_data(item):
+    """Converts an item of the reportDataController to the data of an entity
+
+    The cells are merged into the item and the keys are lower case with underscores instead of
+    spaces.
+    """
+    data = dict(item)
+    cells = data.pop("cells", {})
+    cells = {str(key).replace(" ", "_").lower(): value for key, value in cells.items()}
+    data = {str(key).replace(" ", "_").lower(): value for key, value in data.items()}
+    data.update(cells)
+    return data
+
+
+EntityIndex = namedtuple("EntityIndex", ["per_page", "entities", "by_name"])
+
+
 class JSBaseEntity(View, ReportDataControllerMixin):
     """ represents Entity, no matter what state it is in.
         It is implemented using ManageIQ JS API
@@ -2800,12 +3003,7 @@ class JSBaseEntity(View, ReportDataControllerMixin):
         which is different for each entity type.
         This is property which should hold such data.
         """
-        data = self._invoke_cmd("get_item", self.entity_id)["item"]
-        cells = data.pop("cells")
-        cells = {str(key).replace(" ", "_").lower(): value for key, value in cells.items()}
-        data = {str(key).replace(" ", "_").lower(): value for key, value in data.items()}
-        data.update(cells)
-        return data
+        return normalize_entity_data(self._invoke_cmd("get_item", self.entity_id)["item"])
 
     def read(self):
         return self.is_checked
@@ -2828,6 +3026,9 @@ class JSBaseEntity(View, ReportDataControllerMixin):
 class EntitiesConditionalView(View, ReportDataControllerMixin):
     """ represents Entities view with regard to view selector state
 
+    On 5.9+, looking for entities on all the pages (``surf_pages=True``) reads the items of all
+    the pages at once, with the maximum items per page, into an index of the entities, see
+    :py:meth:`entity_index`.
     """
 
     elements = '//tr[./td/div[@class="quadicon"]]/following-sibling::tr/td/a'
@@ -2835,6 +3036,18 @@ class EntitiesConditionalView(View, ReportDataControllerMixin):
     search = View.nested(Search)
     paginator = PaginationPane()
 
+    #: Read the items of all the pages at once when looking on all the pages
+    BULK_RETRIEVAL = True
+    #: The highest amount of items per page the paginator offers
+    MAX_ITEMS_PER_PAGE = 1000
+
+    def _item_name(self, item):
+        try:
+            return item["cells"]["Name"]
+        except KeyError:
+            # Floating Ip view has an issue. it doesn't have Name though it should
+            return item["cells"]["Instance name"]
+
     @property
     def _current_page_elements(self):
         elements = []
@@ -2847,15 +3060,79 @@ class EntitiesConditionalView(View, ReportDataControllerMixin):
         else:
             entities = self._invoke_cmd("get_all_items")
             for entity in entities:
-                try:
-                    name = entity["item"]["cells"]["Name"]
-                except KeyError:
-                    # Floating Ip view has an issue. it doesn't have Name though it should
-                    name = entity["item"]["cells"]["Instance name"]
-
-                elements.append({"name": name, "entity_id": entity["item"]["id"]})
+                elements.append(
+                    {"name": self._item_name(entity["item"]), "entity_id": entity["item"]["id"]}
+                )
         return elements
 
+    @property
+    def _bulk_retrieval(self):
+        return (
+            self.BULK_RETRIEVAL
+            and self.browser.product_version >= "5.9"
+            and self.paginator.exists
+        )
+
+    def entity_index(self):
+        """Returns the :py:class:`EntityIndex` of the entities on all the pages (5.9+)
+
+        The items are read with the maximum items per page, the items per page and the current
+        page are restored afterwards. The index isn't kept between calls, the entities depend on
+        the search, the filters and the selected tree node.
+        """
+        total = self.paginator.items_amount
+        per_page = self.paginator.items_per_page
+        cur_page = self.paginator.cur_page
+        bulk_per_page = max(per_page, min(total, self.MAX_ITEMS_PER_PAGE))
+        if bulk_per_page != per_page:
+            self.paginator.set_items_per_page(bulk_per_page)
+        try:
+            items = []
+            for _ in self.paginator.pages():
+                items.extend(entity["item"] for entity in self._invoke_cmd("get_all_items"))
+        finally:
+            if bulk_per_page != per_page:
+                self.paginator.set_items_per_page(per_page)
+            if self.paginator.cur_page != cur_page:
+                self.paginator.go_to_page(cur_page)
+
+        entities = []
+        by_name = {}
+        for position, item in enumerate(items):
+            name = self._item_name(item)
+            entities.append((name, item["id"], normalize_entity_data(item)))
+            by_name.setdefault(name, []).append(position)
+        return EntityIndex(per_page, entities, by_name)
+
+    def _indexed_positions(self, index, **keys):
+        """Positions of the entities of the index matching the keys, like
+        :py:meth:`get_entities_by_keys` matches them."""
+        if "entity_id" in keys:
+            entity_id = str(keys.pop("entity_id"))
+            positions = [
+                position
+                for position, (_, eid, _) in enumerate(index.entities)
+                if str(eid) == entity_id
+            ]
+        elif "name" in keys:
+            positions = index.by_name.get(keys.pop("name"), [])
+        else:
+            positions = range(len(index.entities))
+
+        exact = "id" in keys
+        matching = []
+        for position in positions:
+            data = index.entities[position][2]
+            for key, value in keys.items():
+                if key not in data:
+                    break
+                found, wanted = six.text_type(data[key]), six.text_type(value)
+                if exact and found != wanted or not exact and found.lower() != wanted.lower():
+                    break
+            else:
+                matching.append(position)
+        return matching
+
     @property
     def entity_ids(self):
         return [el["entity_id"] for el in self._current_page_elements]
@@ -2909,17 +3186,19 @@ class EntitiesConditionalView(View, ReportDataControllerMixin):
             elif "id" in keys:
                 # it turned out that there are some views which have entities with internal id
                 # which override entity id in JS code. this is workaround for such case
-                elements = self._current_page_elements
-                for el in elements:
-                    entity = self.parent.entity_class(parent=self, entity_id=el["entity_id"])
+                # the data of all the entities on the page are read at once
+                for entity in self._invoke_cmd("get_all_items"):
+                    data = normalize_entity_data(entity["item"])
                     for key, value in keys.items():
                         try:
-                            if entity.data[key] != str(value):
+                            if data[key] != str(value):
                                 break
                         except KeyError:
                             break
                     else:
-                        found_entities.append(entity)
+                        found_entities.append(
+                            self.parent.entity_class(parent=self, entity_id=entity["item"]["id"])
+                        )
             else:
                 entities = [
                     self.parent.entity_class(parent=self, entity_id=eid)
@@ -2946,6 +3225,11 @@ class EntitiesConditionalView(View, ReportDataControllerMixin):
                 self.parent.entity_class(parent=self, entity_id=el["entity_id"], name=el["name"])
                 for el in self._current_page_elements
             ]
+        elif self._bulk_retrieval:
+            return [
+                self.parent.entity_class(parent=self, entity_id=entity_id, name=name)
+                for name, entity_id, _ in self.entity_index().entities
+            ]
         else:
             entities = []
             for _ in self.paginator.pages():
@@ -2972,6 +3256,18 @@ class EntitiesConditionalView(View, ReportDataControllerMixin):
             self.search.clear_simple_search()
             self.search.simple_search(text=keys["name"])
 
+        if surf_pages and self._bulk_retrieval:
+            index = self.entity_index()
+            positions = self._indexed_positions(index, **keys)
+            if not positions:
+                raise ItemNotFound("Entity {keys} isn't found on any page".format(keys=keys))
+            # stop on the page of the entity
+            page = positions[0] // index.per_page + 1
+            if self.paginator.cur_page != page:
+                self.paginator.go_to_page(page)
+            name, entity_id, _ = index.entities[positions[0]]
+            return self.parent.entity_class(parent=self, entity_id=entity_id, name=name)
+
         for _ in self.paginator.pages():
             if len(keys) == 1 and "name" in keys:
                 entity_id = self.get_id_by_name(name=keys["name"])
@@ -3083,12 +3379,15 @@ class BaseEntitiesView(View):
                 for entity in entities:
                     elements.append(
                         {
-                            "name": entity["item"]["cells"].get("Name", None),
+                            "name": self._item_name(entity["item"]),
                             "entity_id": entity["item"]["id"],
                         }
                     )
             return elements
 
+        def _item_name(self, item):
+            return item["cells"].get("Name", None)
+
     @entities.register("Tile View")
     class TileView(EntitiesConditionalView):
         pass